@@ -1,14 +1,19 @@
+import os
 import ssl
+import atexit
 import logging
 import socket
 import time
 import asyncio
+import functools
+import multiprocessing
 import uvloop
 
 from collections import defaultdict
-from athanor.utils import import_from_module
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from athanor.utils import import_from_module, BoundedQueueHandler, LogWriter
 from logging.handlers import TimedRotatingFileHandler
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Any
 
 
 # Must ensure that UvLoop is installed early!
@@ -29,8 +34,14 @@ class BaseConfig:
         # the project.
         self.classes = defaultdict(dict)
 
-        # How often the main loop runs in sync mode.
+        # How often the main loop runs, in seconds. Ticks are due at fixed deadlines this far
+        # apart, however long each one takes.
         self.interval: float = 0.01
+        # What to do when ticks fall behind their deadlines. "catch_up" runs the missed ticks back
+        # to back, up to max_catch_up of them, and skips the rest. "skip" runs one tick and
+        # skips the rest; its delta covers the skipped time.
+        self.tick_policy: str = "catch_up"
+        self.max_catch_up: int = 5
 
         # A dict that maps names to IP Addresses/Interfaces used for networking.
         self.interfaces: Dict[str, str] = dict()
@@ -41,6 +52,12 @@ class BaseConfig:
 
         self.log_handlers = dict()
         self.logs = dict()
+        # Log records go through a queue to a background thread per log, which does the writing.
+        # This is how many records may wait before new ones are dropped. 0 writes them from the
+        # thread that logged them, as logging normally does.
+        self.log_queue_size: int = 10000
+        self.log_queue_handlers: Dict[str, BoundedQueueHandler] = dict()
+        self.log_listeners: Dict[str, LogWriter] = dict()
 
         # A dictionary that maps names to a re.compile() - compiled regex object.
         self.regex = dict()
@@ -48,6 +65,23 @@ class BaseConfig:
         # A dict with the information used for the local app-link.
         self.link = dict()
 
+        # Sizing for the executors Application.offload() hands work to.
+        self.offload = dict()
+
+        # Whether to keep metrics, and how to report them.
+        self.metrics = dict()
+
+        # Whether to record link traffic to disk, and where.
+        self.journal = dict()
+
+        # When the launcher runs several copies of an application (see LauncherConfig.workers),
+        # which one this is and how many there are. worker is None for a lone process.
+        worker = os.environ.get("ATHANOR_WORKER", None)
+        self.worker: Optional[int] = int(worker) if worker is not None else None
+        self.workers: int = int(os.environ.get("ATHANOR_WORKERS", 1))
+        # How many Portal processes the launcher started, so the Server knows what to link to.
+        self.portal_workers: int = int(os.environ.get("ATHANOR_PORTAL_WORKERS", 1))
+
     def setup(self):
         """
         Method that's called to initialize the configuration.
@@ -60,11 +94,112 @@ class BaseConfig:
         self._config_logs()
         self._config_regex()
         self._config_link()
+        self._config_offload()
+        self._config_metrics()
+        self._init_metrics()
+        self._config_journal()
+        self._init_journal()
 
     def _config_link(self):
         self.link = {
+            # How the Portal and Server talk. "websocket" uses interface and port. "unix" uses a
+            # Unix domain socket at path, which is much cheaper but needs both on the same host.
+            "transport": "websocket",
+            "interface": "localhost",
+            "port": 7998,
+            "path": "link.sock",
+            # Wire formats this process can speak, in order of preference. Agreed on at HELLO.
+            "codecs": ["compact", "json"],
+            # Most messages the outbox will hold before send() waits no matter what.
+            "outbox_size": 10000,
+            # Once the outbox holds high_water messages, send() applies the backpressure policy
+            # until the writer has drained it to low_water. The policy is "block" (wait) or
+            # "drop_gamedata" (discard the Server's GAMEDATA output, keep connects/disconnects/
+            # updates). Player input is never dropped. outbox_size also bounds the link's event
+            # queues, so whatever feeds them waits when the link falls behind.
+            "high_water": 5000,
+            "low_water": 1000,
+            "backpressure": "block",
+            # Limits on how many queued messages may be written as one batched frame.
+            "batch_count": 256,
+            "batch_bytes": 1024 * 1024,
+            # How many sent EVENTS messages to keep until the peer acknowledges them, so they can
+            # be replayed if the link drops, and how often (seconds) to acknowledge the peer's.
+            "replay_size": 10000,
+            "ack_interval": 0.1,
+            # A Portal's name. It prefixes that Portal's connection ids, so several Portals feeding
+            # one Server never hand out the same one.
+            "name": "portal",
+            # For the Server: the Portals to link to, as name -> overrides of the settings above,
+            # e.g. {"east": {"port": 7998}, "west": {"port": 7997}}. Empty means one Portal, using
+            # the settings above as they are.
+            "portals": dict(),
+            # For the Server: how long (seconds) a Portal's link may stay down before its
+            # connections are disconnected and output queued for it is thrown away. 0 waits forever.
+            "owner_timeout": 60.0,
+        }
+
+    def _config_offload(self):
+        self.offload = {
+            # Worker processes for CPU-heavy work. None means one per CPU. Started on first use.
+            "processes": None,
+            # How worker processes are started. "spawn" doesn't copy the running event loop.
+            "start_method": "spawn",
+            # Worker threads, for work that releases the GIL or blocks on I/O.
+            "threads": 4,
+            # Default seconds to wait for a result. None waits forever.
+            "timeout": 30.0,
+        }
+
+    def _config_metrics(self):
+        self.metrics = {
+            # Off, metrics cost next to nothing. On, hot paths record into app.metrics.
+            "enabled": False,
+            # Seconds between dumps of every metric to the application log. None never dumps.
+            "dump_interval": 60.0,
+            # Serves every metric as JSON over HTTP on this port of interface. None doesn't.
             "interface": "localhost",
-            "port": 7998
+            "port": None,
+        }
+
+    def _init_metrics(self):
+        if self.metrics.get("enabled", False):
+            self.classes["services"].setdefault("metrics", "athanor.metrics.MetricsService")
+
+    def _config_journal(self):
+        self.journal = {
+            # Records every link frame sent and received, so sessions can be replayed.
+            "enabled": False,
+            # Directory for segment files, and how big each may get before the next is started.
+            "path": "journal",
+            "segment_size": 64 * 1024 * 1024,
+            # Seconds between writes, and most frames that may wait for one before new frames
+            # are dropped.
+            "flush_interval": 0.5,
+            "max_pending": 100000,
+        }
+
+    def _init_journal(self):
+        if self.journal.get("enabled", False):
+            self.classes["services"].setdefault("journal", "athanor.journal.JournalService")
+
+    def worker_link(self, worker: int) -> Dict[str, Any]:
+        """
+        The link settings Portal worker number <worker> uses on top of config.link, so that each
+        worker gets a link of its own. Websocket links count down from the configured port, to
+        stay clear of the telnet port just above it.
+
+        Args:
+            worker (int): The worker's number, from 0.
+
+        Returns:
+            overrides (dict): name, port and path for that worker's link.
+        """
+        root, ext = os.path.splitext(self.link.get("path", "link.sock"))
+        return {
+            "name": f"{self.link.get('name', 'portal')}{worker}",
+            "port": int(self.link["port"]) - worker,
+            "path": f"{root}-{worker}{ext}",
         }
 
     def _config_classes(self):
@@ -114,8 +249,38 @@ class BaseConfig:
     def _config_logs(self):
         for name in ('application', 'server', 'client'):
             log = logging.getLogger(name)
-            log.addHandler(self.log_handlers[name])
+            log.addHandler(self.log_queue_handler(name, self.log_handlers[name]))
             self.logs[name] = log
+        if self.log_listeners:
+            atexit.register(self.stop_log_listeners)
+
+    def log_queue_handler(self, name: str, handler: logging.Handler) -> logging.Handler:
+        """
+        Wraps a log handler so that it runs on a background thread, fed by a bounded queue. The
+        handler itself is returned if log_queue_size is 0.
+        """
+        if not self.log_queue_size:
+            return handler
+        queue_handler = BoundedQueueHandler(self.log_queue_size)
+        listener = LogWriter(queue_handler.queue, handler, respect_handler_level=True)
+        listener.start()
+        self.log_queue_handlers[name] = queue_handler
+        self.log_listeners[name] = listener
+        return queue_handler
+
+    def log_drops(self) -> int:
+        """
+        How many log records have been thrown away because a writer fell behind.
+        """
+        return sum(handler.dropped for handler in self.log_queue_handlers.values())
+
+    def stop_log_listeners(self):
+        """
+        Writes out whatever's still queued and stops the writer threads.
+        """
+        for listener in self.log_listeners.values():
+            listener.stop()
+        self.log_listeners.clear()
 
     def _config_regex(self):
         """
@@ -123,6 +288,39 @@ class BaseConfig:
         """
 
 
+class Timing:
+    """
+    Running statistics on how long something takes, in seconds. If given a metrics Histogram,
+    every recording goes into that too.
+    """
+
+    __slots__ = ["name", "count", "total", "max", "last", "histogram"]
+
+    def __init__(self, name: str, histogram=None):
+        self.name = name
+        self.histogram = histogram
+        self.count: int = 0
+        self.total: float = 0.0
+        self.max: float = 0.0
+        self.last: float = 0.0
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.name}: {self.count} avg {self.mean * 1000:.3f}ms max {self.max * 1000:.3f}ms>"
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def record(self, elapsed: float):
+        self.count += 1
+        self.total += elapsed
+        self.last = elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        if self.histogram is not None:
+            self.histogram.record(elapsed)
+
+
 class LauncherConfig:
     """
     The config object used by the launcher.
@@ -133,6 +331,11 @@ class LauncherConfig:
         # in the <template>/appdata/ folder, like portal.py
         self.applications: List[str] = ["portal", "server"]
 
+        # How many processes to start for each application. Portal workers bind the same
+        # listeners with SO_REUSEPORT, so the kernel spreads new connections across them, and
+        # each links to the Server on its own.
+        self.workers: Dict[str, int] = {"portal": 1}
+
     def setup(self):
         """
         By default, does nothing...
@@ -150,6 +353,16 @@ class Application:
     def __init__(self, config: BaseConfig):
         self.config: BaseConfig = config
 
+        # Counters, gauges and histograms, if config.metrics["enabled"]. Otherwise None, and
+        # everything that would have recorded into it skips doing so.
+        self.metrics = None
+        if self.config.metrics.get("enabled", False):
+            from athanor.metrics import Metrics
+            self.metrics = Metrics()
+
+        # The JournalService, if config.journal["enabled"]. It sets this itself.
+        self.journal = None
+
         # This will be a Dict[str, Dict[str, class]] once setup finishes loading.
         self.classes = defaultdict(dict)
 
@@ -159,6 +372,15 @@ class Application:
         # This is a list of services which subscribed to the update loop.
         self.services_update: List[Service] = list()
 
+        # Which services' update() is due on which tick: tick number -> services, in
+        # update_order. Each service is rescheduled every update_ticks[name] ticks.
+        self.update_wheel: Dict[int, List[Service]] = defaultdict(list)
+        self.update_ticks: Dict[str, int] = dict()
+        # The tick each service last updated on, to work out its delta, and the last tick the
+        # wheel was turned to.
+        self.last_updates: Dict[str, int] = dict()
+        self.wheel_tick: int = 0
+
         # Used to show whether the application's currently running. Is this even used?
         self.running: bool = True
 
@@ -168,6 +390,29 @@ class Application:
         # Starting delta for the main loop.
         self.delta = self.interval
 
+        # Fixed-timestep bookkeeping. tick counts intervals since start, skipped ones included,
+        # and deadline is the monotonic time the next one is due.
+        self.tick_policy: str = self.config.tick_policy
+        if self.tick_policy not in ("catch_up", "skip"):
+            raise ValueError(f"Unknown tick policy: {self.tick_policy}")
+        self.max_catch_up: int = max(1, self.config.max_catch_up)
+        self.tick: int = 0
+        self.deadline: float = 0.0
+        # How many times the loop fell behind, and how many ticks it skipped as a result.
+        self.tick_overruns: int = 0
+        self.ticks_skipped: int = 0
+        self.pending_skipped: int = 0
+        # How long ticks take, and each Service's update() within them, by Service name.
+        self.tick_timing = Timing("tick", self.metrics.histogram("tick") if self.metrics else None)
+        self.update_timings: Dict[str, Timing] = dict()
+        if self.metrics:
+            self.metrics.gauge("tick.overruns", lambda: self.tick_overruns)
+            self.metrics.gauge("tick.skipped", lambda: self.ticks_skipped)
+            self.metrics.gauge("log.dropped", self.config.log_drops)
+
+        # Executors for offload(), by kind. Created when first needed.
+        self.executors: Dict[str, Executor] = dict()
+
     def setup(self):
         """
         Method called by launcher to initialize the Application.
@@ -183,9 +428,24 @@ class Application:
                     found_classes.append(found)
 
         for name, v in sorted(self.classes['services'].items(), key=lambda x: getattr(x[1], 'init_order', 0)):
-            self.services[name] = v(self)
-
-        self.services_update = sorted(self.services.values(), key=lambda x: getattr(x, 'update_order', 0))
+            service = v(self)
+            if not service.name:
+                service.name = name
+            self.services[name] = service
+            self.update_timings[service.name] = Timing(service.name)
+
+        # Services that don't override update() have nothing to do on a tick.
+        self.services_update = sorted(
+            [s for s in self.services.values() if type(s).update is not Service.update],
+            key=lambda x: getattr(x, 'update_order', 0)
+        )
+        for service in self.services_update:
+            interval = service.update_interval or self.interval
+            self.update_ticks[service.name] = max(1, round(interval / self.interval))
+            self.last_updates[service.name] = 0
+            if self.metrics:
+                self.update_timings[service.name].histogram = self.metrics.histogram(f"update.{service.name}")
+            self.update_wheel[1].append(service)
 
         for service in sorted(self.services.values(), key=lambda s: getattr(s, 'load_order', 0)):
             service.setup()
@@ -213,7 +473,59 @@ class Application:
 
     def start_async(self):
         self.running = True
-        asyncio.run(self.async_enter(), debug=True)
+        try:
+            asyncio.run(self.async_enter(), debug=True)
+        finally:
+            self.shutdown_executors()
+
+    def get_executor(self, kind: str = "process") -> Executor:
+        """
+        Returns the executor for a kind of offloaded work, starting it if need be.
+
+        Args:
+            kind (str): "process" for CPU-heavy work, "thread" for work that releases the GIL.
+        """
+        if (executor := self.executors.get(kind, None)):
+            return executor
+        conf = self.config.offload
+        if kind == "process":
+            context = multiprocessing.get_context(conf.get("start_method", "spawn"))
+            executor = ProcessPoolExecutor(max_workers=conf.get("processes", None), mp_context=context)
+        elif kind == "thread":
+            executor = ThreadPoolExecutor(max_workers=conf.get("threads", 4), thread_name_prefix="offload")
+        else:
+            raise ValueError(f"Unknown kind of offload executor: {kind}")
+        self.executors[kind] = executor
+        return executor
+
+    async def offload(self, func, *args, kind: str = "process", timeout: Optional[float] = -1, **kwargs):
+        """
+        Runs func(*args, **kwargs) outside the event loop and returns what it returns. For
+        processes, func, its arguments and its result must all be picklable, so func needs to be
+        a module-level function.
+
+        Args:
+            func (callable): What to run.
+            kind (str): "process" or "thread". See get_executor().
+            timeout (float): Seconds to wait before raising asyncio.TimeoutError. Defaults to
+                config.offload["timeout"]; None waits forever. Work that's already started keeps
+                its worker busy until it finishes, timeout or not.
+
+        Raises:
+            Whatever func raises.
+        """
+        if timeout == -1:
+            timeout = self.config.offload.get("timeout", None)
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.get_executor(kind), functools.partial(func, *args, **kwargs))
+        if timeout is None:
+            return await future
+        return await asyncio.wait_for(future, timeout)
+
+    def shutdown_executors(self):
+        for executor in self.executors.values():
+            executor.shutdown(wait=False)
+        self.executors.clear()
 
     async def async_main_task(self):
         """
@@ -224,49 +536,102 @@ class Application:
 
     async def async_run_loop(self):
         """
-        Asynchronous version of the main loop. Does the same thing but uses asyncio to time its calls.
+        Asynchronous version of the main loop. Runs ticks at fixed deadlines, by the event loop's
+        monotonic clock, sleeping in between.
         """
+        loop = asyncio.get_running_loop()
+        self.deadline = loop.time()
         while self.running:
-            self.run_time_loop()
-
-            if self.interval > self.delta:
-                await asyncio.sleep(self.interval - self.delta)
-            else:
-                await asyncio.sleep(0)
+            due = self.ticks_due(loop.time())
+            for i in range(due):
+                if i:
+                    # Let I/O in between catch-up ticks.
+                    await asyncio.sleep(0)
+                self.run_tick()
+            await asyncio.sleep(max(0.0, self.deadline - loop.time()))
 
     def start(self):
         """
         The synchronous start point for the program, called by startup.
         """
         self.running = True
+        self.deadline = time.monotonic()
 
         while self.running:
             self.run_loop()
 
-    def run_time_loop(self):
-        now = time.time()
-        self.run_loop_once(now, self.delta)
-        self.delta = time.time() - now
+    def ticks_due(self, now: float) -> int:
+        """
+        Works out how many ticks should run now, applying the tick policy if we've fallen
+        behind, and moves the deadline past any that are skipped.
 
-    def run_loop(self):
-        self.run_time_loop()
+        Args:
+            now (float): The current monotonic time.
+
+        Returns:
+            due (int): How many ticks to run back to back.
+        """
+        if now < self.deadline:
+            return 0
+        due = int((now - self.deadline) // self.interval) + 1
+        if due > 1:
+            self.tick_overruns += 1
+            allowed = 1 if self.tick_policy == "skip" else self.max_catch_up
+            if due > allowed:
+                skipped = due - allowed
+                self.ticks_skipped += skipped
+                self.pending_skipped += skipped
+                self.deadline += skipped * self.interval
+                due = allowed
+        return due
+
+    def run_tick(self):
+        """
+        Runs one tick and moves the deadline to the next. delta is the fixed interval, plus any
+        skipped ticks' worth.
+        """
+        self.tick += 1 + self.pending_skipped
+        self.delta = self.interval * (1 + self.pending_skipped)
+        self.pending_skipped = 0
+        self.deadline += self.interval
+        started = time.perf_counter()
+        self.run_loop_once(time.time(), self.delta)
+        self.tick_timing.record(time.perf_counter() - started)
 
-        if self.interval > self.delta:
-            time.sleep(self.interval - self.delta)
-        else:
-            time.sleep(0)
+    def run_loop(self):
+        for i in range(self.ticks_due(time.monotonic())):
+            self.run_tick()
+        time.sleep(max(0.0, self.deadline - time.monotonic()))
 
     def run_loop_once(self, now: float, delta: float):
         """
-        Called by either the async run loop, or the sync one. Does the heavy lifting of updating services.
+        Called by either the async run loop, or the sync one. Does the heavy lifting of updating
+        services: those whose update() is due this tick, according to the update wheel. Each gets
+        the time since its own last update as its delta.
 
         Args:
             now (float): The time.time() of this update.
-            delta (float): Time since last update.
+            delta (float): Time this tick covers: the interval, or more if ticks were skipped.
         """
         self.before_update(now, delta)
-        for s in self.services_update:
-            s.update(now, delta)
+        wheel = self.update_wheel
+        tick = self.tick
+        # Ticks that were skipped may have had services due.
+        due = list()
+        for t in range(self.wheel_tick + 1, tick + 1):
+            if (services := wheel.pop(t, None)):
+                due.extend(services)
+        self.wheel_tick = tick
+        if len(due) > 1:
+            due.sort(key=lambda x: getattr(x, 'update_order', 0))
+        timings = self.update_timings
+        for s in due:
+            name = s.name
+            started = time.perf_counter()
+            s.update(now, (tick - self.last_updates[name]) * self.interval)
+            timings[name].record(time.perf_counter() - started)
+            self.last_updates[name] = tick
+            wheel[tick + self.update_ticks[name]].append(s)
         self.after_update(now, delta)
 
     def before_update(self, now: float, delta: float):
@@ -296,6 +661,9 @@ class Service:
     init_order = 0
     setup_order = 0
     update_order = 0
+    # Seconds between calls to update(), rounded to a whole number of the Application's ticks.
+    # None means every tick. Services that don't override update() are never called.
+    update_interval: Optional[float] = None
 
     def __init__(self, app: Application):
         self.app = app
@@ -319,12 +687,18 @@ class Service:
 
     def update(self, now: float, delta: float):
         """
-        Called by Application every time the main loop runs once.
+        Called by Application every update_interval, or every time the main loop runs once.
 
         Args:
             now (float): The current time.time()
-            delta (float): The time since the last update.
+            delta (float): The time since this Service's last update.
+        """
+
+    async def offload(self, func, *args, **kwargs):
+        """
+        Runs func(*args, **kwargs) outside the event loop. See Application.offload().
         """
+        return await self.app.offload(func, *args, **kwargs)
 
     async def async_run(self):
         """
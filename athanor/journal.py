@@ -0,0 +1,229 @@
+import os
+import sys
+import atexit
+import time
+import struct
+import threading
+import traceback
+
+from collections import deque
+from typing import Iterator, List, Optional, Tuple
+
+from athanor.app import Service
+from athanor.shared import decode_frame, ServerInMessage, PortalOutMessage, EVENTS
+from athanor.shared import JOURNAL_TO_SERVER, JOURNAL_TO_PORTAL
+
+# Every segment file starts with this, and the format version after it.
+MAGIC = b"ATHJ"
+VERSION = 1
+_FILE_HEADER = MAGIC + bytes([VERSION])
+# Each record is its length (of everything after the length), then the time.time() it was
+# recorded at and its kind, then the link frame itself.
+_LENGTH = struct.Struct("<I")
+_RECORD = struct.Struct("<IdB")
+_RECORD_HEADER = _RECORD.size - _LENGTH.size
+
+# Which message class the frames of each kind of record decode to.
+KIND_CLASSES = {JOURNAL_TO_SERVER: ServerInMessage, JOURNAL_TO_PORTAL: PortalOutMessage}
+
+
+class JournalService(Service):
+    """
+    Records the link traffic between Portal and Server - every ConnectionInMessage and
+    ConnectionOutMessage, batched as they cross - to rotating segment files, for replaying
+    real sessions later. Frames are journaled exactly as they were sent or received, so
+    recording costs the event loop one append per frame. A background thread adds timestamps
+    and headers and does the writing.
+
+    Configured by config.journal. Only installed when that's enabled. Read the segments back
+    with read_segment(), read_frames() or read_events().
+    """
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.app.journal = self
+        self.path: str = "journal"
+        self.segment_size: int = 64 * 1024 * 1024
+        self.flush_interval: float = 0.5
+        self.max_pending: int = 100000
+        # Filled by the event loop, drained by the writer. Appending to a deque is thread-safe.
+        self.pending = deque()
+        # Records thrown away because the writer fell more than max_pending behind.
+        self.dropped: int = 0
+        self.written: int = 0
+        self.segment: Optional[str] = None
+        self.segment_count: int = 0
+        self.file = None
+        self.file_size: int = 0
+        self.running: bool = False
+        self.thread: Optional[threading.Thread] = None
+        self.wake = threading.Event()
+
+    def setup(self):
+        conf = self.app.config.journal
+        self.path = conf.get("path", "journal")
+        self.segment_size = int(conf.get("segment_size", 64 * 1024 * 1024))
+        self.flush_interval = float(conf.get("flush_interval", 0.5))
+        self.max_pending = int(conf.get("max_pending", 100000))
+        os.makedirs(self.path, exist_ok=True)
+        atexit.register(self.stop)
+        if (metrics := self.app.metrics):
+            metrics.gauge("journal.pending", lambda: len(self.pending))
+            metrics.gauge("journal.dropped", lambda: self.dropped)
+        self.start()
+
+    def record(self, kind: int, frame: bytes):
+        """
+        Queues a link frame for the journal. Called from the event loop.
+
+        Args:
+            kind (int): JOURNAL_TO_SERVER or JOURNAL_TO_PORTAL.
+            frame (bytes): The frame, as it went over the link.
+        """
+        if len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self.pending.append((time.time(), kind, frame))
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self.run, name="journal", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """
+        Writes out everything pending and closes the current segment.
+        """
+        if self.running:
+            self.running = False
+            self.wake.set()
+            self.thread.join()
+
+    def run(self):
+        while self.running:
+            self.wake.wait(self.flush_interval)
+            try:
+                self.write_pending()
+            except Exception:
+                traceback.print_exc(file=sys.stdout)
+        self.write_pending()
+        self.close_segment()
+
+    def write_pending(self):
+        pending = self.pending
+        if not pending:
+            return
+        pack = _RECORD.pack
+        chunks = list()
+        size = 0
+        while pending:
+            timestamp, kind, frame = pending.popleft()
+            chunks.append(pack(len(frame) + _RECORD_HEADER, timestamp, kind))
+            chunks.append(frame)
+            size += _RECORD.size + len(frame)
+            if self.file_size + size >= self.segment_size:
+                self.write(chunks, size)
+                self.close_segment()
+                chunks, size = list(), 0
+        if chunks:
+            self.write(chunks, size)
+        if self.file:
+            self.file.flush()
+
+    def write(self, chunks: List[bytes], size: int):
+        if not self.file:
+            self.open_segment()
+        self.file.write(b"".join(chunks))
+        self.file_size += size
+        self.written += len(chunks) // 2
+
+    def open_segment(self):
+        self.segment_count += 1
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        name = f"{self.app.config.name}-{os.getpid()}-{stamp}-{self.segment_count:04d}.journal"
+        self.segment = os.path.join(self.path, name)
+        self.file = open(self.segment, "wb")
+        self.file.write(_FILE_HEADER)
+        self.file_size = len(_FILE_HEADER)
+
+    def close_segment(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+            self.file_size = 0
+
+
+def _segment_order(name: str) -> Tuple[str, int, str]:
+    """
+    Sort key for a segment file name, as made by JournalService.open_segment(): when it was
+    opened, then the process's segment count for segments opened in the same second. Unlike
+    mtime, this survives the files being copied elsewhere.
+    """
+    parts = name[:-len(".journal")].rsplit("-", 4)
+    if len(parts) != 5 or not parts[4].isdigit():
+        return "", 0, name
+    return f"{parts[2]}-{parts[3]}", int(parts[4]), name
+
+
+def list_segments(path: str = "journal") -> List[str]:
+    """
+    Returns the segment files in a journal directory, oldest first, going by their names.
+    """
+    names = [n for n in os.listdir(path) if n.endswith(".journal")]
+    return [os.path.join(path, n) for n in sorted(names, key=_segment_order)]
+
+
+def read_segment(path: str) -> Iterator[Tuple[float, int, bytes]]:
+    """
+    Streams the records of a segment file, one at a time, without loading the file. A record
+    cut short by a crash ends the stream.
+
+    Yields:
+        record (tuple): The time it was recorded, its kind, and the raw link frame.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(_FILE_HEADER)) != _FILE_HEADER:
+            raise ValueError(f"Not a version {VERSION} journal segment: {path}")
+        read = f.read
+        unpack = _RECORD.unpack
+        while True:
+            header = read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return
+            length, timestamp, kind = unpack(header)
+            frame = read(length - _RECORD_HEADER)
+            if len(frame) < length - _RECORD_HEADER:
+                return
+            yield timestamp, kind, frame
+
+
+def read_frames(path: str) -> Iterator[Tuple[float, int, list]]:
+    """
+    Like read_segment(), but with each frame decoded into its link messages.
+    """
+    for timestamp, kind, frame in read_segment(path):
+        yield timestamp, kind, decode_frame(frame, KIND_CLASSES[kind])
+
+
+def read_events(path: str) -> Iterator[Tuple[float, object]]:
+    """
+    Streams just the connection events of a segment, in order: ConnectionInMessages on their
+    way to the Server and ConnectionOutMessages on their way to clients. Events replayed after
+    a link drop are skipped, as the receiving end would skip them.
+
+    Yields:
+        event (tuple): The time its frame was recorded, and the event.
+    """
+    last_seq = dict()
+    for timestamp, kind, messages in read_frames(path):
+        for msg in messages:
+            if msg.msg_type != EVENTS or not msg.data:
+                continue
+            if msg.seq:
+                key = (kind, msg.process_id)
+                if msg.seq <= last_seq.get(key, 0):
+                    continue
+                last_seq[key] = msg.seq
+            for ev in msg.data:
+                yield timestamp, ev
@@ -33,6 +33,7 @@ class AthanorLauncher:
             "_passthru": self.operation_passthru,
         }
         self.profile_path = None
+        self.workers = dict()
 
     def create_parser(self):
         """
@@ -109,32 +110,55 @@ class AthanorLauncher:
             raise ValueError(f"Current directory is not a valid {self.name} profile!")
         self.profile_path = cur_dir
 
+    def processes(self, app):
+        """
+        The names of the processes an app runs as. These are also their pidfile names.
+
+        Args:
+            app (str): The name of the application.
+
+        Returns:
+            names (list): Just the app's name, or <app>-<n> for each of several workers.
+        """
+        count = self.workers.get(app, 1)
+        if count > 1:
+            return [f"{app}-{i}" for i in range(count)]
+        return [app]
+
     def operation_start(self, op, args, unknown):
         for app in self.applications:
-            if not self.ensure_stopped(app):
-                raise ValueError(f"Process {app} is already running!")
+            for proc in self.processes(app):
+                if not self.ensure_stopped(proc):
+                    raise ValueError(f"Process {proc} is already running!")
         for app in self.applications:
-            env = os.environ.copy()
-            env["ATHANOR_PROFILE"] = self.profile_path
-            env["ATHANOR_APPNAME"] = app
-            cmd = f"{sys.executable} {self.startup}"
-            subprocess.Popen(shlex.split(cmd), env=env)
+            count = self.workers.get(app, 1)
+            for i in range(count):
+                env = os.environ.copy()
+                env["ATHANOR_PROFILE"] = self.profile_path
+                env["ATHANOR_APPNAME"] = app
+                env["ATHANOR_PORTAL_WORKERS"] = str(self.workers.get("portal", 1))
+                if count > 1:
+                    env["ATHANOR_WORKER"] = str(i)
+                    env["ATHANOR_WORKERS"] = str(count)
+                cmd = f"{sys.executable} {self.startup}"
+                subprocess.Popen(shlex.split(cmd), env=env)
 
     def operation_noop(self, op, args, unknown):
         pass
 
     def operation_stop(self, op, args, unknown):
-        for app in self.applications:
-            if not self.ensure_running(app):
-                raise ValueError(f"Process {app} is not running.")
-        for app in self.applications:
-            pidfile = os.path.join(os.getcwd(), f"{app}.pid")
+        procs = [proc for app in self.applications for proc in self.processes(app)]
+        for proc in procs:
+            if not self.ensure_running(proc):
+                raise ValueError(f"Process {proc} is not running.")
+        for proc in procs:
+            pidfile = os.path.join(os.getcwd(), f"{proc}.pid")
             with open(pidfile, "r") as p:
                 if not (pid := int(p.read())):
-                    raise ValueError(f"Process pid for {app} corrupted.")
+                    raise ValueError(f"Process pid for {proc} corrupted.")
             os.kill(pid, signal.SIGTERM)
             os.remove(pidfile)
-            print(f"Stopped process {pid} - {app}")
+            print(f"Stopped process {pid} - {proc}")
 
     def operation_passthru(self, op, args, unknown):
         """
@@ -185,6 +209,7 @@ class AthanorLauncher:
 
                 l_config = Launcher()
                 l_config.setup()
+                self.workers = getattr(l_config, "workers", dict())
 
                 # choose either all apps or a specific app to focus on.
                 if args.app:
@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import time
+import orjson
+
+from typing import Any, Callable, Dict, Optional
+from athanor.app import Service
+
+
+class MetricCounter:
+    """
+    A number that only goes up: events sent, bytes read, lines dropped.
+    """
+
+    __slots__ = ["name", "value"]
+
+    def __init__(self, name: str):
+        self.name = name
+        self.value: int = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+
+class Gauge:
+    """
+    A number that goes up and down: queue depths, connection counts. Either set() it, or give it
+    a function to read the value from when a snapshot is taken, which costs nothing until then.
+    """
+
+    __slots__ = ["name", "value", "func"]
+
+    def __init__(self, name: str, func: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.value: float = 0
+        self.func = func
+
+    def set(self, value: float):
+        self.value = value
+
+    def read(self) -> float:
+        return self.func() if self.func else self.value
+
+
+class Histogram:
+    """
+    A log-linear histogram of durations, in the style of HdrHistogram. Values are kept in whole
+    microseconds; below 2**sub_bits they're exact, and above that each power of two is split into
+    2**sub_bits buckets, so any value read back is within 1 / 2**sub_bits of what was recorded
+    (about 6% with the default of 4) however large it gets.
+    """
+
+    __slots__ = ["name", "sub_bits", "sub_count", "counts", "count", "total", "max"]
+
+    def __init__(self, name: str, sub_bits: int = 4):
+        self.name = name
+        self.sub_bits = sub_bits
+        self.sub_count = 1 << sub_bits
+        self.counts: Dict[int, int] = dict()
+        self.count: int = 0
+        self.total: float = 0.0
+        self.max: float = 0.0
+
+    def bucket(self, micros: int) -> int:
+        if micros < self.sub_count:
+            return micros
+        shift = micros.bit_length() - self.sub_bits - 1
+        return (shift + 1) * self.sub_count + (micros >> shift) - self.sub_count
+
+    def bucket_high(self, bucket: int) -> int:
+        """
+        The largest value, in microseconds, that lands in a bucket.
+        """
+        if bucket < self.sub_count:
+            return bucket
+        shift = bucket // self.sub_count - 1
+        mantissa = bucket % self.sub_count + self.sub_count
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, seconds: float):
+        bucket = self.bucket(int(seconds * 1000000))
+        counts = self.counts
+        counts[bucket] = counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent: float) -> float:
+        """
+        Returns the value, in seconds, that percent of recordings were at or below.
+        """
+        if not self.count:
+            return 0.0
+        wanted = max(1, round(self.count * percent / 100))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= wanted:
+                return min(self.bucket_high(bucket) / 1000000, self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+    def reset(self):
+        self.counts.clear()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+class Metrics:
+    """
+    Every metric an Application keeps, by name. Asking for one that doesn't exist yet creates it.
+
+    The Application only has one of these (app.metrics) when config.metrics["enabled"] is set;
+    otherwise app.metrics is None. Code on hot paths should fetch its metrics once, keep them,
+    and check for None, so that when metrics are off they cost a single test.
+    """
+
+    def __init__(self):
+        self.counters: Dict[str, MetricCounter] = dict()
+        self.gauges: Dict[str, Gauge] = dict()
+        self.histograms: Dict[str, Histogram] = dict()
+
+    def counter(self, name: str) -> MetricCounter:
+        if (found := self.counters.get(name, None)) is None:
+            found = self.counters[name] = MetricCounter(name)
+        return found
+
+    def gauge(self, name: str, func: Optional[Callable[[], float]] = None) -> Gauge:
+        if (found := self.gauges.get(name, None)) is None:
+            found = self.gauges[name] = Gauge(name, func)
+        elif func:
+            found.func = func
+        return found
+
+    def histogram(self, name: str) -> Histogram:
+        if (found := self.histograms.get(name, None)) is None:
+            found = self.histograms[name] = Histogram(name)
+        return found
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "counters": {name: c.value for name, c in sorted(self.counters.items())},
+            "gauges": {name: g.read() for name, g in sorted(self.gauges.items())},
+            "histograms": {name: h.summary() for name, h in sorted(self.histograms.items())},
+        }
+
+
+class MetricsService(Service):
+    """
+    Reports the Application's metrics: as a log dump every config.metrics["dump_interval"]
+    seconds, and as JSON to anything that connects to config.metrics["port"], if set. Any HTTP
+    client will do:
+
+        curl http://localhost:<port>/
+
+    Only installed when metrics are enabled.
+    """
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.log = logging.getLogger("application.metrics")
+        self.last_dump: float = time.monotonic()
+        self.last_counters: Dict[str, int] = dict()
+        self.server: Optional[asyncio.AbstractServer] = None
+        # Seconds between log dumps. With none, update() only comes round once an hour.
+        self.dump_interval: Optional[float] = app.config.metrics.get("dump_interval", None) or None
+        self.update_interval = self.dump_interval or 3600.0
+
+    def setup(self):
+        self.log.setLevel(logging.INFO)
+
+    async def async_setup(self):
+        conf = self.app.config.metrics
+        if (port := conf.get("port", None)) is not None:
+            host = self.app.config.interfaces.get(conf.get("interface", "localhost"), "localhost")
+            self.server = await asyncio.start_server(self.serve, host, port)
+
+    def report(self) -> Dict[str, Any]:
+        """
+        A snapshot of every metric, plus how fast each counter has gone up since the last dump.
+        """
+        snapshot = self.app.metrics.snapshot()
+        now = time.monotonic()
+        elapsed = now - self.last_dump
+        counters = snapshot["counters"]
+        if elapsed > 0:
+            snapshot["rates"] = {name: (value - self.last_counters.get(name, 0)) / elapsed
+                                 for name, value in counters.items()}
+        return snapshot
+
+    def update(self, now: float, delta: float):
+        if self.dump_interval:
+            self.dump()
+
+    def dump(self):
+        report = self.report()
+        self.last_dump = time.monotonic()
+        self.last_counters = dict(report["counters"])
+        lines = [f"metrics for {self.app.config.name}:"]
+        rates = report.get("rates", dict())
+        for name, value in report["counters"].items():
+            lines.append(f"  {name} {value} ({rates.get(name, 0.0):.1f}/s)")
+        for name, value in report["gauges"].items():
+            lines.append(f"  {name} {value}")
+        for name, h in report["histograms"].items():
+            if h["count"]:
+                lines.append(f"  {name} n={h['count']} mean={h['mean'] * 1000:.3f}ms "
+                             f"p50={h['p50'] * 1000:.3f}ms p90={h['p90'] * 1000:.3f}ms "
+                             f"p99={h['p99'] * 1000:.3f}ms max={h['max'] * 1000:.3f}ms")
+        self.log.info("\n".join(lines))
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # Whatever was asked for, the answer is the same.
+            await asyncio.wait_for(reader.readline(), 5.0)
+            body = orjson.dumps(self.report())
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: application/json\r\n"
+                         b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -1,11 +1,16 @@
+import os
+import sys
 import time
+import typing
 import orjson
 import asyncio
 import websockets
 
-from typing import Optional
+from collections import deque
+from typing import Optional, Dict, Callable, Any, List, Tuple
 from enum import IntEnum
-from dataclasses import dataclass
+from operator import attrgetter
+from dataclasses import dataclass, fields
 from dataclasses_json import dataclass_json
 from websockets.exceptions import ConnectionClosedError, ConnectionClosed, ConnectionClosedOK
 
@@ -44,41 +49,195 @@ COLOR_MAP = {
 }
 
 
-@dataclass_json
-@dataclass
+# The boolean capabilities of a ConnectionDetails. Each is one bit of ConnectionDetails.flags, in
+# this order. Only ever append to this, or old and new processes will disagree about the bits.
+DETAILS_FLAGS = (
+    "utf8",
+    "screen_reader",
+    "proxy",
+    "osc_color_palette",
+    "vt100",
+    "mouse_tracking",
+    "naws",
+    "mccp2",
+    "mccp2_active",
+    "mccp3",
+    "mccp3_active",
+    "mtts",
+    "ttype",
+    "mnes",
+    "suppress_ga",
+    "force_endline",
+    "linemode",
+    "mssp",
+    "mxp",
+    "mxp_active",
+    "oob",
+)
+
+DETAILS_FLAG_BITS = {name: 1 << i for i, name in enumerate(DETAILS_FLAGS)}
+
+# Every field of a ConnectionDetails, in the order to_dict() has always used.
+DETAILS_FIELDS = (
+    "protocol",
+    "client_id",
+    "client_name",
+    "client_version",
+    "host_address",
+    "host_name",
+    "host_port",
+    "connected",
+    "utf8",
+    "color",
+    "screen_reader",
+    "proxy",
+    "osc_color_palette",
+    "vt100",
+    "mouse_tracking",
+    "naws",
+    "width",
+    "height",
+    "mccp2",
+    "mccp2_active",
+    "mccp3",
+    "mccp3_active",
+    "mtts",
+    "ttype",
+    "mnes",
+    "suppress_ga",
+    "force_endline",
+    "linemode",
+    "mssp",
+    "mxp",
+    "mxp_active",
+    "oob",
+)
+
+_DETAILS_SLOTS = ("protocol", "client_id", "client_name", "client_version", "host_address", "host_name",
+                  "host_port", "connected", "color", "width", "height", "flags")
+
+_details_getter = attrgetter(*_DETAILS_SLOTS)
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _flag_property(name: str) -> property:
+    bit = DETAILS_FLAG_BITS[name]
+
+    def fget(self) -> bool:
+        return bool(self.flags & bit)
+
+    def fset(self, value):
+        if value:
+            self.flags |= bit
+        else:
+            self.flags &= ~bit
+
+    return property(fget, fset, doc=f"Whether the client supports/has enabled {name}.")
+
+
 class ConnectionDetails:
-    protocol: MudProtocol = 0
-    client_id: str = UNKNOWN
-    client_name: str = UNKNOWN
-    client_version: str = UNKNOWN
-    host_address: str = UNKNOWN
-    host_name: str = UNKNOWN
-    host_port: int = 0
-    connected: float = time.time()
-    utf8: bool = False
-    color: Optional[ColorSystem] = None
-    screen_reader: bool = False
-    proxy: bool = False
-    osc_color_palette: bool = False
-    vt100: bool = False
-    mouse_tracking: bool = False
-    naws: bool = False
-    width: int = 78
-    height: int = 24
-    mccp2: bool = False
-    mccp2_active: bool = False
-    mccp3: bool = False
-    mccp3_active: bool = False
-    mtts: bool = False
-    ttype: bool = False
-    mnes: bool = False
-    suppress_ga: bool = False
-    force_endline: bool = False
-    linemode: bool = False
-    mssp: bool = False
-    mxp: bool = False
-    mxp_active: bool = False
-    oob: bool = False
+    """
+    Everything the Portal knows about a client, shipped to the Server on READY and HELLO.
+
+    There's one of these per connection in both processes, so it's kept small: it has no
+    __dict__, the boolean capabilities named in DETAILS_FLAGS live as bits of a single int
+    (self.flags) behind properties, and the strings most often repeated between clients are
+    interned.
+    """
+    __slots__ = _DETAILS_SLOTS
+
+    def __init__(self, protocol: MudProtocol = MudProtocol.TELNET, client_id: str = UNKNOWN,
+                 client_name: str = UNKNOWN, client_version: str = UNKNOWN, host_address: str = UNKNOWN,
+                 host_name: str = UNKNOWN, host_port: int = 0, connected: Optional[float] = None,
+                 color: Optional[ColorSystem] = None, width: int = 78, height: int = 24, **flags):
+        self.protocol = protocol
+        self.client_id = sys.intern(client_id)
+        self.client_name = sys.intern(client_name)
+        self.client_version = sys.intern(client_version)
+        self.host_address = sys.intern(host_address)
+        self.host_name = host_name
+        self.host_port = host_port
+        self.connected: float = time.time() if connected is None else connected
+        self.color = color
+        self.width = width
+        self.height = height
+        self.flags = 0
+        for name, value in flags.items():
+            if (bit := DETAILS_FLAG_BITS.get(name, None)) is None:
+                raise TypeError(f"ConnectionDetails got an unexpected keyword argument '{name}'")
+            if value:
+                self.flags |= bit
+
+    def __repr__(self):
+        fields_repr = ", ".join(f"{k}={v!r}" for k, v in self.to_dict().items())
+        return f"{self.__class__.__name__}({fields_repr})"
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return _details_getter(self) == _details_getter(other)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in DETAILS_FIELDS}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ConnectionDetails":
+        obj = cls()
+        obj.apply_changes(data)
+        return obj
+
+    def to_tuple(self) -> tuple:
+        """
+        The compact form used by CompactLinkCodec: the slots' values, flags packed in one int.
+        """
+        return _details_getter(self)
+
+    @classmethod
+    def from_tuple(cls, data) -> "ConnectionDetails":
+        obj = cls.__new__(cls)
+        (protocol, client_id, client_name, client_version, host_address, obj.host_name, obj.host_port,
+         obj.connected, color, obj.width, obj.height, obj.flags) = data
+        obj.protocol = MudProtocol(protocol)
+        obj.client_id = sys.intern(client_id)
+        obj.client_name = sys.intern(client_name)
+        obj.client_version = sys.intern(client_version)
+        obj.host_address = sys.intern(host_address)
+        obj.color = None if color is None else ColorSystem(color)
+        return obj
+
+    def apply_changes(self, changes: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Sets fields from a dict of {field: value}, ignoring names that aren't fields.
+
+        Args:
+            changes (dict): The fields to set. May be partial, or a whole to_dict().
+
+        Returns:
+            changed (dict): The fields whose values were actually different, with their new values.
+        """
+        changed = dict()
+        for k, v in changes.items():
+            if k in DETAILS_FLAG_BITS:
+                v = bool(v)
+            elif k == "protocol":
+                v = MudProtocol(v)
+            elif k == "color":
+                v = None if v is None else ColorSystem(v)
+            elif k in _DETAILS_SLOTS and k != "flags":
+                v = _intern(v)
+            else:
+                continue
+            if getattr(self, k) != v:
+                setattr(self, k, v)
+                changed[k] = v
+        return changed
+
+
+for _name in DETAILS_FLAGS:
+    setattr(ConnectionDetails, _name, _flag_property(_name))
 
 
 class ConnectionInMessageType(IntEnum):
@@ -124,6 +283,8 @@ class PortalOutMessage:
     msg_type: PortalOutMessageType
     process_id: int
     data: Optional[object]
+    # Set on EVENTS messages by LinkSession.stamp(). 0 means unsequenced.
+    seq: int = 0
 
 
 class ServerInMessageType(IntEnum):
@@ -138,23 +299,417 @@ class ServerInMessage:
     msg_type: ServerInMessageType
     process_id: int
     data: Optional[object]
+    # Set on EVENTS messages by LinkSession.stamp(). 0 means unsequenced.
+    seq: int = 0
+
+
+# PortalOutMessageType and ServerInMessageType share values.
+EVENTS = 0
+HELLO = 1
+SYSTEM = 2
+
+# ConnectionInMessage types whose data is a ConnectionDetails. UPDATE only carries a dict of
+# the fields that changed, for ConnectionDetails.apply_changes().
+DETAILS_EVENTS = (ConnectionInMessageType.READY,)
+
+
+def compile_encoder(cls) -> Callable[[Any], tuple]:
+    """
+    Builds a function that turns an instance of the given dataclass into a tuple of its field
+    values, in field order.
+    """
+    return attrgetter(*[f.name for f in fields(cls)])
+
+
+def compile_decoder(cls) -> Callable[[list], Any]:
+    """
+    Builds a function that turns a list of field values (as made by compile_encoder) back into
+    an instance of the given dataclass. IntEnum fields are converted back into their enum.
+    """
+    hints = typing.get_type_hints(cls)
+    namespace = {"cls": cls}
+    args = list()
+    for i, f in enumerate(fields(cls)):
+        hint = hints.get(f.name, None)
+        if isinstance(hint, type) and issubclass(hint, IntEnum):
+            namespace[f"_enum{i}"] = hint._value2member_map_
+            args.append(f"_enum{i}[a[{i}]]")
+        else:
+            args.append(f"a[{i}]")
+    exec(f"def decode(a):\n    return cls({', '.join(args)})", namespace)
+    return namespace["decode"]
+
+
+class LinkCodec:
+    """
+    Turns link messages (PortalOutMessage/ServerInMessage and the events they carry) into bytes
+    and back again. Only EVENTS messages have their data converted - HELLO and SYSTEM data is
+    sent as-is.
+    """
+    name = None
+
+    def encode(self, msg) -> bytes:
+        raise NotImplementedError()
+
+    def decode(self, data: bytes, msg_class):
+        return self.load(orjson.loads(data), msg_class)
+
+    def load(self, data, msg_class):
+        """
+        Like decode(), but for a message that's already been parsed from JSON.
+        """
+        raise NotImplementedError()
+
+
+class JsonLinkCodec(LinkCodec):
+    """
+    The original wire format: every message is a JSON object, as made by dataclasses_json.
+    Slow, but every version of Athanor understands it.
+    """
+    name = "json"
+
+    def encode(self, msg) -> bytes:
+        return orjson.dumps(msg, default=self.default)
+
+    @staticmethod
+    def default(obj):
+        # orjson handles the message dataclasses itself, but not ConnectionDetails.
+        if isinstance(obj, ConnectionDetails):
+            return obj.to_dict()
+        raise TypeError(f"Cannot serialize {obj.__class__.__name__}")
+
+    def load(self, data: dict, msg_class):
+        msg = msg_class.from_dict(data)
+        if msg.msg_type == EVENTS and msg.data:
+            if msg_class is ServerInMessage:
+                events = [ConnectionInMessage.from_dict(e) for e in msg.data]
+                for ev in events:
+                    if ev.msg_type in DETAILS_EVENTS:
+                        ev.data = ConnectionDetails.from_dict(ev.data)
+                msg.data = events
+            else:
+                msg.data = [ConnectionOutMessage.from_dict(e) for e in msg.data]
+        return msg
+
+
+class CompactLinkCodec(LinkCodec):
+    """
+    Encodes every message as a JSON array of its field values, in field order. No keys are
+    sent, and encoding/decoding is done by functions compiled once per class.
+    """
+    name = "compact"
+
+    def __init__(self):
+        self.encoders: Dict[type, Callable] = dict()
+        self.decoders: Dict[type, Callable] = dict()
+        for cls in (ConnectionInMessage, ConnectionOutMessage, PortalOutMessage, ServerInMessage):
+            self.encoders[cls] = compile_encoder(cls)
+            self.decoders[cls] = compile_decoder(cls)
+        self.encoders[ConnectionDetails] = ConnectionDetails.to_tuple
+        self.decoders[ConnectionDetails] = ConnectionDetails.from_tuple
+
+    def encode(self, msg) -> bytes:
+        out = self.encoders[msg.__class__](msg)
+        if msg.msg_type == EVENTS and msg.data:
+            out = list(out)
+            if msg.__class__ is ServerInMessage:
+                out[2] = [self.encode_in_event(ev) for ev in msg.data]
+            else:
+                encode = self.encoders[ConnectionOutMessage]
+                out[2] = [encode(ev) for ev in msg.data]
+        return orjson.dumps(out)
+
+    def encode_in_event(self, ev: ConnectionInMessage) -> tuple:
+        if ev.msg_type in DETAILS_EVENTS:
+            return ev.msg_type, ev.client_id, self.encoders[ConnectionDetails](ev.data)
+        return ev.msg_type, ev.client_id, ev.data
+
+    def load(self, data: list, msg_class):
+        msg = self.decoders[msg_class](data)
+        if msg.msg_type == EVENTS and msg.data:
+            if msg_class is ServerInMessage:
+                decode = self.decoders[ConnectionInMessage]
+                decode_details = self.decoders[ConnectionDetails]
+                events = [decode(e) for e in msg.data]
+                for ev in events:
+                    if ev.msg_type in DETAILS_EVENTS:
+                        ev.data = decode_details(ev.data)
+                msg.data = events
+            else:
+                decode = self.decoders[ConnectionOutMessage]
+                msg.data = [decode(e) for e in msg.data]
+        return msg
+
+
+LINK_CODECS: Dict[str, LinkCodec] = {codec.name: codec for codec in (CompactLinkCodec(), JsonLinkCodec())}
+
+def decode_frame(data: bytes, msg_class) -> List[Any]:
+    """
+    Decodes a link frame into a list of msg_class.
+
+    Frames are self-describing: a json message is an object, a compact message is an array
+    starting with its msg_type, and a batch (see LinkProtocol.write) is an array of messages.
+    """
+    data = orjson.loads(data)
+    if isinstance(data, dict):
+        return [LINK_CODECS["json"].load(data, msg_class)]
+    if not isinstance(data, list) or not data:
+        raise ValueError(f"Unrecognized link frame: {data!r:.40}")
+    if isinstance(data[0], (list, dict)):
+        json_codec, compact_codec = LINK_CODECS["json"], LINK_CODECS["compact"]
+        return [(json_codec if isinstance(m, dict) else compact_codec).load(m, msg_class) for m in data]
+    return [LINK_CODECS["compact"].load(data, msg_class)]
+
+
+def choose_codec(ours, theirs) -> LinkCodec:
+    """
+    Picks the first codec in our preference list that the peer also supports, falling back to
+    json, which everyone speaks.
+    """
+    theirs = set(theirs or ())
+    for name in ours:
+        if name in theirs and name in LINK_CODECS:
+            return LINK_CODECS[name]
+    return LINK_CODECS["json"]
+
+
+def strip_gamedata(msg) -> Tuple[Any, int]:
+    """
+    Takes the GAMEDATA events out of an outgoing EVENTS message, for the drop_gamedata
+    backpressure policy. Connects, disconnects and updates are kept.
+
+    Returns:
+        kept (message or None): What's left, or None if nothing is.
+        dropped (int): How many events were taken out.
+    """
+    if msg.msg_type != EVENTS or not msg.data:
+        return msg, 0
+    kept = [ev for ev in msg.data if ev.msg_type != ConnectionOutMessageType.GAMEDATA]
+    dropped = len(msg.data) - len(kept)
+    if not kept:
+        return None, dropped
+    if not dropped:
+        return msg, 0
+    return msg.__class__(msg.msg_type, msg.process_id, kept, msg.seq), dropped
+
+
+class StreamLinkConnection:
+    """
+    Makes an asyncio stream pair look like the parts of a websocket that LinkProtocol uses:
+    frames go out with send(), and come in by iterating over it. Each frame is prefixed with its
+    length as a 4-byte big-endian integer.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    async def send(self, data: bytes):
+        self.writer.write(len(data).to_bytes(4, "big") + data)
+        await self.writer.drain()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        try:
+            header = await self.reader.readexactly(4)
+            return await self.reader.readexactly(int.from_bytes(header, "big"))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            raise StopAsyncIteration
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+class LinkSession:
+    """
+    The sequencing state of a LinkService's conversation with the other process. Unlike a
+    LinkProtocol, this survives the link dropping, so that whatever the other side didn't
+    acknowledge can be replayed when it reconnects.
+
+    Every EVENTS message sent gets the next sequence number and is kept in a ring buffer until
+    the peer acknowledges it. Received EVENTS messages are checked against the last sequence
+    number seen from that peer process, so replays aren't processed twice. We only acknowledge
+    what the consumer has reported done via complete(), so nothing sitting in a queue when a
+    process dies is lost - although what was done since the last ack will be replayed to a
+    restarted peer.
+    """
+
+    def __init__(self, replay_size: int = 0):
+        self.next_seq: int = 1
+        self.replay = deque(maxlen=replay_size or None)
+        # The most recent sequence number the peer acknowledged.
+        self.acked: int = 0
+        # Messages that fell off the end of the replay buffer before they were acknowledged.
+        self.overflowed: int = 0
+        # The process id of the peer, the last sequence number received from it, and the last one
+        # the consumer finished with.
+        self.peer_id: Optional[int] = None
+        self.received: int = 0
+        self.completed: int = 0
+        self.ack_sent: int = 0
+
+    def stamp(self, msg):
+        if msg.msg_type != EVENTS:
+            return
+        msg.seq = self.next_seq
+        self.next_seq += 1
+        if len(self.replay) == self.replay.maxlen:
+            self.overflowed += 1
+        self.replay.append(msg)
+
+    def ack(self, seq: int):
+        """
+        The peer has everything up to and including seq. Forget about it.
+        """
+        if seq > self.acked:
+            self.acked = seq
+        replay = self.replay
+        while replay and replay[0].seq <= seq:
+            replay.popleft()
+
+    def receive(self, msg) -> bool:
+        """
+        Called for every message that arrives over the link.
+
+        Returns:
+            process (bool): False if the message was handled here (acks) or was a duplicate, and
+                should go no further.
+        """
+        if msg.process_id != self.peer_id:
+            # A new peer process knows nothing of our old one's sequence numbers.
+            self.peer_id = msg.process_id
+            self.received = 0
+            self.completed = 0
+            self.ack_sent = 0
+        if msg.msg_type == SYSTEM and isinstance(msg.data, dict) and "ack" in msg.data:
+            self.ack(msg.data["ack"])
+            return False
+        if msg.seq:
+            if msg.seq <= self.received:
+                return False
+            self.received = msg.seq
+        return True
+
+    def complete(self, seq: int):
+        """
+        Called by whatever consumes received EVENTS messages once it's done with one.
+        """
+        if seq > self.completed:
+            self.completed = seq
+
+
+# Kinds of journal record: which way the link frame in it was going.
+JOURNAL_TO_SERVER = 0
+JOURNAL_TO_PORTAL = 1
 
 
 class LinkProtocol:
+    """
+    One live link to the other process. Messages put in the outbox are written out in batches;
+    producers should use send(), which applies backpressure once the outbox passes its high
+    watermark.
+    """
 
-    def __init__(self, service, ws, path):
+    def __init__(self, service, ws, path, session: Optional[LinkSession] = None, name: str = ""):
         self.service = service
         self.connection = ws
         self.path = path
-        self.outbox = asyncio.Queue()
+        # Sequencing and replay state. It outlives the link, so a reconnect can pick up where
+        # this one left off.
+        self.session: LinkSession = session or service.session
+        # Which of the service's endpoints this link belongs to, for services with several.
+        self.name = name
+        self.outbox = asyncio.Queue(maxsize=service.outbox_size)
         self.task = None
         self.running = False
+        # Everything starts out speaking json, one message per frame. The HELLO exchange may
+        # upgrade both.
+        self.codec: LinkCodec = LINK_CODECS["json"]
+        self.batching: bool = False
+        # Set once HELLO is done and anything unacknowledged has been replayed. Until then,
+        # LinkServices hold on to their events.
+        self.ready: bool = False
+        # Set while the outbox is below its high watermark, or has since drained to the low one.
+        self.writable = asyncio.Event()
+        self.writable.set()
+        # Count of GAMEDATA events thrown away by the drop_gamedata backpressure policy. Only the
+        # Server's output is ever dropped; player input always waits for room.
+        self.dropped: int = 0
+        self.may_drop: bool = service.in_message_class is ServerInMessage
+        # Traffic counters, when the Application keeps metrics.
+        self.messages_in = self.bytes_in = self.messages_out = self.bytes_out = None
+        if (metrics := service.app.metrics):
+            self.messages_in = metrics.counter("link.messages_in")
+            self.bytes_in = metrics.counter("link.bytes_in")
+            self.messages_out = metrics.counter("link.messages_out")
+            self.bytes_out = metrics.counter("link.bytes_out")
+        # The Application's JournalService, if it keeps one, and the journal kinds of the frames
+        # we read and write.
+        self.journal = service.app.journal
+        if service.in_message_class is ServerInMessage:
+            self.journal_in, self.journal_out = JOURNAL_TO_SERVER, JOURNAL_TO_PORTAL
+        else:
+            self.journal_in, self.journal_out = JOURNAL_TO_PORTAL, JOURNAL_TO_SERVER
+
+    @property
+    def paused(self) -> bool:
+        return not self.writable.is_set()
+
+    async def send(self, msg):
+        """
+        Queues a message for the other process, applying the service's backpressure policy if
+        the outbox has passed its high watermark:
+
+            block: wait until the writer drains it down to the low watermark.
+            drop_gamedata: strip GAMEDATA out of EVENTS messages, and send whatever's left. This
+                only applies to output headed for a Portal. Input headed for the Server blocks.
+
+        Once the outbox is completely full, this waits regardless of policy.
+        """
+        if self.outbox.qsize() >= self.service.high_water:
+            self.writable.clear()
+        if self.paused:
+            if self.may_drop and self.service.backpressure == "drop_gamedata":
+                msg = self.drop_gamedata(msg)
+                if msg is None:
+                    return
+            else:
+                await self.writable.wait()
+        self.session.stamp(msg)
+        await self.outbox.put(msg)
+
+    def drop_gamedata(self, msg):
+        msg, dropped = strip_gamedata(msg)
+        self.dropped += dropped
+        return msg
+
+    def encode(self, msg) -> bytes:
+        if isinstance(msg, bytes):
+            return msg
+        if isinstance(msg, str):
+            return msg.encode()
+        return self.codec.encode(msg)
 
     async def run(self):
         self.running = True
         self.task = asyncio.create_task(self.run_tasks())
-        await self.task
-        self.running = False
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.running = False
+            self.ready = False
+            # Release anyone waiting on us. What's still in the outbox is in the replay buffer.
+            while not self.outbox.empty():
+                self.outbox.get_nowait()
+            self.writable.set()
 
     async def run_tasks(self):
         await asyncio.gather(self.read(), self.write())
@@ -164,34 +719,69 @@ class LinkProtocol:
             async for message in self.connection:
                 await self.process_message(message)
         except ConnectionClosedError:
-            self.running = False
-            self.task.cancel()
+            pass
         except ConnectionClosedOK:
-            self.running = False
-            self.task.cancel()
+            pass
         except ConnectionClosed:
-            self.running = False
-            self.task.cancel()
+            pass
+        # The connection is gone one way or another. Take the writer down with us.
+        self.running = False
+        self.task.cancel()
 
     async def write(self):
+        """
+        Sends everything that's ready in the outbox. Once the peer has agreed to batching, that
+        goes out as one frame - a JSON array of encoded messages - of up to batch_count
+        messages, stopping early once it reaches batch_bytes.
+        """
+        outbox = self.outbox
+        service = self.service
         while self.running:
-            msg = await self.outbox.get()
-            #print(f"{self.service.app.config.name.upper()} SENDING MESSAGE: {msg}")
-            if isinstance(msg, str):
-                await self.connection.send(msg)
-            else:
-                await self.connection.send(orjson.dumps(msg))
+            frames = [self.encode(await outbox.get())]
+            size = len(frames[0])
+            if self.batching:
+                while size < service.batch_bytes and len(frames) < service.batch_count and not outbox.empty():
+                    frame = self.encode(outbox.get_nowait())
+                    frames.append(frame)
+                    size += len(frame)
+            if self.paused and outbox.qsize() <= service.low_water:
+                self.writable.set()
+            #print(f"{self.service.app.config.name.upper()} SENDING MESSAGES: {frames}")
+            if self.messages_out is not None:
+                self.messages_out.inc(len(frames))
+                self.bytes_out.inc(size)
+            frame = frames[0] if len(frames) == 1 else b"[" + b",".join(frames) + b"]"
+            if self.journal is not None:
+                self.journal.record(self.journal_out, frame)
+            try:
+                await self.connection.send(frame)
+            except (ConnectionClosed, ConnectionError):
+                # The peer went away mid-write. Same as read() noticing: take the link down, and
+                # whoever ran it reconnects.
+                self.running = False
+                self.task.cancel()
+                return
 
     async def process_message(self, message):
         #print(f"{self.service.app.config.name.upper()} RECEIVED MESSAGE: {message}")
         if isinstance(message, bytes):
-            data = orjson.loads(message.decode())
-            await self.service.message_from_link(data)
+            session = self.session
+            if self.journal is not None:
+                self.journal.record(self.journal_in, message)
+            messages = decode_frame(message, self.service.in_message_class)
+            if self.messages_in is not None:
+                self.messages_in.inc(len(messages))
+                self.bytes_in.inc(len(message))
+            for msg in messages:
+                if session.receive(msg):
+                    await self.service.message_from_link(msg, self)
         else:
             print(f"{self.service.app.config.name} got unknown websocket message: {message}")
 
 
 class LinkService(Service):
+    # The message class that arrives over the link. Set by subclasses.
+    in_message_class = None
 
     def __init__(self, app):
         super().__init__(app)
@@ -199,23 +789,78 @@ class LinkService(Service):
         self.link: Optional[LinkProtocol] = None
         self.interface: Optional[str] = None
         self.port: int = 0
+        self.transport: str = "websocket"
+        self.path: Optional[str] = None
         self.in_events: Optional[asyncio.Queue] = None
         self.out_events: Optional[asyncio.Queue] = None
+        self.codecs = list()
+        self.outbox_size: int = 0
+        self.high_water: int = 0
+        self.low_water: int = 0
+        self.batch_count: int = 1
+        self.batch_bytes: int = 0
+        self.backpressure: str = "block"
+        self.replay_size: int = 0
+        self.session = LinkSession()
+        self.ack_interval: float = 0.0
 
-    def setup(self):
-        link_conf = self.app.config.link
+    def parse_endpoint(self, link_conf: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Validates where a link lives.
+
+        Args:
+            link_conf (dict): A link config, as found in config.link.
+
+        Returns:
+            endpoint (dict): The transport, interface, port and path to use.
+        """
         interface = self.app.config.interfaces.get(link_conf["interface"], None)
         if interface is None:
             raise ValueError("Portal must have a link interface!")
-        self.interface = interface
         port = int(link_conf["port"])
         if port < 0 or port > 65535:
             raise ValueError(f"Invalid port: {port}. Port must be 16-bit unsigned integer")
-        self.port = port
+        transport = link_conf.get("transport", "websocket")
+        if transport not in ("websocket", "unix"):
+            raise ValueError(f"Unknown link transport: {transport}")
+        path = None
+        if transport == "unix":
+            if not (path := link_conf.get("path", None)):
+                raise ValueError("The unix link transport needs a socket path!")
+            path = os.path.abspath(path)
+        return {"transport": transport, "interface": interface, "port": port, "path": path}
+
+    def setup(self):
+        link_conf = self.app.config.link
+        endpoint = self.parse_endpoint(link_conf)
+        self.interface = endpoint["interface"]
+        self.port = endpoint["port"]
+        self.transport = endpoint["transport"]
+        self.path = endpoint["path"]
+        self.codecs = list(link_conf.get("codecs", ["json"]))
+        self.outbox_size = int(link_conf.get("outbox_size", 0))
+        self.high_water = int(link_conf.get("high_water", self.outbox_size or sys.maxsize))
+        self.low_water = int(link_conf.get("low_water", self.high_water // 2))
+        if self.low_water > self.high_water:
+            raise ValueError("Link low_water must not be above high_water!")
+        self.batch_count = max(1, int(link_conf.get("batch_count", 1)))
+        self.batch_bytes = int(link_conf.get("batch_bytes", sys.maxsize))
+        self.backpressure = link_conf.get("backpressure", "block")
+        if self.backpressure not in ("block", "drop_gamedata"):
+            raise ValueError(f"Unknown link backpressure policy: {self.backpressure}")
+        self.replay_size = int(link_conf.get("replay_size", 0))
+        self.session = LinkSession(self.replay_size)
+        self.ack_interval = float(link_conf.get("ack_interval", 0.0))
+        if (metrics := self.app.metrics):
+            metrics.gauge("link.in_events", lambda: self.in_events.qsize() if self.in_events else 0)
+            metrics.gauge("link.out_events", lambda: self.out_events.qsize() if self.out_events else 0)
+            metrics.gauge("link.outbox", lambda: sum(link.outbox.qsize() for link in self.active_links()))
+            metrics.gauge("link.unacked", lambda: sum(len(session.replay) for session in self.sessions()))
 
     async def async_setup(self):
-        self.in_events = asyncio.Queue()
-        self.out_events = asyncio.Queue()
+        # Bounded like the outbox, so that whoever feeds us waits once the link falls behind.
+        self.in_events = asyncio.Queue(maxsize=self.outbox_size)
+        self.out_events = asyncio.Queue(maxsize=self.outbox_size)
 
     async def async_run(self):
         pass
@@ -226,21 +871,98 @@ class LinkService(Service):
     async def handle_out_events(self):
         pass
 
+    @property
+    def link_ready(self) -> bool:
+        return bool(self.link and self.link.ready)
+
+    def active_links(self) -> List[LinkProtocol]:
+        """
+        Every link that's currently up.
+        """
+        return [self.link] if self.link else []
+
+    def sessions(self) -> List[LinkSession]:
+        return [self.session]
+
+    def complete(self, msg):
+        """
+        Called by whoever consumes a message from the link once they're done with it, so that
+        it can be acknowledged to the process that sent it.
+        """
+        for session in self.sessions():
+            if session.peer_id == msg.process_id:
+                session.complete(msg.seq)
+                return
+
+    async def resume_link(self, link: LinkProtocol, received: Optional[int]):
+        """
+        Finishes a HELLO exchange. If the peer told us the last sequence number it received from
+        us, everything after that which is still in the replay buffer is sent again, ahead of any
+        new events.
+
+        Args:
+            link (LinkProtocol): The link that just said HELLO.
+            received (int or None): The peer's last received sequence number, or None for a peer
+                that doesn't do replay.
+        """
+        if received is not None:
+            link.session.ack(received)
+            for msg in list(link.session.replay):
+                await link.outbox.put(msg)
+        link.ready = True
+
+    def resume_data(self, link: LinkProtocol) -> Dict[str, Any]:
+        """
+        What we tell the peer during HELLO so it can resume.
+        """
+        return {"received": link.session.completed}
+
+    async def send_acks(self):
+        """
+        Periodically tells each peer how far we've gotten, so it can trim its replay buffer.
+        """
+        if not self.ack_interval:
+            return
+        while True:
+            await asyncio.sleep(self.ack_interval)
+            for link in self.active_links():
+                session = link.session
+                completed = session.completed
+                if not link.ready or completed == session.ack_sent:
+                    continue
+                msg = self.link_message(SYSTEM, {"ack": completed})
+                try:
+                    link.outbox.put_nowait(msg)
+                    session.ack_sent = completed
+                except asyncio.QueueFull:
+                    pass
+
+    def link_message(self, msg_type: int, data):
+        """
+        Creates a message of the kind this side sends over the link.
+        """
+        return None
+
     def new_link(self, ws, path):
         link = LinkProtocol(self, ws, path)
         if self.link:
             self.close_link()
         self.link = link
-        self.on_new_link()
-        return link.run()
+        self.on_new_link(link)
+        return self.run_link(link)
 
-    def on_new_link(self):
+    async def run_link(self, link: LinkProtocol):
+        await link.run()
+        if self.link is link:
+            self.link = None
+
+    def on_new_link(self, link: LinkProtocol):
         pass
 
     def close_link(self):
         pass
 
-    async def message_from_link(self, message):
+    async def message_from_link(self, message, link: LinkProtocol):
         pass
 
 
@@ -251,25 +973,93 @@ class LinkServiceServer(LinkService):
         self.listener = None
 
     async def async_run(self):
-        await asyncio.gather(self.listener, self.handle_in_events(), self.handle_out_events())
+        await asyncio.gather(self.listener, self.handle_in_events(), self.handle_out_events(), self.send_acks())
 
     async def async_setup(self):
         await super().async_setup()
-        self.listener = websockets.serve(self.new_link, self.interface, self.port)
+        if self.transport == "unix":
+            if os.path.exists(self.path):
+                # Left behind by a previous run. Nobody else can be using it, or we'd conflict anyway.
+                os.remove(self.path)
+            self.listener = asyncio.start_unix_server(self.accept_stream, self.path)
+        else:
+            self.listener = websockets.serve(self.new_link, self.interface, self.port)
+
+    async def accept_stream(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        conn = StreamLinkConnection(reader, writer)
+        try:
+            await self.new_link(conn, "/")
+        finally:
+            await conn.close()
 
 
 class LinkServiceClient(LinkService):
+    """
+    Connects out to one or more other processes. config.link["portals"] may name several
+    endpoints, each a dict of overrides on top of config.link, and each gets its own link and
+    replay state. Without it, there's a single endpoint named after config.link itself.
+
+    self.link is the most recently connected link, for the common case of there being just one.
+    """
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.endpoints: Dict[str, Dict[str, Any]] = dict()
+        self.links: Dict[str, LinkProtocol] = dict()
+        self.link_sessions: Dict[str, LinkSession] = dict()
+
+    def setup(self):
+        super().setup()
+        link_conf = self.app.config.link
+        portals = link_conf.get("portals", None) or {link_conf.get("name", "portal"): dict()}
+        for name, overrides in portals.items():
+            self.endpoints[name] = self.parse_endpoint({**link_conf, **overrides})
+            self.link_sessions[name] = LinkSession(self.replay_size)
+
+    def active_links(self) -> List[LinkProtocol]:
+        return list(self.links.values())
+
+    def sessions(self) -> List[LinkSession]:
+        return list(self.link_sessions.values())
 
     async def async_run(self):
-        await asyncio.gather(self.async_link(), self.handle_in_events(), self.handle_out_events())
+        await asyncio.gather(
+            *[self.async_link(name) for name in self.endpoints],
+            self.handle_in_events(),
+            self.handle_out_events(),
+            self.send_acks()
+        )
+
+    async def connect(self, endpoint: Dict[str, Any]):
+        """
+        Opens a connection to the other process, over the endpoint's transport.
+        """
+        if endpoint["transport"] == "unix":
+            reader, writer = await asyncio.open_unix_connection(endpoint["path"])
+            return StreamLinkConnection(reader, writer)
+        return await websockets.connect(f"ws://{endpoint['interface']}:{endpoint['port']}")
 
-    async def async_link(self):
-        url = f"ws://{self.interface}:{self.port}"
+    async def async_link(self, name: str):
+        endpoint = self.endpoints[name]
         while True:
-            async with websockets.connect(url) as ws:
-                self.link = LinkProtocol(self, ws, "/")
-                self.on_new_link()
-                await self.link.run()
+            try:
+                conn = await self.connect(endpoint)
+            except OSError:
+                # The other side isn't up yet, or is rebooting.
+                await asyncio.sleep(0.1)
+                continue
+            try:
+                link = LinkProtocol(self, conn, "/", session=self.link_sessions[name], name=name)
+                self.links[name] = link
+                self.link = link
+                self.on_new_link(link)
+                await self.run_link(link)
+            finally:
+                if self.links.get(name, None) is link:
+                    del self.links[name]
+                if self.link is None:
+                    self.link = next(iter(self.links.values()), None)
+                await conn.close()
             await asyncio.sleep(0.1)
 
     async def handle_in_events(self):
@@ -279,8 +1069,8 @@ class LinkServiceClient(LinkService):
 
     async def handle_out_events(self):
         while True:
-            if self.link:
+            if self.link_ready:
                 msg = await self.out_events.get()
-                await self.link.outbox.put(msg)
+                await self.link.send(msg)
             else:
-                await asyncio.sleep(1)
\ No newline at end of file
+                await asyncio.sleep(1)
@@ -31,7 +31,11 @@ def main():
     if not (core_class := import_from_module(config.application)):
         raise ValueError(f"Cannot import {app_name} from config applications")
 
-    pidfile = os.path.join(".", f"{app_name}.pid")
+    # One of several workers gets a pidfile of its own.
+    if (worker := os.environ.get("ATHANOR_WORKER")) is not None:
+        pidfile = os.path.join(".", f"{app_name}-{worker}.pid")
+    else:
+        pidfile = os.path.join(".", f"{app_name}.pid")
     with open(pidfile, "w") as p:
         p.write(str(os.getpid()))
 
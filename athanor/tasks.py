@@ -1,38 +1,229 @@
 import sys
+import time
 import asyncio
+import traceback
+
+from heapq import heappush, heappop
+from itertools import count
+from typing import Any, Callable, List, Optional
 
 
 class TaskMaster:
+    """
+    Runs queued tasks one at a time, lowest priority number first and in the order they were
+    queued within a priority. Subclasses implement run_task().
+
+    By default each TaskMaster runs in an asyncio task of its own. If get_task_pool() returns a
+    TaskPool, it's run by that pool's shared workers instead, which still never run two of its
+    tasks at once.
+
+    The class attributes below choose how it behaves. The defaults keep the queue unbounded and
+    let stop() wait for everything queued before it.
+    """
+
+    # Most tasks that may be waiting at once. 0 means no limit.
+    task_queue_size: int = 0
+    # If true, stop() cancels the running task and throws away the queue rather than waiting.
+    stop_immediately: bool = False
 
     def __init__(self, *args, **kwargs):
-        # queue-relevant data
+        # queue-relevant data. The queue is an asyncio.PriorityQueue when we run our own task,
+        # and a plain heap when a TaskPool runs us.
         self._queue = None
-        self._task = None
+        self._task: Optional[asyncio.Task] = None
         self._running: bool = False
+        # Whether run() has actually begun. A task cancelled before that never runs its cleanup.
+        self._begun: bool = False
+        # Tie-breaker so tasks of equal priority run first-in, first-out and never get compared.
+        self._seq = count()
+        self._pool: Optional["TaskPool"] = None
+        # Pool mode: set while we're waiting in the pool's ready queue or being run by a worker.
+        self._scheduled: bool = False
+        # Pool mode: the worker running us right now, and whether stop() cancelled it.
+        self._worker: Optional[asyncio.Task] = None
+        self._cancelled: bool = False
+
+    def get_task_pool(self) -> Optional["TaskPool"]:
+        """
+        Returns the TaskPool to run in, or None to run in a task of our own.
+        """
+        return None
 
     def start(self):
         if not self._running:
             self._running = True
-            self._queue = asyncio.PriorityQueue()
-            self._task = asyncio.create_task(self.run())
+            self._begun = False
+            if (pool := self.get_task_pool()):
+                self._pool = pool
+                self._queue = list()
+                # The pool's first visit runs on_start().
+                self._wake()
+            else:
+                self._queue = asyncio.PriorityQueue()
+                self._task = asyncio.create_task(self.run())
 
-    def stop(self):
-        if self._running:
-            self._queue.put_nowait((sys.maxsize, None))
+    def _put(self, entry):
+        if self._pool:
+            heappush(self._queue, entry)
+            self._wake()
+        else:
+            self._queue.put_nowait(entry)
+
+    def _wake(self):
+        if not self._scheduled:
+            self._scheduled = True
+            self._pool.schedule(self)
+
+    def enqueue(self, task: Any, priority: int = 0) -> bool:
+        """
+        Queues a task to be run.
+
+        Args:
+            task (any): Handed to run_task().
+            priority (int): Lower runs sooner.
+
+        Returns:
+            queued (bool): False if we aren't running, or the queue is full.
+        """
+        if not self._running:
+            return False
+        if self.task_queue_size and self.queued_tasks() >= self.task_queue_size:
+            self.on_queue_full(task)
+            return False
+        self._put((priority, next(self._seq), time.perf_counter(), task))
+        return True
+
+    def queued_tasks(self) -> int:
+        """
+        How many tasks are waiting.
+        """
+        if self._queue is None:
+            return 0
+        if self._pool:
+            return len(self._queue)
+        return self._queue.qsize()
+
+    def stop(self, immediate: Optional[bool] = None):
+        """
+        Stops running tasks. on_stop() is called either way.
+
+        Args:
+            immediate (bool): Override stop_immediately for this call.
+        """
+        if not self._running:
+            return
+        if self.stop_immediately if immediate is None else immediate:
+            self._running = False
+            if self._pool:
+                self._queue.clear()
+                # A task stopping its own TaskMaster just finishes. Cancelling the worker from
+                # inside would only go off at its next await, after we're done with it.
+                if self._worker and self._worker is not asyncio.current_task():
+                    self._cancelled = True
+                    self._worker.cancel()
+                self._put((-sys.maxsize, next(self._seq), 0.0, None))
+            elif self._begun:
+                self._task.cancel()
+            else:
+                # Jump the queue instead, so on_start() and on_stop() still get their turn.
+                self._queue.put_nowait((-sys.maxsize, next(self._seq), 0.0, None))
+        else:
+            self._put((sys.maxsize, next(self._seq), 0.0, None))
 
     async def run(self):
-        await self.on_start()
-        while True:
-            priority, task = await self._queue.get()
-            if task is None:
-                self._running = False
-                break
-            await self.run_task(task)
-        await self.on_stop()
-        self._task.cancel()
-        self._queue = None
+        self._begun = True
+        try:
+            await self.on_start()
+            while True:
+                entry = await self._queue.get()
+                if entry[3] is None:
+                    break
+                await self._run_entry(entry)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._running = False
+            self._queue = None
+            await self.on_stop()
+
+    async def step(self):
+        """
+        Pool mode: called by a TaskPool worker to do the next thing we have to do, which is
+        on_start(), one task, or stopping.
+        """
+        worker = self._worker = asyncio.current_task()
+        finished = False
+        try:
+            if not self._begun:
+                self._begun = True
+                await self.on_start()
+            elif self._queue:
+                entry = heappop(self._queue)
+                if entry[3] is None:
+                    finished = True
+                else:
+                    await self._run_entry(entry)
+        except asyncio.CancelledError:
+            if not self._cancelled:
+                raise
+            # stop() did that, not whoever owns the worker. It has other TaskMasters to run.
+        except Exception:
+            # One task going wrong mustn't leave us scheduled with nobody running us. Carry on
+            # with the rest of the queue.
+            traceback.print_exc(file=sys.stdout)
+        finally:
+            self._worker = None
+            if self._cancelled:
+                # Whether or not stop()'s cancel landed, it was meant for us, not the worker.
+                self._cancelled = False
+                if hasattr(worker, "uncancel"):
+                    worker.uncancel()
+
+        if finished:
+            self._running = False
+            self._queue = None
+            self._scheduled = False
+            await self.on_stop()
+        elif self._queue:
+            # Back of the line, so one busy TaskMaster can't starve the rest.
+            self._pool.schedule(self)
+        else:
+            self._scheduled = False
+
+    async def _run_entry(self, entry):
+        priority, seq, queued, task = entry
+        started = time.perf_counter()
+        try:
+            # Offloaded work comes back to whoever asked for it, not through run_task(), so
+            # overriding that can't lose it.
+            if isinstance(task, OffloadResult):
+                await task.deliver()
+            else:
+                await self.run_task(task)
+        finally:
+            self.on_task_timed(task, started - queued, time.perf_counter() - started)
 
     async def run_task(self, task):
+        """
+        Does one queued task. OffloadResults are delivered before they'd get here.
+        """
+        pass
+
+    def on_task_timed(self, task, waited: float, elapsed: float):
+        """
+        Called after every task, whether or not it finished. Does nothing by default.
+
+        Args:
+            task (any): The task.
+            waited (float): Seconds it spent in the queue.
+            elapsed (float): Seconds it spent running.
+        """
+        pass
+
+    def on_queue_full(self, task):
+        """
+        Called when enqueue() turns a task away. Does nothing by default.
+        """
         pass
 
     async def on_start(self):
@@ -40,3 +231,80 @@ class TaskMaster:
 
     async def on_stop(self):
         pass
+
+
+class OffloadResult:
+    """
+    The outcome of work done outside the event loop, queued as a task for the TaskMaster that
+    asked for it, so it's handled in order with that TaskMaster's other tasks.
+
+    Args:
+        callback (callable): Called as callback(result, error), and awaited if it returns a
+            coroutine. error is None on success, and result is None on failure.
+        future (asyncio.Future): The finished work.
+    """
+
+    __slots__ = ["callback", "result", "error"]
+
+    def __init__(self, callback: Callable, future: asyncio.Future):
+        self.callback = callback
+        self.result = None
+        self.error: Optional[BaseException] = None
+        if future.cancelled():
+            self.error = asyncio.CancelledError()
+        elif (error := future.exception()) is not None:
+            self.error = error
+        else:
+            self.result = future.result()
+
+    async def deliver(self):
+        ret = self.callback(self.result, self.error)
+        if asyncio.iscoroutine(ret):
+            await ret
+
+
+class TaskPool:
+    """
+    A fixed number of worker coroutines shared by any number of TaskMasters, in place of a task
+    per TaskMaster. TaskMasters with work to do wait in one ready queue; a worker takes the
+    first, runs one step of it, and sends it to the back of the queue if it has more.
+
+    Args:
+        workers (int): How many worker coroutines to run. This is how many TaskMasters can be
+            in the middle of a task at once.
+    """
+
+    def __init__(self, workers: int = 16):
+        self.workers = max(1, workers)
+        self.ready: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = list()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        if not self._tasks:
+            self.ready = asyncio.Queue()
+            self._tasks = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = list()
+
+    def schedule(self, master: TaskMaster):
+        self.ready.put_nowait(master)
+
+    async def work(self):
+        ready = self.ready
+        while True:
+            master = await ready.get()
+            try:
+                await master.step()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # step() handles its tasks' errors itself, so this came from on_stop(), after
+                # the TaskMaster was already done. The worker lives on for everyone else.
+                traceback.print_exc(file=sys.stdout)
@@ -0,0 +1,216 @@
+import sys
+import math
+import traceback
+
+from typing import Any, Callable, Dict, List, Optional
+from athanor.app import Service
+
+# Slots per level of the wheel, as powers of two. The first level has one slot per tick and each
+# later level one slot per whole turn of the level before it, so at 10ms ticks the levels reach
+# 2.56 seconds, 2.7 minutes, 2.9 hours, 7.8 days and 497 days. Timers further out than that wait
+# in the last level, going round it again until they're in range.
+LEVEL_BITS = (8, 6, 6, 6, 6)
+_SHIFTS = tuple(sum(LEVEL_BITS[:i]) for i in range(len(LEVEL_BITS)))
+_MASKS = tuple((1 << bits) - 1 for bits in LEVEL_BITS)
+_LIMITS = tuple(1 << (shift + bits) for shift, bits in zip(_SHIFTS, LEVEL_BITS))
+MAX_TICKS = _LIMITS[-1] - 1
+
+
+class Timer:
+    """
+    A pending call, as returned by TimerService.call_later() and friends. Keep it to cancel it.
+    """
+
+    __slots__ = ["expires", "callback", "args", "key", "data", "slot"]
+
+    def __init__(self, expires: int, callback: Optional[Callable], args=(), key: Optional[str] = None, data=None):
+        self.expires = expires
+        self.callback = callback
+        self.args = args
+        # Set for persistent timers: the name of their handler, and what it's called with.
+        self.key = key
+        self.data = data
+        # The wheel slot holding us, while we're pending.
+        self.slot: Optional[Dict["Timer", None]] = None
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} tick {self.expires}: {self.key or self.callback}>"
+
+    @property
+    def pending(self) -> bool:
+        return self.slot is not None
+
+    def cancel(self):
+        if self.slot is not None:
+            del self.slot[self]
+            self.slot = None
+
+
+class TimerService(Service):
+    """
+    A hierarchical timer wheel for delayed game events: buffs wearing off, respawns, cooldowns.
+    Scheduling and cancelling are O(1) whatever the number of timers, and the wheel is turned by
+    the Application's main loop, one slot per tick, so its resolution is config.interval.
+
+    Timers made with schedule() are persistent: rather than a callback, they name a handler
+    registered with register_handler() and carry JSON-friendly data, so dump() can write them
+    out and restore() can bring them back after a reboot. save_timers() and load_timers() are the
+    hooks for where they go; by default, nowhere.
+    """
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.app.timers = self
+        self.wheel: List[List[Dict[Timer, None]]] = [[dict() for _ in range(1 << bits)] for bits in LEVEL_BITS]
+        # The next tick to be processed.
+        self.tick: int = 0
+        self.resolution: float = 0.01
+        self.handlers: Dict[str, Callable] = dict()
+
+    def setup(self):
+        self.resolution = self.app.interval
+
+    async def async_setup(self):
+        self.restore(self.load_timers())
+
+    def update(self, now: float, delta: float):
+        self.advance(self.app.tick)
+
+    def ticks_for(self, delay: float) -> int:
+        """
+        Converts a delay in seconds to whole ticks, rounding up so nothing ever fires early.
+        """
+        return max(0, math.ceil(delay / self.resolution - 1e-9))
+
+    def call_later(self, delay: float, callback: Callable, *args) -> Timer:
+        """
+        Calls callback(*args) once delay seconds have passed.
+
+        Returns:
+            timer (Timer): Call its cancel() to cancel it.
+        """
+        timer = Timer(self.tick + self.ticks_for(delay), callback, args)
+        self._insert(timer)
+        return timer
+
+    def schedule(self, delay: float, key: str, data: Any = None) -> Timer:
+        """
+        Like call_later(), but persistent: calls the handler registered for key with data.
+        """
+        if key not in self.handlers:
+            raise ValueError(f"No timer handler registered for: {key}")
+        timer = Timer(self.tick + self.ticks_for(delay), None, key=key, data=data)
+        self._insert(timer)
+        return timer
+
+    def register_handler(self, key: str, handler: Callable[[Any], Any]):
+        self.handlers[key] = handler
+
+    def _insert(self, timer: Timer):
+        remaining = timer.expires - self.tick
+        if remaining < 0:
+            timer.expires = self.tick
+            remaining = 0
+        # Past MAX_TICKS, this falls through to the last level. Its slot comes round before the
+        # timer's due, and it's re-filed from there, until it's close enough to go lower.
+        for level, limit in enumerate(_LIMITS):
+            if remaining < limit:
+                break
+        slot = self.wheel[level][(timer.expires >> _SHIFTS[level]) & _MASKS[level]]
+        slot[timer] = None
+        timer.slot = slot
+
+    def __len__(self):
+        """
+        How many timers are pending.
+        """
+        return sum(len(slot) for level in self.wheel for slot in level)
+
+    def advance(self, tick: int):
+        """
+        Turns the wheel up to and including tick, firing everything that's due, in order.
+        """
+        wheel = self.wheel
+        level0 = wheel[0]
+        mask0 = _MASKS[0]
+        while self.tick <= tick:
+            now = self.tick
+            index = now & mask0
+            if index == 0:
+                self._cascade(now)
+            slot = level0[index]
+            if slot:
+                level0[index] = dict()
+                self.tick = now + 1
+                # Taken out one at a time as they fire, so a callback can still cancel another
+                # timer due on this tick.
+                while slot:
+                    timer = next(iter(slot))
+                    del slot[timer]
+                    timer.slot = None
+                    self._fire(timer)
+            else:
+                self.tick = now + 1
+
+    def _cascade(self, now: int):
+        """
+        The first level has come round again: re-file the next slot of each level above into
+        the levels below, for as many levels as have also come round.
+        """
+        wheel = self.wheel
+        for level in range(1, len(LEVEL_BITS)):
+            index = (now >> _SHIFTS[level]) & _MASKS[level]
+            slot = wheel[level][index]
+            if slot:
+                wheel[level][index] = dict()
+                for timer in slot:
+                    self._insert(timer)
+            if index:
+                break
+
+    def _fire(self, timer: Timer):
+        try:
+            if timer.key is not None:
+                self.handlers[timer.key](timer.data)
+            else:
+                timer.callback(*timer.args)
+        except Exception:
+            traceback.print_exc(file=sys.stdout)
+
+    def dump(self) -> List[Dict[str, Any]]:
+        """
+        Returns the pending persistent timers, with the seconds each has left.
+        """
+        out = list()
+        for level in self.wheel:
+            for slot in level:
+                for timer in slot:
+                    if timer.key is not None:
+                        remaining = (timer.expires - self.tick) * self.resolution
+                        out.append({"key": timer.key, "data": timer.data, "remaining": remaining})
+        return out
+
+    def restore(self, entries: List[Dict[str, Any]]):
+        """
+        Re-schedules persistent timers from dump(). Those whose handler is gone are dropped.
+        """
+        for entry in entries or ():
+            if entry["key"] in self.handlers:
+                self.schedule(entry["remaining"], entry["key"], entry.get("data", None))
+
+    def persist(self):
+        """
+        Hands dump() to save_timers(). Call this before shutting down, or periodically.
+        """
+        self.save_timers(self.dump())
+
+    def save_timers(self, entries: List[Dict[str, Any]]):
+        """
+        Stores persistent timers somewhere. Does nothing by default.
+        """
+
+    def load_timers(self) -> List[Dict[str, Any]]:
+        """
+        Returns whatever save_timers() stored, for restore(). Nothing by default.
+        """
+        return list()
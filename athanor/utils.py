@@ -1,8 +1,12 @@
 import importlib
+import logging
+import logging.handlers
+import queue
 import uuid
 import typing
 import random
 import string
+import time
 
 
 def import_from_module(path: str) -> typing.Any:
@@ -222,3 +226,144 @@ def generate_name(prefix: str, existing, gen_length: int = 20):
     while attempt in existing:
         attempt = f"{prefix}{''.join(random.choices(string.ascii_letters + string.digits, k=gen_length))}"
     return attempt
+
+
+class EventBuffer(list):
+    """
+    A list that calls a wake-up function whenever something is appended to it. Used for the
+    event lists that producers (connections) fill and a single flusher task drains, so the
+    flusher can sleep until there's actually work for it.
+    """
+
+    __slots__ = ["wake"]
+
+    def __init__(self, wake: typing.Callable[[], None]):
+        super().__init__()
+        self.wake = wake
+
+    def append(self, item):
+        super().append(item)
+        self.wake()
+
+    def extend(self, items):
+        size = len(self)
+        super().extend(items)
+        if len(self) > size:
+            self.wake()
+
+
+class TokenBucket:
+    """
+    A rate limiter that allows rate units per second on average, in bursts of up to burst.
+
+    Args:
+        rate (float): Units refilled per second.
+        burst (float): Most units that can be saved up. Defaults to one second's worth.
+    """
+
+    __slots__ = ["rate", "burst", "tokens", "stamp"]
+
+    def __init__(self, rate: float, burst: typing.Optional[float] = None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+
+    @classmethod
+    def from_config(cls, rate: typing.Optional[float], burst: typing.Optional[float] = None):
+        """
+        Returns a TokenBucket, or None if rate is 0 or None, meaning unlimited.
+        """
+        if not rate:
+            return None
+        return cls(float(rate), float(burst) if burst else None)
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def available(self, amount: float = 1) -> bool:
+        """
+        Whether amount could be taken right now, without taking it.
+        """
+        self.refill()
+        return self.tokens >= amount
+
+    def take(self, amount: float = 1) -> bool:
+        """
+        Takes amount if there's that much available.
+
+        Returns:
+            taken (bool): False if there wasn't enough, in which case nothing is taken.
+        """
+        self.refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def debit(self, amount: float) -> float:
+        """
+        Takes amount whether it's available or not, going into debt if need be. For things that
+        have already happened, like bytes that have already been read.
+
+        Returns:
+            delay (float): Seconds until the bucket is out of debt. 0 if it isn't in debt.
+        """
+        self.refill()
+        self.tokens -= amount
+        if self.tokens < 0:
+            return -self.tokens / self.rate
+        return 0.0
+
+
+# Argument types that can't change after the fact, so a log message using only these can be
+# formatted later, on the writer's thread.
+_IMMUTABLE_ARGS = (str, int, float, bool, bytes, type(None))
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands log records to a QueueListener's thread, which formats them and does the disk I/O,
+    so logging from the event loop never blocks on a file. The queue is bounded: once it's full,
+    records are thrown away and counted in dropped rather than making the caller wait.
+
+    Args:
+        maxsize (int): Most records that may wait for the writer.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        super().__init__(queue.Queue(maxsize))
+        self.dropped: int = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Unlike QueueHandler's, leaves formatting to the writer where that's safe. Messages with
+        arguments that could change before then, and tracebacks, are rendered now.
+        """
+        args = record.args
+        if args and not (isinstance(args, tuple) and all(isinstance(a, _IMMUTABLE_ARGS) for a in args)):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogWriter(logging.handlers.QueueListener):
+    """
+    The thread behind a BoundedQueueHandler. stop() waits for room in a full queue, rather than
+    failing, so everything queued before it is still written.
+    """
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
@@ -8,14 +8,69 @@ class Config(BaseConfig):
         self.process_name = "Athanor Portal"
         self.application = "athanor_portal.app.Application"
         self.listeners = dict()
+        self.net = dict()
+        if self.worker is not None:
+            self.process_name = f"{self.process_name} {self.worker}"
 
     def setup(self):
         super().setup()
         self._config_listeners()
+        self._config_net()
+        self._config_worker()
 
     def _config_listeners(self):
         self.listeners["telnet"] = {"interface": "any", "port": 7999, "protocol": 0}
 
+    def _config_net(self):
+        self.net = {
+            # Seconds to hold inbound events after the first one arrives, so bursts get batched
+            # into one link message. 0 ships them on the next pass of the event loop.
+            "in_batch_window": 0.0,
+            # Seconds a new connection gets to negotiate before it's announced to the server.
+            "ready_delay": 0.3,
+            # Bind listeners with SO_REUSEPORT, so other processes can bind the same ones.
+            "reuse_port": False,
+            # Output to a client is collected and written once per pass of the event loop, or
+            # right away once this many bytes are waiting.
+            "write_threshold": 64 * 1024,
+            # How many bytes may wait for a client that's stopped reading before it's dropped.
+            "max_output_buffer": 4 * 1024 * 1024,
+            # Limits on what each client may send. Rates are token buckets: *_per_sec sustained,
+            # *_burst saved up (defaults to one second's worth). 0 means unlimited, which is the
+            # default for the rates. A client over its byte rate stops being read from until it's
+            # caught up; lines over the line rate are dropped; a line longer than max_line_length
+            # is thrown away. The client is told when its input is dropped.
+            # A listener's config may override these with its own "conn_limits", and may set
+            # "limits" with bytes_per_sec/lines_per_sec for all its connections put together.
+            "conn_limits": {
+                "bytes_per_sec": 0,
+                "bytes_burst": 0,
+                "lines_per_sec": 0,
+                "lines_burst": 0,
+                "max_line_length": 16 * 1024,
+            },
+            # Defaults for WebSocket listeners, which a listener's config may override with its
+            # own "websocket". compression turns on permessage-deflate, which shrinks text output
+            # several times over but costs CPU and about 2**window_bits + 2**(mem_level + 9)
+            # bytes per client each way. max_size is the biggest frame a client may send.
+            "websocket": {
+                "compression": False,
+                "window_bits": 12,
+                "mem_level": 5,
+                "max_size": 64 * 1024,
+            },
+        }
+
+    def _config_worker(self):
+        """
+        Called last. If this is one of several Portal workers, gives it its own link and shares
+        the listeners with the others.
+        """
+        if self.worker is None:
+            return
+        self.link.update(self.worker_link(self.worker))
+        self.net["reuse_port"] = True
+
     def _config_classes(self):
         self.classes["services"]["net"] = "athanor_portal.net.NetService"
         self.classes["services"]["link"] = "athanor_portal.link.LinkService"
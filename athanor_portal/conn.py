@@ -1,7 +1,9 @@
+import asyncio
 import random
 import string
 import time
-from typing import List
+from typing import List, Optional
+from athanor.utils import TokenBucket
 from athanor.shared import (
     ConnectionDetails,
     ConnectionInMessageType,
@@ -11,23 +13,39 @@ from athanor.shared import (
     MudProtocol,
 )
 
+# What a client is told when some of its input is thrown away, by the reason it was.
+DROP_NOTICES = {
+    "lines": "You're sending commands too quickly. Some were ignored.",
+    "overlong": "That line was too long, and was ignored.",
+}
+
 
 class MudConnection:
     def __init__(self, listener):
         self.listener = listener
         self.conn_id: str = self.generate_name()
-        self.details = ConnectionDetails()
-        self.details.client_id = self.conn_id
-        self.details.protocol = listener.protocol
+        self.details = ConnectionDetails(protocol=listener.protocol, client_id=self.conn_id)
         self.created = time.time()
         self.running: bool = False
         self.started: bool = False
         self.ended: bool = False
         self.tls = bool(listener.ssl_context)
         self.in_events: List[ConnectionInMessage] = listener.service.in_conn_events
+        self.ready_timer: Optional[asyncio.TimerHandle] = None
+        limits = listener.conn_limits
+        self.bytes_bucket = TokenBucket.from_config(limits.get("bytes_per_sec"), limits.get("bytes_burst"))
+        self.lines_bucket = TokenBucket.from_config(limits.get("lines_per_sec"), limits.get("lines_burst"))
+        self.max_line_length: int = int(limits.get("max_line_length", 0) or 0)
+        # Set once the client's been told its input is being dropped. Cleared when a line gets
+        # through, so a flood gets one notice rather than one per line.
+        self.drop_notified: bool = False
+        # When metrics are kept: the service's input-to-output histogram, and when the oldest
+        # input that hasn't been answered yet arrived.
+        self.response_time = listener.service.response_time
+        self.input_time: float = 0.0
 
     def generate_name(self) -> str:
-        prefix = f"{self.listener.name}_"
+        prefix = f"{self.listener.service.id_prefix}{self.listener.name}_"
 
         attempt = f"{prefix}{''.join(random.choices(string.ascii_letters + string.digits, k=20))}"
         while attempt in self.listener.service.mudconnections:
@@ -37,13 +55,93 @@ class MudConnection:
     def process_out_event(self, ev: ConnectionOutMessage):
         pass
 
+    def throttle(self, size: int) -> float:
+        """
+        Charges size bytes of input against this connection's and its listener's byte rates.
+
+        Returns:
+            delay (float): Seconds to stop reading from the client for, so it stays within them.
+        """
+        delay = 0.0
+        for bucket in (self.bytes_bucket, self.listener.bytes_bucket):
+            if bucket:
+                delay = max(delay, bucket.debit(size))
+        if delay:
+            self.listener.record_drop("throttled")
+        return delay
+
+    def allow_line(self) -> bool:
+        """
+        Charges one line of input against this connection's and its listener's line rates.
+
+        Returns:
+            allowed (bool): False if the line should be dropped.
+        """
+        conn_bucket, listener_bucket = self.lines_bucket, self.listener.lines_bucket
+        # Nothing is taken from either unless both have room, so a line dropped by one limit
+        # isn't charged against the other.
+        if (conn_bucket and not conn_bucket.available()) or (listener_bucket and not listener_bucket.available()):
+            self.input_dropped("lines")
+            return False
+        if conn_bucket:
+            conn_bucket.take()
+        if listener_bucket:
+            listener_bucket.take()
+        self.drop_notified = False
+        return True
+
+    def input_dropped(self, reason: str):
+        """
+        Counts some of the client's input as dropped, and tells the client so, unless it's been
+        told already.
+
+        Args:
+            reason (str): Why it was dropped. A key of the listener's drops.
+        """
+        self.listener.record_drop(reason)
+        if self.drop_notified or not (notice := DROP_NOTICES.get(reason, None)):
+            return
+        self.drop_notified = True
+        self.process_out_event(ConnectionOutMessage(ConnectionOutMessageType.GAMEDATA, self.conn_id,
+                                                    [("line", (notice,), dict())]))
+
+    def start_ready_timer(self):
+        """
+        Gives the connection a grace period to finish negotiating before check_ready() is called.
+        """
+        delay = self.listener.service.ready_delay
+        self.ready_timer = asyncio.get_event_loop().call_later(delay, self.check_ready)
+
     def on_start(self):
         self.started = True
+        if self.ready_timer:
+            self.ready_timer.cancel()
+            self.ready_timer = None
         self.in_events.append(
             ConnectionInMessage(
                 ConnectionInMessageType.READY, self.conn_id, self.details
             )
         )
 
+    def on_end(self):
+        """
+        Called when the client goes away. Tells the server, if it knows about us, and
+        unregisters the connection.
+        """
+        if self.ended:
+            return
+        self.ended = True
+        self.running = False
+        if self.ready_timer:
+            self.ready_timer.cancel()
+            self.ready_timer = None
+        if self.started:
+            self.in_events.append(
+                ConnectionInMessage(
+                    ConnectionInMessageType.DISCONNECT, self.conn_id, None
+                )
+            )
+        self.listener.service.mudconnections.pop(self.conn_id, None)
+
     def check_ready(self):
         pass
@@ -2,31 +2,47 @@ import asyncio
 import os
 
 from athanor.shared import LinkServiceServer, PortalOutMessageType, PortalOutMessage
-from athanor.shared import ServerInMessageType, ServerInMessage
+from athanor.shared import ServerInMessageType, ServerInMessage, choose_codec
 
 
 class LinkService(LinkServiceServer):
-    async def message_from_link(self, message):
-        if not message:
+    in_message_class = PortalOutMessage
+
+    async def message_from_link(self, msg: PortalOutMessage, link):
+        if not msg:
             return
-        msg: PortalOutMessage = PortalOutMessage.from_dict(message)
         if msg.msg_type == PortalOutMessageType.HELLO:
             data = [
                 c.details.to_dict()
                 for c in self.app.net.mudconnections.values()
                 if c.started
             ]
-            out_msg = ServerInMessage(ServerInMessageType.HELLO, os.getpid(), data)
-            await self.link.outbox.put(out_msg)
+            if isinstance(msg.data, dict) and "codecs" in msg.data:
+                # The server can speak something better than json. Answer in json, then switch.
+                codec = choose_codec(self.codecs, msg.data["codecs"])
+                batching = bool(msg.data.get("batch", False))
+                data = {"codec": codec.name, "batch": batching, "connections": data, **self.resume_data(link)}
+                out_msg = ServerInMessage(ServerInMessageType.HELLO, os.getpid(), data)
+                await link.outbox.put(link.codec.encode(out_msg))
+                link.codec = codec
+                link.batching = batching
+                await self.resume_link(link, msg.data.get("received", None))
+            else:
+                out_msg = ServerInMessage(ServerInMessageType.HELLO, os.getpid(), data)
+                await link.outbox.put(out_msg)
+                await self.resume_link(link, None)
         else:
             await self.app.net.out_events.put(msg)
 
+    def link_message(self, msg_type: int, data):
+        return ServerInMessage(ServerInMessageType(msg_type), os.getpid(), data)
+
     async def handle_in_events(self):
         while True:
             msg = await self.in_events.get()
             while msg:
-                if self.link:
-                    await self.link.outbox.put(msg)
+                if self.link_ready:
+                    await self.link.send(msg)
                     msg = None
                 else:
                     await asyncio.sleep(0.1)
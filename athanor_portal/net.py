@@ -2,10 +2,13 @@ import ssl
 import asyncio
 import websockets
 import os
+import time
 
-from typing import Optional, Dict
+from typing import Optional, Dict, Any
 from enum import IntEnum
+from collections import Counter
 from athanor.app import Service
+from athanor.utils import EventBuffer, TokenBucket
 
 from athanor.shared import PortalOutMessageType
 from athanor.shared import (
@@ -17,7 +20,7 @@ from athanor.shared import (
 
 from .conn import MudConnection
 from .telnet import TelnetMudConnection
-from .websocket import WebSocketConnection
+from .websocket import WebSocketConnection, websocket_options
 
 
 class MudProtocol(IntEnum):
@@ -34,6 +37,11 @@ class MudListener:
         "protocol",
         "ssl_context",
         "server",
+        "conn_limits",
+        "bytes_bucket",
+        "lines_bucket",
+        "drops",
+        "websocket",
     ]
 
     def __init__(
@@ -44,6 +52,9 @@ class MudListener:
         port: int,
         protocol: MudProtocol,
         ssl_context: Optional[ssl.SSLContext] = None,
+        conn_limits: Optional[Dict[str, Any]] = None,
+        limits: Optional[Dict[str, Any]] = None,
+        websocket: Optional[Dict[str, Any]] = None,
     ):
         self.service: "NetService" = service
         self.name: str = name
@@ -52,6 +63,19 @@ class MudListener:
         self.protocol: MudProtocol = protocol
         self.ssl_context: Optional[ssl.SSLContext] = ssl_context
         self.server = None
+        # Input limits for each of this listener's connections, and for all of them together.
+        self.conn_limits: Dict[str, Any] = conn_limits or dict()
+        limits = limits or dict()
+        self.bytes_bucket = TokenBucket.from_config(limits.get("bytes_per_sec"), limits.get("bytes_burst"))
+        self.lines_bucket = TokenBucket.from_config(limits.get("lines_per_sec"), limits.get("lines_burst"))
+        # What the limits have done to this listener's connections, by kind.
+        self.drops = Counter()
+        # Settings for WebSocket listeners. See websocket_options().
+        self.websocket: Dict[str, Any] = websocket or dict()
+
+    def record_drop(self, kind: str, amount: int = 1):
+        self.drops[kind] += amount
+        self.service.drops[kind] += amount
 
     async def async_setup(self):
         if self.protocol == MudProtocol.TELNET:
@@ -61,11 +85,17 @@ class MudListener:
                 self.interface,
                 self.port,
                 ssl=self.ssl_context,
+                reuse_port=self.service.reuse_port or None,
                 start_serving=False,
             )
         elif self.protocol == MudProtocol.WEBSOCKET:
-            self.server = websockets.serve(
-                self.accept_websocket, self.interface, self.port, ssl=self.ssl_context
+            self.server = await websockets.serve(
+                self.accept_websocket,
+                self.interface,
+                self.port,
+                ssl=self.ssl_context,
+                reuse_port=self.service.reuse_port or None,
+                **websocket_options(self.websocket),
             )
 
     def accept_telnet(self):
@@ -82,7 +112,7 @@ class MudListener:
         if self.protocol == MudProtocol.TELNET:
             await self.server.serve_forever()
         elif self.protocol == MudProtocol.WEBSOCKET:
-            await self.server
+            await self.server.wait_closed()
 
 
 class NetService(Service):
@@ -106,8 +136,25 @@ class NetService(Service):
         self.mudconnections: Dict[str, MudConnection] = dict()
         self.in_events: Optional[asyncio.Queue] = None
         self.out_events: Optional[asyncio.Queue] = None
-        self.in_conn_events = list()
+        self.in_conn_events = EventBuffer(self.wake_in_events)
         self.out_conn_events = list()
+        self.in_events_ready: Optional[asyncio.Event] = None
+        self.in_batch_window: float = 0.0
+        self.ready_delay: float = 0.3
+        # Prepended to every connection id, so they're unique across Portals.
+        self.id_prefix: str = ""
+        self.reuse_port: bool = False
+        self.write_threshold: int = 64 * 1024
+        self.max_output_buffer: int = 4 * 1024 * 1024
+        # Input limit defaults for every connection, and what they've done across all listeners.
+        self.conn_limits: Dict[str, Any] = dict()
+        self.drops = Counter()
+        # WebSocket listener defaults.
+        self.websocket: Dict[str, Any] = dict()
+        # Metrics, if the Application keeps them.
+        self.events_in = None
+        self.events_out = None
+        self.response_time = None
 
     def register_listener(
         self,
@@ -116,6 +163,9 @@ class NetService(Service):
         port: int,
         protocol: MudProtocol,
         ssl_context: Optional[str] = None,
+        conn_limits: Optional[Dict[str, Any]] = None,
+        limits: Optional[Dict[str, Any]] = None,
+        websocket: Optional[Dict[str, Any]] = None,
     ):
         if name in self.listeners:
             raise ValueError(f"A Listener is already using name: {name}")
@@ -129,10 +179,37 @@ class NetService(Service):
         use_ssl = self.app.config.tls_contexts.get(ssl_context, None)
         if ssl_context and not use_ssl:
             raise ValueError(f"SSL Context not registered: {ssl_context}")
-        listener = MudListener(self, name, host, port, protocol, ssl_context=use_ssl)
+        listener = MudListener(
+            self,
+            name,
+            host,
+            port,
+            protocol,
+            ssl_context=use_ssl,
+            conn_limits={**self.conn_limits, **(conn_limits or dict())},
+            limits=limits,
+            websocket={**self.websocket, **(websocket or dict())},
+        )
         self.listeners[name] = listener
 
     def setup(self):
+        net_conf = self.app.config.net
+        self.in_batch_window = float(net_conf.get("in_batch_window", 0.0))
+        self.ready_delay = float(net_conf.get("ready_delay", 0.3))
+        self.id_prefix = f"{self.app.config.link.get('name', 'portal')}:"
+        self.reuse_port = bool(net_conf.get("reuse_port", False))
+        self.write_threshold = int(net_conf.get("write_threshold", 64 * 1024))
+        self.max_output_buffer = int(net_conf.get("max_output_buffer", 4 * 1024 * 1024))
+        self.conn_limits = dict(net_conf.get("conn_limits", dict()))
+        self.websocket = dict(net_conf.get("websocket", dict()))
+        if (metrics := self.app.metrics):
+            self.events_in = metrics.counter("net.events_in")
+            self.events_out = metrics.counter("net.events_out")
+            # From a client's input to the first output sent back to it after.
+            self.response_time = metrics.histogram("net.response_time")
+            metrics.gauge("net.connections", lambda: len(self.mudconnections))
+            metrics.gauge("net.pending_in", lambda: len(self.in_conn_events))
+            metrics.gauge("net.drops", lambda: sum(self.drops.values()))
         for name, config in self.app.config.listeners.items():
             try:
                 protocol = MudProtocol(config.get("protocol", -1))
@@ -144,11 +221,15 @@ class NetService(Service):
                 config.get("port", -1),
                 protocol,
                 config.get("ssl", None),
+                config.get("conn_limits", None),
+                config.get("limits", None),
+                config.get("websocket", None),
             )
 
     async def async_setup(self):
         self.in_events = asyncio.Queue()
         self.out_events = asyncio.Queue()
+        self.in_events_ready = asyncio.Event()
         for listener in self.listeners.values():
             await listener.async_setup()
 
@@ -165,37 +246,48 @@ class NetService(Service):
             ended = set()
             msg = await self.out_events.get()
             if msg.msg_type == PortalOutMessageType.EVENTS:
-                for ev_dict in msg.data:
-                    conn_out_msg = ConnectionOutMessage.from_dict(ev_dict)
+                if self.events_out is not None:
+                    self.events_out.inc(len(msg.data))
+                for conn_out_msg in msg.data:
                     if (conn := self.mudconnections.get(conn_out_msg.client_id, None)) :
                         if conn_out_msg.msg_type == ConnectionOutMessageType.DISCONNECT:
                             ended.add(conn)
+                        elif conn.input_time and conn_out_msg.msg_type == ConnectionOutMessageType.GAMEDATA:
+                            self.response_time.record(time.perf_counter() - conn.input_time)
+                            conn.input_time = 0.0
                         conn.process_out_event(conn_out_msg)
             elif msg.msg_type == PortalOutMessageType.HELLO:
                 pass
             elif msg.msg_type == PortalOutMessageType.SYSTEM:
                 pass
+            self.app.link.complete(msg)
 
             for conn in ended:
                 self.mudconnections.pop(conn.conn_id, None)
 
-    async def poll_in_events(self):
+    def wake_in_events(self):
+        """
+        Called whenever a MudConnection queues an inbound event.
+        """
+        if self.in_events_ready:
+            self.in_events_ready.set()
 
+    async def poll_in_events(self):
+        """
+        Sleeps until connections have queued inbound events, then ships them all to the link as
+        one EVENTS message. If in_batch_window is set, waits that long after the first event so
+        that bursts from many connections share a message.
+        """
         while True:
-            ended = {conn for conn in self.mudconnections.values() if conn.ended}
-            not_ready = {
-                conn for conn in self.mudconnections.values() if not conn.started
-            }
-            for conn in not_ready:
-                conn.check_ready()
+            await self.in_events_ready.wait()
+            if self.in_batch_window > 0:
+                await asyncio.sleep(self.in_batch_window)
+            self.in_events_ready.clear()
 
             if self.in_conn_events:
-                data = [ev.to_dict() for ev in self.in_conn_events]
+                data = list(self.in_conn_events)
+                self.in_conn_events.clear()
+                if self.events_in is not None:
+                    self.events_in.inc(len(data))
                 msg = ServerInMessage(ServerInMessageType.EVENTS, os.getpid(), data)
                 await self.app.link.in_events.put(msg)
-                self.in_conn_events.clear()
-
-            for conn in ended:
-                self.mudconnections.pop(conn.conn_id, None)
-
-            await asyncio.sleep(0.1)
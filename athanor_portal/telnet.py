@@ -1,15 +1,67 @@
 import time
+import asyncio
 
 from asyncio import Protocol, transports
-from typing import Optional, Union, Dict, Set, List
+from typing import Optional, Union, Dict, Set, List, Any, Tuple
 
-from mudtelnet import TelnetFrame, TelnetConnection, TelnetOutMessage, TelnetOutMessageType
-from mudtelnet import TelnetInMessage, TelnetInMessageType
+from mudtelnet import TelnetFrame, TelnetFrameType, TelnetConnection, TelnetOutMessage, TelnetOutMessageType
+from mudtelnet import TelnetInMessage, TelnetInMessageType, TC, NEGOTIATORS
 from athanor.shared import COLOR_MAP
 from athanor.shared import ConnectionInMessageType, ConnectionOutMessage, ConnectionInMessage, ConnectionOutMessageType
 
 from .conn import MudConnection
 
+_IAC = int(TC.IAC)
+_SB = int(TC.SB)
+_IAC_BYTE = bytes([_IAC])
+_IAC_SE = bytes([_IAC, int(TC.SE)])
+_NEGOTIATORS = frozenset(int(n) for n in NEGOTIATORS)
+# TC.from_int() for every byte, since enum lookups are most of the cost of parsing negotiation.
+_CODES = tuple(TC.from_int(i) for i in range(256))
+
+
+def next_frame(buffer: bytearray, pos: int) -> Tuple[Optional[TelnetFrame], int]:
+    """
+    Parses the telnet frame starting at buffer[pos], without modifying the buffer. This does what
+    TelnetFrame.parse_consume() does, but leaves it to the caller to throw away what's been
+    parsed, so that can happen once for a whole read instead of once per frame.
+
+    Args:
+        buffer (bytearray): Bytes received so far.
+        pos (int): Where to start.
+
+    Returns:
+        frame (TelnetFrame or None): The frame, or None if more bytes are needed.
+        pos (int): Where the next frame starts.
+    """
+    end = len(buffer)
+    if pos >= end:
+        return None, pos
+    if buffer[pos] != _IAC:
+        idx = buffer.find(_IAC_BYTE, pos)
+        if idx == -1:
+            idx = end
+        return TelnetFrame(TelnetFrameType.DATA, buffer[pos:idx]), idx
+    if end - pos < 2:
+        return None, pos
+    cmd = buffer[pos + 1]
+    if cmd == _IAC:
+        # An escaped 255 in the data.
+        return TelnetFrame(TelnetFrameType.DATA, _IAC_BYTE), pos + 2
+    if cmd in _NEGOTIATORS:
+        if end - pos < 3:
+            return None, pos
+        return TelnetFrame(TelnetFrameType.NEGOTIATION, (_CODES[cmd], _CODES[buffer[pos + 2]])), pos + 3
+    if cmd == _SB:
+        if end - pos < 5:
+            return None, pos
+        idx = buffer.find(_IAC_SE, pos + 3)
+        if idx == -1:
+            return None, pos
+        frame = TelnetFrame(TelnetFrameType.SUBNEGOTIATION, (_CODES[buffer[pos + 2]], buffer[pos + 3:idx]))
+        return frame, idx + 2
+    return TelnetFrame(TelnetFrameType.COMMAND, _CODES[cmd]), pos + 2
+
 
 class TelnetMudConnection(MudConnection, Protocol):
 
@@ -20,6 +72,17 @@ class TelnetMudConnection(MudConnection, Protocol):
         self.telnet_pending_events: List[TelnetInMessage] = list()
         self.transport: Optional[transports.Transport] = None
         self.in_buffer = bytearray()
+        # Everything waiting to be written. It's flushed once per pass of the event loop, or as
+        # soon as it reaches the service's write_threshold. frame_buffer holds the response to
+        # one frame, since TelnetConnection decides whether to add a GA by whether it's empty.
+        self.out_buffer = bytearray()
+        self.frame_buffer = bytearray()
+        self.flush_handle: Optional[asyncio.Handle] = None
+        # Set while the transport's buffer is over its high watermark. Output piles up in
+        # out_buffer instead, up to the service's max_output_buffer.
+        self.write_paused: bool = False
+        # Set when a line went over max_line_length, so the rest of it is thrown away too.
+        self.discard_line: bool = False
 
     def on_start(self):
         super().on_start()
@@ -29,70 +92,149 @@ class TelnetMudConnection(MudConnection, Protocol):
             self.process_telnet_events()
 
     def check_ready(self):
-        if (time.time() - self.created) > 0.3:
+        self.ready_timer = None
+        if not self.started and not self.ended:
             self.on_start()
 
     def data_received(self, data: bytearray):
-        self.in_buffer.extend(data)
+        if (delay := self.throttle(len(data))):
+            self.transport.pause_reading()
+            asyncio.get_event_loop().call_later(delay, self.resume_reading)
+        buffer = self.in_buffer
+        buffer.extend(data)
+        out_buffer = self.out_buffer
+        frame_buffer = self.frame_buffer
+        telnet = self.telnet
+        patch = dict()
 
+        pos = 0
         while True:
-            frame = TelnetFrame.parse_consume(self.in_buffer)
+            frame, pos = next_frame(buffer, pos)
             if not frame:
                 break
             events_buffer = self.telnet_in_events if self.started else self.telnet_pending_events
-            out_buffer = bytearray()
-            changed = self.telnet.process_frame(frame, out_buffer, events_buffer)
-            if out_buffer:
-                self.transport.write(out_buffer)
+            changed = telnet.process_frame(frame, frame_buffer, events_buffer)
+            if frame_buffer:
+                out_buffer.extend(frame_buffer)
+                frame_buffer.clear()
             if changed:
-                self.update_details(changed)
-                if self.started:
-                    self.in_events.append(ConnectionInMessage(ConnectionInMessageType.UPDATE, self.conn_id,
-                                                              self.details))
+                patch.update(self.update_details(changed))
+        # Whatever's left is an incomplete frame.
+        del buffer[:pos]
+
+        if self.max_line_length and len(buffer) > self.max_line_length:
+            # A subnegotiation that never ends. There's no resyncing from that.
+            self.listener.record_drop("overlong")
+            buffer.clear()
+            self.transport.abort()
+            return
+
+        if out_buffer:
+            self.schedule_flush()
+
+        if patch and self.started:
+            self.in_events.append(ConnectionInMessage(ConnectionInMessageType.UPDATE, self.conn_id, patch))
 
         if self.telnet_in_events:
             self.process_telnet_events()
 
+        if self.max_line_length and len(telnet.cmdbuff) > self.max_line_length:
+            # Checked after the complete lines above have gone through, so they aren't mistaken
+            # for the rest of this one.
+            self.input_dropped("overlong")
+            telnet.cmdbuff.clear()
+            self.discard_line = True
+
     def connection_made(self, transport: transports.Transport) -> None:
         self.transport = transport
         addr, port = transport.get_extra_info('peername')
         self.details.host_address = addr
         self.details.host_port = port
-        out_buffer = bytearray()
-        self.telnet.start(out_buffer)
+        self.telnet.start(self.out_buffer)
         self.running = True
-        self.transport.write(out_buffer)
+        self.flush()
+        self.start_ready_timer()
+
+    def resume_reading(self):
+        if not self.ended:
+            self.transport.resume_reading()
 
-    def update_details(self, changed: dict):
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        if self.flush_handle:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        self.out_buffer.clear()
+        self.on_end()
+
+    def schedule_flush(self):
+        """
+        Arranges for out_buffer to be written. Anything else written before the event loop gets
+        back to us goes out with it, unless there's enough already to be worth writing now.
+        """
+        if len(self.out_buffer) >= self.listener.service.write_threshold:
+            self.flush()
+        elif not self.flush_handle:
+            self.flush_handle = asyncio.get_event_loop().call_soon(self.flush)
+
+    def flush(self):
+        if self.flush_handle:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        out_buffer = self.out_buffer
+        if not out_buffer or self.ended:
+            return
+        if self.write_paused:
+            # The client isn't reading. Its output can't be thrown away without corrupting an
+            # MCCP stream, so once too much has piled up, it's disconnected instead.
+            if len(out_buffer) > self.listener.service.max_output_buffer:
+                out_buffer.clear()
+                self.transport.abort()
+            return
+        self.transport.write(bytes(out_buffer))
+        out_buffer.clear()
+
+    def pause_writing(self) -> None:
+        self.write_paused = True
+
+    def resume_writing(self) -> None:
+        self.write_paused = False
+        if self.out_buffer:
+            self.schedule_flush()
+
+    def update_details(self, changed: dict) -> Dict[str, Any]:
+        """
+        Applies the changes reported by TelnetConnection.process_frame to self.details.
+
+        Returns:
+            patch (dict): The ConnectionDetails fields that actually changed, with their new values.
+        """
+        patch = dict()
         for k, v in changed.items():
             if k in ("local", "remote"):
-                for feature, value in v.items():
-                    setattr(self.details, feature, value)
+                patch.update(v)
             elif k == "naws":
-                self.details.width = v.get('width', 78)
-                self.details.height = v.get('height', 24)
+                patch["width"] = v.get('width', 78)
+                patch["height"] = v.get('height', 24)
             elif k == "mccp2":
-                for feature, val in v.items():
-                    if feature == "active":
-                        self.details.mccp2_active = val
+                if "active" in v:
+                    patch["mccp2_active"] = v["active"]
             elif k == "mccp3":
-                for feature, val in v.items():
-                    if feature == "active":
-                        self.details.mccp3_active = val
+                if "active" in v:
+                    patch["mccp3_active"] = v["active"]
             elif k == "mtts":
                 for feature, val in v.items():
                     if feature in ("ansi", "xterm256", "truecolor"):
+                        color = patch.get("color", self.details.color)
                         if not val:
-                            self.details.color = None
+                            color = None
                         else:
                             mapped = COLOR_MAP[feature]
-                            if not self.details.color:
-                                self.details.color = mapped
-                            else:
-                                if mapped > self.details.color:
-                                    self.details.color = mapped
+                            if not color or mapped > color:
+                                color = mapped
+                        patch["color"] = color
                     else:
-                        setattr(self.details, feature, val)
+                        patch[feature] = val
+        return self.details.apply_changes(patch)
 
     def telnet_in_to_conn_in(self, ev: TelnetInMessage):
         if ev.msg_type == TelnetInMessageType.LINE:
@@ -105,10 +247,24 @@ class TelnetMudConnection(MudConnection, Protocol):
         else:
             return None
 
+    def accept_line(self, ev: TelnetInMessage) -> bool:
+        if self.discard_line:
+            # The tail end of a line that was too long.
+            self.discard_line = False
+            return False
+        if self.max_line_length and len(ev.data) > self.max_line_length:
+            self.input_dropped("overlong")
+            return False
+        return self.allow_line()
+
     def process_telnet_events(self):
         for ev in self.telnet_in_events:
+            if ev.msg_type == TelnetInMessageType.LINE and not self.accept_line(ev):
+                continue
             msg = self.telnet_in_to_conn_in(ev)
             if msg:
+                if self.response_time is not None and msg.msg_type == ConnectionInMessageType.GAMEDATA:
+                    self.input_time = self.input_time or time.perf_counter()
                 self.in_events.append(msg)
         self.telnet_in_events.clear()
 
@@ -128,8 +284,8 @@ class TelnetMudConnection(MudConnection, Protocol):
         return out
 
     def process_out_event(self, ev: ConnectionOutMessage):
-        outbox = bytearray()
+        outbox = self.out_buffer
         for msg in self.conn_out_to_telnet_out(ev):
             self.telnet.process_out_message(msg, outbox)
         if outbox:
-            self.transport.write(outbox)
+            self.schedule_flush()
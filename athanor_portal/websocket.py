@@ -1,44 +1,192 @@
 import asyncio
+import time
+import orjson
 
-from websockets.exceptions import (
-    ConnectionClosedError,
-    ConnectionClosed,
-    ConnectionClosedOK,
-)
+from typing import Any, Dict, List, Optional
 
+from websockets.exceptions import ConnectionClosed
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+
+from athanor.shared import ConnectionInMessageType, ConnectionOutMessage, ConnectionInMessage, ConnectionOutMessageType
+from athanor.shared import ColorSystem
 from .conn import MudConnection
 
+# What a client may tell us about itself with the "client" command, and the type of each.
+CLIENT_FIELDS = {
+    "client_name": str,
+    "client_version": str,
+    "width": int,
+    "height": int,
+    "color": int,
+    "screen_reader": bool,
+    "mouse_tracking": bool,
+    "osc_color_palette": bool,
+    "vt100": bool,
+}
+
+
+def websocket_options(options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Turns a listener's websocket settings into keyword arguments for websockets.serve().
+    """
+    extensions = None
+    if options.get("compression", False):
+        bits = int(options.get("window_bits", 12))
+        extensions = [ServerPerMessageDeflateFactory(
+            server_max_window_bits=bits,
+            client_max_window_bits=bits,
+            compress_settings={"memLevel": int(options.get("mem_level", 5))},
+        )]
+    return {"compression": None, "extensions": extensions, "max_size": options.get("max_size", 64 * 1024)}
+
 
 class WebSocketConnection(MudConnection):
     """
-    TODO: Everything. Websockets are not ready yet!
+    A web client. Every frame, either way, is JSON made of commands in the same shape as
+    GAMEDATA events: [cmd, args, kwargs].
+
+    The client sends one command, or a list of them, per frame. A frame that isn't a JSON list
+    is taken to be a line of input, as ["line", [text], {}], with a JSON string decoded to its
+    text. Anything in a list that isn't a command is dropped. The "client" command's kwargs
+    update what we know about the client, such as its width, height and color support; see
+    CLIENT_FIELDS.
+
+    We send a list of commands per frame: everything queued for the client in one pass of the
+    event loop, or more while the client is slow to take it.
     """
 
     def __init__(self, listener, ws, path):
         super().__init__(listener)
         self.connection = ws
         self.path = path
-        self.outbox = asyncio.Queue()
-        self.task = None
+        # Encoded commands waiting to be sent, and how many bytes they come to.
+        self.out_buffer: List[bytes] = list()
+        self.out_size: int = 0
+        self.out_ready = asyncio.Event()
+        # Set by a DISCONNECT from the server. The writer closes the connection once it's sent
+        # what's left.
+        self.closing: bool = False
+        self.task: Optional[asyncio.Future] = None
+        self.details.utf8 = True
 
     async def run(self):
         self.running = True
-        self.task = asyncio.create_task(asyncio.gather(self.read(), self.write()))
-        await self.task
-        self.running = False
+        if (address := self.connection.remote_address):
+            self.details.host_address = address[0]
+            self.details.host_port = address[1]
+        # There's nothing to negotiate, so the client's ready straight away.
+        self.on_start()
+        self.task = asyncio.gather(self.read(), self.write())
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.out_buffer.clear()
+            self.on_end()
 
     async def read(self):
         try:
             async for message in self.connection:
-                await self.process(message)
-        except ConnectionClosedError:
-            self.task.cancel()
-        except ConnectionClosedOK:
-            self.task.cancel()
+                if (delay := self.throttle(len(message))):
+                    await asyncio.sleep(delay)
+                self.process_message(message)
         except ConnectionClosed:
-            self.task.cancel()
+            pass
+        # The client's gone one way or another. Take the writer down with us.
+        self.running = False
+        self.task.cancel()
 
     async def write(self):
-        while self.running:
-            msg = await self.outbox.get()
-            await self.connection.send(msg)
+        ws = self.connection
+        try:
+            while True:
+                await self.out_ready.wait()
+                self.out_ready.clear()
+                if self.out_buffer:
+                    frame = b"[" + b",".join(self.out_buffer) + b"]"
+                    self.out_buffer.clear()
+                    self.out_size = 0
+                    await ws.send(frame.decode())
+                if self.closing:
+                    await ws.close()
+                    return
+        except ConnectionClosed:
+            # read() notices too, and cleans up.
+            pass
+
+    def process_message(self, message):
+        if self.max_line_length and len(message) > self.max_line_length:
+            self.input_dropped("overlong")
+            return
+        try:
+            data = orjson.loads(message)
+        except orjson.JSONDecodeError:
+            data = None
+        if isinstance(data, str):
+            data = [["line", [data], dict()]]
+        elif not isinstance(data, list):
+            # Not JSON, or JSON that's just what the player typed, like 1 to pick a menu option.
+            if isinstance(message, bytes):
+                message = message.decode(errors="replace")
+            data = [["line", [message], dict()]]
+        elif not data:
+            self.listener.record_drop("malformed")
+            return
+        elif isinstance(data[0], str):
+            data = [data]
+
+        commands = list()
+        for cmd in data:
+            if not (isinstance(cmd, list) and cmd and isinstance(cmd[0], str)):
+                self.listener.record_drop("malformed")
+                continue
+            name = cmd[0].lower()
+            args = cmd[1] if len(cmd) > 1 and isinstance(cmd[1], list) else list()
+            kwargs = cmd[2] if len(cmd) > 2 and isinstance(cmd[2], dict) else dict()
+            if name == "client":
+                self.client_update(kwargs)
+            elif self.allow_line():
+                commands.append((name, tuple(args), kwargs))
+        if commands:
+            if self.response_time is not None:
+                self.input_time = self.input_time or time.perf_counter()
+            self.in_events.append(ConnectionInMessage(ConnectionInMessageType.GAMEDATA, self.conn_id, tuple(commands)))
+
+    def client_update(self, fields: Dict[str, Any]):
+        """
+        Applies what the client says about itself to our details, and tells the server.
+        """
+        patch = dict()
+        for name, value in fields.items():
+            if (kind := CLIENT_FIELDS.get(name, None)) is None:
+                continue
+            try:
+                value = kind(value)
+                if name == "color":
+                    value = ColorSystem(value) if value else None
+            except (TypeError, ValueError):
+                continue
+            patch[name] = value
+        if (changed := self.details.apply_changes(patch)):
+            self.in_events.append(ConnectionInMessage(ConnectionInMessageType.UPDATE, self.conn_id, changed))
+
+    def process_out_event(self, ev: ConnectionOutMessage):
+        if ev.msg_type == ConnectionOutMessageType.GAMEDATA:
+            for cmd, args, kwargs in ev.data:
+                encoded = orjson.dumps((cmd, args, kwargs))
+                self.out_buffer.append(encoded)
+                self.out_size += len(encoded)
+            if self.out_size > self.listener.service.max_output_buffer:
+                # The client isn't keeping up. Same as telnet: drop it rather than its output.
+                self.out_buffer.clear()
+                self.out_size = 0
+                self.listener.record_drop("output")
+                if (transport := getattr(self.connection, "transport", None)):
+                    transport.abort()
+                return
+        elif ev.msg_type == ConnectionOutMessageType.DISCONNECT:
+            self.closing = True
+        else:
+            return
+        self.out_ready.set()
@@ -7,8 +7,33 @@ class Config(BaseConfig):
         self.name = "server"
         self.process_name: str = "Athanor Server"
         self.application = "athanor_server.app.Application"
+        self.conn = dict()
+
+    def setup(self):
+        super().setup()
+        self._config_conn()
+        self._config_portals()
+
+    def _config_conn(self):
+        self.conn = {
+            # Seconds to hold outgoing events after the first one is queued, so output from many
+            # Connections gets batched into one link message. 0 ships it on the next loop pass.
+            "out_batch_window": 0.0,
+            # Worker coroutines shared by Connection classes with scheduler = "pool".
+            "pool_workers": 16,
+        }
+
+    def _config_portals(self):
+        """
+        Called last. If the launcher started several Portal workers, links to each of them,
+        unless link["portals"] was already set up by hand.
+        """
+        if self.portal_workers > 1 and not self.link.get("portals", None):
+            workers = [self.worker_link(i) for i in range(self.portal_workers)]
+            self.link["portals"] = {w["name"]: w for w in workers}
 
     def _config_classes(self):
         self.classes["services"]["link"] = "athanor_server.link.LinkService"
         self.classes["services"]["conn"] = "athanor_server.conn.ConnectionService"
+        self.classes["services"]["timers"] = "athanor.timers.TimerService"
         self.classes["game"]["connection"] = "athanor_server.conn.Connection"
@@ -1,27 +1,100 @@
 from athanor.app import Service
 import asyncio
-from typing import Optional, Union, Dict, Set, List
+import sys
+import time
+import traceback
+from typing import Optional, Union, Dict, Set, List, Any
 import os
-from athanor.tasks import TaskMaster
+from athanor.tasks import TaskMaster, TaskPool, OffloadResult
+from athanor.utils import EventBuffer
 from athanor.shared import ConnectionDetails
 from athanor.shared import ConnectionInMessageType, ConnectionOutMessage, ConnectionInMessage, ConnectionOutMessageType
 from athanor.shared import PortalOutMessageType, PortalOutMessage, ServerInMessageType, ServerInMessage
 
 
 class Connection(TaskMaster):
+    # A client that's gone has no use for the rest of its queue, and a stuck task shouldn't keep
+    # it from being cleaned up.
+    task_queue_size = 1000
+    stop_immediately = True
+    # "task" runs each Connection in an asyncio task of its own. "pool" shares the
+    # ConnectionService's TaskPool workers instead, which is much lighter with many players.
+    scheduler = "task"
+
     def __init__(self, service: "ConnectionService", details: ConnectionDetails):
         super().__init__()
         self.service = service
         self.details: ConnectionDetails = details
-        self.out_events: List[ConnectionOutMessage] = list()
-        self.out_gamedata = list()
+        self.out_events: List[ConnectionOutMessage] = EventBuffer(self.mark_dirty)
+        self.out_gamedata = EventBuffer(self.mark_dirty)
 
     @property
     def client_id(self):
         return self.details.client_id
 
-    async def on_update(self, details: ConnectionDetails):
-        self.details = details
+    def get_task_pool(self) -> Optional[TaskPool]:
+        if self.scheduler == "pool":
+            return self.service.get_task_pool()
+        return None
+
+    def offload(self, callback, func, *args, priority: int = 0, **kwargs) -> asyncio.Future:
+        """
+        Runs func(*args, **kwargs) outside the event loop, for commands too heavy to run inline.
+        When it's done, callback(result, error) is queued as one of our tasks. If that can't be
+        queued, because we've stopped or our queue is full, callback is called right away with
+        a RuntimeError instead. Takes the same keyword arguments as Application.offload().
+
+        Args:
+            callback (callable): Gets the result, or the exception func raised (including
+                asyncio.TimeoutError).
+            func (callable): What to run. Must be picklable for processes.
+            priority (int): The callback's task priority.
+
+        Returns:
+            future (asyncio.Future): The offloaded work, in case the caller wants it too.
+        """
+        future = asyncio.ensure_future(self.service.app.offload(func, *args, **kwargs))
+        future.add_done_callback(lambda f: self.offload_done(OffloadResult(callback, f), priority))
+        return future
+
+    def offload_done(self, result: OffloadResult, priority: int):
+        if self.enqueue(result, priority):
+            return
+        print(f"Connection {self.details.client_id} could not queue the result of offloaded work.")
+        error = RuntimeError("Offloaded work finished, but its result could not be queued.")
+        error.__cause__ = result.error
+        result.result, result.error = None, error
+        asyncio.ensure_future(self.deliver_unqueued(result))
+
+    async def deliver_unqueued(self, result: OffloadResult):
+        try:
+            await result.deliver()
+        except Exception:
+            traceback.print_exc(file=sys.stdout)
+
+    def on_task_timed(self, task, waited: float, elapsed: float):
+        if self.service.task_run is not None:
+            self.service.task_wait.record(waited)
+            self.service.task_run.record(elapsed)
+
+    def mark_dirty(self):
+        """
+        Called whenever output is queued, so the ConnectionService knows to flush us.
+        """
+        self.service.mark_dirty(self)
+
+    async def on_update(self, details: Union[ConnectionDetails, Dict[str, Any]]):
+        """
+        Called when the Portal tells us something about the client changed.
+
+        Args:
+            details (ConnectionDetails or dict): A whole new ConnectionDetails (from READY or
+                HELLO), or a dict of only the fields that changed (from UPDATE).
+        """
+        if isinstance(details, dict):
+            self.details.apply_changes(details)
+        else:
+            self.details = details
 
     async def on_process_event(self, ev: ConnectionInMessage):
         pass
@@ -57,10 +130,42 @@ class ConnectionService(Service):
         self.in_events: Optional[asyncio.Queue] = None
         self.out_events: Optional[asyncio.Queue] = None
         self.conn_class = self.app.classes['game']['connection']
+        self.dirty_connections: Set[Connection] = set()
+        self.out_events_ready: Optional[asyncio.Event] = None
+        self.out_batch_window: float = 0.0
+        # Shared by Connections that use the "pool" scheduler. Started when first needed.
+        self.task_pool: Optional[TaskPool] = None
+        self.pool_workers: int = 16
+        # Metrics, if the Application keeps them.
+        self.events_in = None
+        self.events_out = None
+        self.process_time = None
+        self.task_wait = None
+        self.task_run = None
+
+    def setup(self):
+        self.out_batch_window = float(self.app.config.conn.get("out_batch_window", 0.0))
+        self.pool_workers = int(self.app.config.conn.get("pool_workers", 16))
+        if (metrics := self.app.metrics):
+            self.events_in = metrics.counter("conn.events_in")
+            self.events_out = metrics.counter("conn.events_out")
+            self.process_time = metrics.histogram("conn.process_events")
+            self.task_wait = metrics.histogram("conn.task_wait")
+            self.task_run = metrics.histogram("conn.task_run")
+            metrics.gauge("conn.connections", lambda: len(self.connections))
+            metrics.gauge("conn.in_events", lambda: self.in_events.qsize() if self.in_events else 0)
+            metrics.gauge("conn.dirty", lambda: len(self.dirty_connections))
+
+    def get_task_pool(self) -> TaskPool:
+        if not self.task_pool:
+            self.task_pool = TaskPool(self.pool_workers)
+            self.task_pool.start()
+        return self.task_pool
 
     async def async_setup(self):
         self.in_events = asyncio.Queue()
         self.out_events = asyncio.Queue()
+        self.out_events_ready = asyncio.Event()
 
     async def async_run(self):
         await asyncio.gather(self.handle_out_events(), self.handle_in_events())
@@ -72,20 +177,52 @@ class ConnectionService(Service):
                 if msg.msg_type == ServerInMessageType.HELLO:
                     await self.process_hello(msg)
                 elif msg.msg_type == ServerInMessageType.EVENTS:
-                    await self.process_events(msg)
+                    if self.process_time is not None:
+                        started = time.perf_counter()
+                        await self.process_events(msg)
+                        self.process_time.record(time.perf_counter() - started)
+                        self.events_in.inc(len(msg.data or ()))
+                    else:
+                        await self.process_events(msg)
+                    self.app.link.complete(msg)
+
+    def mark_dirty(self, conn: Connection):
+        self.dirty_connections.add(conn)
+        if self.out_events_ready:
+            self.out_events_ready.set()
 
     async def handle_out_events(self):
+        """
+        Sleeps until a Connection queues output, then flushes only the Connections that have any
+        and ships the results to the link as one EVENTS message. If out_batch_window is set, waits
+        that long after the first output so that a burst of output shares a message.
+        """
         while True:
+            await self.out_events_ready.wait()
+            if self.out_batch_window > 0:
+                await asyncio.sleep(self.out_batch_window)
+            self.out_events_ready.clear()
+
+            dirty = self.dirty_connections
+            self.dirty_connections = set()
             events = list()
-            for conn in self.connections.values():
+            for conn in dirty:
                 await conn.flush_out_events()
                 if conn.out_events:
                     events.extend(conn.out_events)
                     conn.out_events.clear()
 
+            # Flushing re-marks connections as dirty; only keep the ones that got more output since.
+            for conn in dirty:
+                if not (conn.out_gamedata or conn.out_events):
+                    self.dirty_connections.discard(conn)
+            if not self.dirty_connections:
+                self.out_events_ready.clear()
+
             if events:
+                if self.events_out is not None:
+                    self.events_out.inc(len(events))
                 await self.app.link.out_events.put(PortalOutMessage(PortalOutMessageType.EVENTS, os.getpid(), events))
-            await asyncio.sleep(0.1)
 
     async def get_or_create_client(self, details) -> Connection:
         if (conn := self.connections.get(details.client_id, None)):
@@ -107,22 +244,23 @@ class ConnectionService(Service):
     async def process_events(self, msg: ServerInMessage):
         if not msg.data:
             return
-        for e in msg.data:
-            ev = ConnectionInMessage.from_dict(e)
+        for ev in msg.data:
             await self.process_event(ev)
 
     async def process_event(self, ev: ConnectionInMessage):
         if ev.msg_type == ConnectionInMessageType.READY:
-            details: ConnectionDetails = ConnectionDetails.from_dict(ev.data)
-            conn = await self.get_or_create_client(details)
+            conn = await self.get_or_create_client(ev.data)
             return
         if (conn := self.connections.get(ev.client_id, None)):
             if ev.msg_type == ConnectionInMessageType.DISCONNECT:
                 self.remove_client(conn)
+            elif ev.msg_type == ConnectionInMessageType.UPDATE:
+                await conn.on_update(ev.data)
             else:
                 await conn.on_process_event(ev)
         else:
             pass
 
     def remove_client(self, conn: Connection):
-        conn.stop()
\ No newline at end of file
+        self.connections.pop(conn.client_id, None)
+        conn.stop()
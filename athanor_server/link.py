@@ -1,38 +1,206 @@
-from athanor.shared import LinkServiceClient, PortalOutMessageType, PortalOutMessage
-from athanor.shared import ServerInMessageType, ServerInMessage
+from athanor.shared import LinkServiceClient, PortalOutMessageType, PortalOutMessage, LinkProtocol
+from athanor.shared import ServerInMessageType, ServerInMessage, LINK_CODECS
+from athanor.shared import ConnectionInMessageType, ConnectionInMessage, strip_gamedata
+from typing import Dict, List, Optional, Set
 import os
+import time
 import asyncio
 
 
 class LinkService(LinkServiceClient):
-    def on_new_link(self):
-        msg = PortalOutMessage(PortalOutMessageType.HELLO, os.getpid(), None)
-        self.link.outbox.put_nowait(msg)
+    """
+    Links the server to every Portal in config.link["portals"]. Each Portal owns the connections
+    it announces, and output for a connection is routed back to the Portal that owns it.
+    """
+    in_message_class = ServerInMessage
 
-    async def message_from_link(self, message):
-        if not message:
+    def __init__(self, app):
+        super().__init__(app)
+        # client_id -> name of the Portal that connection lives on.
+        self.owners: Dict[str, str] = dict()
+        # Outgoing messages for each Portal, waiting for its link to be ready. Bounded by
+        # outbox_size, with the link's backpressure policy applied once one fills up.
+        self.portal_events: Dict[str, asyncio.Queue] = dict()
+        # How long (seconds) a Portal's link may stay down before we give up on its connections.
+        self.owner_timeout: float = 0.0
+        # When each Portal's link was last seen going down, and the Portals we've given up on.
+        self.down_since: Dict[str, float] = dict()
+        self.lost: Set[str] = set()
+        # GAMEDATA events thrown away for each Portal, because its queue was full.
+        self.dropped: Dict[str, int] = dict()
+
+    def setup(self):
+        super().setup()
+        self.owner_timeout = float(self.app.config.link.get("owner_timeout", 0.0))
+
+    async def async_setup(self):
+        await super().async_setup()
+        for name in self.endpoints:
+            self.portal_events[name] = asyncio.Queue(maxsize=self.outbox_size)
+
+    def on_new_link(self, link: LinkProtocol):
+        data = {"codecs": self.codecs, "batch": True, **self.resume_data(link)}
+        msg = PortalOutMessage(PortalOutMessageType.HELLO, os.getpid(), data)
+        link.outbox.put_nowait(msg)
+
+    def link_message(self, msg_type: int, data):
+        return PortalOutMessage(PortalOutMessageType(msg_type), os.getpid(), data)
+
+    async def message_from_link(self, msg: ServerInMessage, link: LinkProtocol):
+        if not msg:
             return
-        msg: ServerInMessage = ServerInMessage.from_dict(message)
         if msg.msg_type == ServerInMessageType.SYSTEM:
             pass
+        elif msg.msg_type == ServerInMessageType.HELLO:
+            received = None
+            if isinstance(msg.data, dict):
+                # The Portal picked a codec for us. Older Portals just send a list of connections.
+                link.codec = LINK_CODECS.get(msg.data.get("codec", None), link.codec)
+                link.batching = bool(msg.data.get("batch", False))
+                received = msg.data.get("received", None)
+                msg.data = msg.data.get("connections", None)
+            await self.claim_connections(link.name, msg)
+            await self.app.conn.in_events.put(msg)
+            await self.resume_link(link, received)
         else:
+            if msg.msg_type == ServerInMessageType.EVENTS and msg.data:
+                for ev in msg.data:
+                    if ev.msg_type == ConnectionInMessageType.READY:
+                        self.owners[ev.client_id] = link.name
+                    elif ev.msg_type == ConnectionInMessageType.DISCONNECT:
+                        self.owners.pop(ev.client_id, None)
             await self.app.conn.in_events.put(msg)
 
+    async def claim_connections(self, name: str, msg: ServerInMessage):
+        """
+        Records which connections a Portal has, from its HELLO. Anything we thought it had that it
+        no longer does went away while the link was down, so is disconnected here.
+        """
+        self.lost.discard(name)
+        self.down_since.pop(name, None)
+        current = set()
+        for d in msg.data or ():
+            client_id = d["client_id"] if isinstance(d, dict) else d.client_id
+            current.add(client_id)
+            self.owners[client_id] = name
+        stale = [client_id for client_id, owner in self.owners.items() if owner == name and client_id not in current]
+        if not stale:
+            return
+        for client_id in stale:
+            del self.owners[client_id]
+        events = [ConnectionInMessage(ConnectionInMessageType.DISCONNECT, client_id, None) for client_id in stale]
+        await self.app.conn.in_events.put(ServerInMessage(ServerInMessageType.EVENTS, msg.process_id, events))
+
     async def async_run(self):
         await asyncio.gather(
-            self.async_link(), self.handle_in_events(), self.handle_out_events()
+            *[self.async_link(name) for name in self.endpoints],
+            *[self.send_portal_events(name) for name in self.endpoints],
+            self.handle_in_events(),
+            self.handle_out_events(),
+            self.send_acks(),
+            self.expire_portals()
         )
 
     async def handle_in_events(self):
         pass
 
     async def handle_out_events(self):
+        """
+        Splits outgoing events up by the Portal that owns each connection. Events for connections
+        no Portal owns anymore are dropped.
+        """
         while True:
             msg = await self.out_events.get()
+            if msg.msg_type != PortalOutMessageType.EVENTS:
+                for name in self.portal_events:
+                    if name not in self.lost:
+                        await self.route(name, msg)
+                continue
+            routed: Dict[str, List] = dict()
+            for ev in msg.data:
+                if (name := self.owners.get(ev.client_id, None)):
+                    routed.setdefault(name, list()).append(ev)
+            for name, events in routed.items():
+                await self.route(name, PortalOutMessage(msg.msg_type, msg.process_id, events))
+
+    async def route(self, name: str, msg: PortalOutMessage):
+        """
+        Queues a message for a Portal. Once its queue is full, a Portal whose link is up gets the
+        link's own backpressure policy: wait for room, or strip out GAMEDATA and wait only if
+        anything is left. Every other Portal's output waits behind this, so a Portal whose link
+        is down doesn't get to hold it up: its GAMEDATA is dropped whatever the policy, and if
+        that still doesn't make room, it's given up on now rather than at owner_timeout.
+        """
+        queue = self.portal_events[name]
+        while True:
+            try:
+                queue.put_nowait(msg)
+                return
+            except asyncio.QueueFull:
+                pass
+            link = self.links.get(name, None)
+            up = link and link.ready
+            if not up or self.backpressure == "drop_gamedata":
+                if (msg := self.drop_gamedata(name, msg)) is None:
+                    return
+            if not up:
+                await self.expire_portal(name)
+                return
+            # Wait for send_portal_events() to make room, checking the link's still up.
+            await asyncio.sleep(0.01)
+
+    def drop_gamedata(self, name: str, msg: PortalOutMessage) -> Optional[PortalOutMessage]:
+        msg, dropped = strip_gamedata(msg)
+        if dropped:
+            self.dropped[name] = self.dropped.get(name, 0) + dropped
+        return msg
+
+    async def send_portal_events(self, name: str):
+        queue = self.portal_events[name]
+        while True:
+            msg = await queue.get()
 
             while msg:
-                if self.link:
-                    await self.link.outbox.put(msg)
+                link = self.links.get(name, None)
+                if link and link.ready:
+                    await link.send(msg)
+                    msg = None
+                elif name in self.lost:
+                    # Whoever this was for is gone as far as we're concerned.
                     msg = None
                 else:
                     await asyncio.sleep(0.1)
+
+    async def expire_portals(self):
+        """
+        Watches for Portals whose link has been down longer than owner_timeout. Their connections
+        are disconnected, and anything queued for them is thrown away rather than held forever. If
+        the Portal comes back after all, its HELLO claims whatever connections it still has.
+        """
+        if not self.owner_timeout:
+            return
+        while True:
+            await asyncio.sleep(min(1.0, self.owner_timeout))
+            now = time.monotonic()
+            for name in self.endpoints:
+                link = self.links.get(name, None)
+                if link and link.ready:
+                    self.down_since.pop(name, None)
+                    self.lost.discard(name)
+                    continue
+                since = self.down_since.setdefault(name, now)
+                if name not in self.lost and now - since >= self.owner_timeout:
+                    await self.expire_portal(name)
+
+    async def expire_portal(self, name: str):
+        self.lost.add(name)
+        queue = self.portal_events[name]
+        while not queue.empty():
+            queue.get_nowait()
+        gone = [client_id for client_id, owner in self.owners.items() if owner == name]
+        if not gone:
+            return
+        for client_id in gone:
+            del self.owners[client_id]
+        events = [ConnectionInMessage(ConnectionInMessageType.DISCONNECT, client_id, None) for client_id in gone]
+        await self.app.conn.in_events.put(ServerInMessage(ServerInMessageType.EVENTS, os.getpid(), events))
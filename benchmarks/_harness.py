@@ -0,0 +1,64 @@
+"""
+Tiny timing harness shared by the benchmark scripts. Each script builds a list of Benchmarks and
+hands it to main(), so it can be run directly with `python -m benchmarks.<script>`.
+"""
+import argparse
+import time
+
+from typing import Callable, List, Optional
+
+
+class Benchmark:
+    """
+    A named callable to time.
+
+    Args:
+        name (str): What shows up in the report.
+        func (callable): Called with no arguments, number times per round.
+        ops (int): How many units of work (events, bytes, ...) one call of func does.
+        unit (str): What those units are called.
+        number (int): Calls per timing round.
+        group (str): Benchmarks in the same group are reported relative to the group's first one.
+    """
+
+    def __init__(self, name: str, func: Callable[[], object], ops: int = 1, unit: str = "ops",
+                 number: int = 100, group: Optional[str] = None):
+        self.name = name
+        self.func = func
+        self.ops = ops
+        self.unit = unit
+        self.number = number
+        self.group = group
+
+    def run(self, repeat: int = 5) -> float:
+        """
+        Returns the best observed rate, in units per second.
+        """
+        func = self.func
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(self.number):
+                func()
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        return (self.ops * self.number) / best
+
+
+def report(name: str, rate: float, unit: str, baseline: Optional[float] = None):
+    line = f"{name:<50} {rate:>14,.0f} {unit}/sec"
+    if baseline:
+        line += f"  ({rate / baseline:.2f}x)"
+    print(line)
+
+
+def main(benchmarks: List[Benchmark], description: str = ""):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--repeat", type=int, default=5, help="Timing rounds per benchmark.")
+    args = parser.parse_args()
+    baselines = dict()
+    for bench in benchmarks:
+        rate = bench.run(args.repeat)
+        report(bench.name, rate, bench.unit, baselines.get(bench.group, None))
+        baselines.setdefault(bench.group, rate)
@@ -0,0 +1,92 @@
+"""
+Memory used by ConnectionDetails at scale, against the plain dataclass it replaced.
+
+    python -m benchmarks.bench_details_memory [--count 10000]
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from dataclasses import make_dataclass, field
+from athanor.shared import ConnectionDetails, DETAILS_FIELDS, DETAILS_FLAGS, MudProtocol, ColorSystem
+
+_DEFAULTS = {
+    "protocol": 0,
+    "client_id": "UNKNOWN",
+    "client_name": "UNKNOWN",
+    "client_version": "UNKNOWN",
+    "host_address": "UNKNOWN",
+    "host_name": "UNKNOWN",
+    "host_port": 0,
+    "connected": 0.0,
+    "color": None,
+    "width": 78,
+    "height": 24,
+}
+
+# The old @dataclass version of ConnectionDetails: one __dict__ per instance, one attribute per flag.
+DataclassDetails = make_dataclass(
+    "DataclassDetails",
+    [(name, object, field(default=_DEFAULTS.get(name, False))) for name in DETAILS_FIELDS],
+)
+
+
+def make_kwargs(i: int) -> dict:
+    # What a typical telnet client ends up with after negotiation.
+    return dict(
+        protocol=MudProtocol.TELNET,
+        client_id=f"telnet_{i:020d}",
+        client_name="MUDLET",
+        client_version="4.10.1",
+        host_address="127.0.0.1",
+        host_port=40000 + (i % 20000),
+        connected=time.time(),
+        color=ColorSystem.EIGHT_BIT,
+        width=120,
+        height=40,
+        utf8=True,
+        naws=True,
+        mtts=True,
+        ttype=True,
+        mccp2=True,
+        mccp2_active=True,
+        suppress_ga=True,
+        vt100=True,
+    )
+
+
+def measure(cls, count: int) -> int:
+    """
+    Returns the bytes allocated to keep count instances of cls alive.
+    """
+    # The arguments are built first so their strings and floats aren't counted; the connection
+    # would be holding on to those anyway.
+    kwargs = [make_kwargs(i) for i in range(count)]
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    instances = [cls(**k) for k in kwargs]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del instances
+    return after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=10000)
+    args = parser.parse_args()
+    print(f"{len(DETAILS_FLAGS)} flags packed into one int.")
+    baseline = None
+    for cls in (DataclassDetails, ConnectionDetails):
+        used = measure(cls, args.count)
+        line = f"{cls.__name__:<30} {used / 1024:>10,.1f} KiB for {args.count:,}  ({used / args.count:,.0f} bytes each)"
+        if baseline:
+            line += f"  ({used / baseline:.2f}x)"
+        baseline = baseline or used
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+What the journal costs the link: throughput of EVENTS messages between two LinkProtocols over
+a Unix socket, with and without both ends journaling, and how fast a segment reads back.
+
+    python -m benchmarks.bench_journal [--messages 20000] [--events 20] [--repeat 3]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+from types import SimpleNamespace
+
+import uvloop
+
+from athanor.journal import JournalService, list_segments, read_events
+from athanor.shared import LinkProtocol, LinkSession, StreamLinkConnection, LINK_CODECS
+from athanor.shared import ServerInMessage, ServerInMessageType, ConnectionInMessage, ConnectionInMessageType
+from athanor.shared import PortalOutMessage
+
+
+def make_service(name, in_message_class, journal_path, received=None):
+    async def message_from_link(msg, link):
+        received.append(msg)
+
+    app = SimpleNamespace(metrics=None, journal=None, config=SimpleNamespace(
+        name=name, journal={"path": journal_path, "flush_interval": 0.1}))
+    service = SimpleNamespace(app=app, in_message_class=in_message_class, outbox_size=10000, high_water=5000,
+                              low_water=1000, backpressure="block", batch_count=256, batch_bytes=1024 * 1024,
+                              session=LinkSession(), message_from_link=message_from_link)
+    if journal_path:
+        journal = JournalService(app)
+        journal.setup()
+    return service
+
+
+async def measure(messages: int, events: int, journal_path) -> float:
+    path = os.path.join(tempfile.mkdtemp(), "link.sock")
+    accepted = asyncio.get_running_loop().create_future()
+
+    async def handler(reader, writer):
+        accepted.set_result(StreamLinkConnection(reader, writer))
+
+    server = await asyncio.start_unix_server(handler, path)
+    client = StreamLinkConnection(*await asyncio.open_unix_connection(path))
+    remote = await accepted
+
+    received = list()
+    sender_service = make_service("sender", PortalOutMessage, journal_path)
+    receiver_service = make_service("receiver", ServerInMessage, journal_path, received)
+    sender = LinkProtocol(sender_service, client, None)
+    receiver = LinkProtocol(receiver_service, remote, None)
+    for link in (sender, receiver):
+        link.codec = LINK_CODECS["compact"]
+        link.batching = True
+    tasks = [asyncio.create_task(link.run()) for link in (sender, receiver)]
+
+    batch = [ConnectionInMessage(ConnectionInMessageType.GAMEDATA, f"portal:telnet_{i:020d}",
+                                 (("line", ("say hello there, everyone",), dict()),)) for i in range(events)]
+    start = time.perf_counter()
+    for _ in range(messages):
+        await sender.send(ServerInMessage(ServerInMessageType.EVENTS, 1, batch))
+    while len(received) < messages:
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - start
+
+    for task in tasks:
+        task.cancel()
+    await client.close()
+    await remote.close()
+    server.close()
+    for service in (sender_service, receiver_service):
+        if service.app.journal:
+            service.app.journal.stop()
+    os.remove(path)
+    return messages * events / elapsed
+
+
+async def run(args):
+    directory = tempfile.mkdtemp()
+    try:
+        rates = dict()
+        for _ in range(args.repeat):
+            for name, journal_path in (("off", None), ("on", directory)):
+                rate = await measure(args.messages, args.events, journal_path)
+                rates[name] = max(rates.get(name, 0.0), rate)
+        print(f"{'journal off':<20} {rates['off']:>12,.0f} events/sec")
+        print(f"{'journal on':<20} {rates['on']:>12,.0f} events/sec  "
+              f"({(rates['on'] / rates['off'] - 1) * 100:+.1f}%)")
+
+        segments = list_segments(directory)
+        size = sum(os.path.getsize(s) for s in segments)
+        start = time.perf_counter()
+        count = sum(1 for segment in segments for _ in read_events(segment))
+        elapsed = time.perf_counter() - start
+        print(f"{'read_events':<20} {count / elapsed:>12,.0f} events/sec  "
+              f"({count:,} events, {size / count:.1f} bytes each on disk)")
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--events", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    uvloop.install()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
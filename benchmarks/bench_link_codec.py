@@ -0,0 +1,92 @@
+"""
+Compares link codecs on a typical EVENTS message: mostly GAMEDATA, with a few READY events
+carrying full ConnectionDetails. "legacy" is the path used before codecs existed: to_dict() on
+every event when sending, and from_dict() on every event when receiving.
+
+    python -m benchmarks.bench_link_codec
+"""
+import os
+
+import orjson
+
+from athanor.shared import (
+    LINK_CODECS,
+    JsonLinkCodec,
+    ConnectionDetails,
+    ConnectionInMessage,
+    ConnectionInMessageType,
+    ConnectionOutMessage,
+    ConnectionOutMessageType,
+    PortalOutMessage,
+    PortalOutMessageType,
+    ServerInMessage,
+    ServerInMessageType,
+    decode_frame,
+)
+from benchmarks._harness import Benchmark, main
+
+EVENTS = 200
+
+
+def make_in_events():
+    events = list()
+    for i in range(EVENTS):
+        client_id = f"telnet_{i:020d}"
+        if i % 20 == 0:
+            details = ConnectionDetails(client_id=client_id, client_name="MUDLET", utf8=True, naws=True)
+            events.append(ConnectionInMessage(ConnectionInMessageType.READY, client_id, details))
+        else:
+            data = (("line", (f"say hello number {i}",), dict()),)
+            events.append(ConnectionInMessage(ConnectionInMessageType.GAMEDATA, client_id, data))
+    return ServerInMessage(ServerInMessageType.EVENTS, os.getpid(), events)
+
+
+def make_out_events():
+    events = list()
+    for i in range(EVENTS):
+        data = [("line", (f"You say, 'hello number {i}'",), dict())]
+        events.append(ConnectionOutMessage(ConnectionOutMessageType.GAMEDATA, f"telnet_{i:020d}", data))
+    return PortalOutMessage(PortalOutMessageType.EVENTS, os.getpid(), events)
+
+
+def legacy_encode_in(msg: ServerInMessage) -> bytes:
+    data = [ev.to_dict() for ev in msg.data]
+    return orjson.dumps(ServerInMessage(msg.msg_type, msg.process_id, data), default=JsonLinkCodec.default)
+
+
+def legacy_decode_in(frame: bytes):
+    msg = ServerInMessage.from_dict(orjson.loads(frame.decode()))
+    events = [ConnectionInMessage.from_dict(e) for e in msg.data]
+    for ev in events:
+        if ev.msg_type == ConnectionInMessageType.READY:
+            ev.data = ConnectionDetails.from_dict(ev.data)
+    return events
+
+
+def legacy_decode_out(frame: bytes):
+    msg = PortalOutMessage.from_dict(orjson.loads(frame.decode()))
+    return [ConnectionOutMessage.from_dict(e) for e in msg.data]
+
+
+def build():
+    in_msg = make_in_events()
+    out_msg = make_out_events()
+    benchmarks = [
+        Benchmark("portal->server encode+decode: legacy",
+                  lambda: legacy_decode_in(legacy_encode_in(in_msg)), EVENTS, "events", 20, "in"),
+    ]
+    for name, codec in LINK_CODECS.items():
+        benchmarks.append(Benchmark(f"portal->server encode+decode: {name}",
+                                    lambda c=codec: decode_frame(c.encode(in_msg), ServerInMessage),
+                                    EVENTS, "events", 20, "in"))
+    benchmarks.append(Benchmark("server->portal encode+decode: legacy",
+                                lambda: legacy_decode_out(orjson.dumps(out_msg)), EVENTS, "events", 20, "out"))
+    for name, codec in LINK_CODECS.items():
+        benchmarks.append(Benchmark(f"server->portal encode+decode: {name}",
+                                    lambda c=codec: decode_frame(c.encode(out_msg), PortalOutMessage),
+                                    EVENTS, "events", 20, "out"))
+    return benchmarks
+
+
+if __name__ == "__main__":
+    main(build(), __doc__)
@@ -0,0 +1,124 @@
+"""
+Throughput and round-trip latency of the link transports, measured between two ends in one
+process so only the transport itself is being compared.
+
+    python -m benchmarks.bench_link_transport [--frames 20000] [--size 512] [--pings 2000]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import websockets
+
+from athanor.shared import StreamLinkConnection
+from benchmarks._harness import report
+
+
+async def open_websocket():
+    accepted = asyncio.get_running_loop().create_future()
+    done = asyncio.Event()
+
+    async def handler(ws, path=None):
+        accepted.set_result(ws)
+        await done.wait()
+
+    server = await websockets.serve(handler, "localhost", 0)
+    port = server.sockets[0].getsockname()[1]
+    client = await websockets.connect(f"ws://localhost:{port}")
+    remote = await accepted
+
+    async def close():
+        done.set()
+        await client.close()
+        server.close()
+        await server.wait_closed()
+
+    return client, remote, close
+
+
+async def open_unix():
+    path = os.path.join(tempfile.mkdtemp(), "link.sock")
+    accepted = asyncio.get_running_loop().create_future()
+
+    async def handler(reader, writer):
+        accepted.set_result(StreamLinkConnection(reader, writer))
+
+    server = await asyncio.start_unix_server(handler, path)
+    client = StreamLinkConnection(*await asyncio.open_unix_connection(path))
+    remote = await accepted
+
+    async def close():
+        await client.close()
+        await remote.close()
+        server.close()
+        await server.wait_closed()
+        os.remove(path)
+
+    return client, remote, close
+
+
+async def throughput(client, remote, frames: int, size: int) -> float:
+    payload = b"x" * size
+
+    async def receive():
+        count = 0
+        async for _ in remote:
+            count += 1
+            if count == frames:
+                return
+
+    receiver = asyncio.create_task(receive())
+    start = time.perf_counter()
+    for _ in range(frames):
+        await client.send(payload)
+    await receiver
+    return frames / (time.perf_counter() - start)
+
+
+async def latency(client, remote, pings: int) -> list:
+    async def echo():
+        count = 0
+        async for frame in remote:
+            await remote.send(frame)
+            count += 1
+            if count == pings:
+                return
+
+    echoer = asyncio.create_task(echo())
+    replies = client.__aiter__()
+    times = list()
+    for _ in range(pings):
+        start = time.perf_counter()
+        await client.send(b"ping")
+        await replies.__anext__()
+        times.append(time.perf_counter() - start)
+    await echoer
+    return times
+
+
+async def run(args):
+    baseline = None
+    for name, opener in (("websocket", open_websocket), ("unix", open_unix)):
+        client, remote, close = await opener()
+        rate = await throughput(client, remote, args.frames, args.size)
+        times = sorted(await latency(client, remote, args.pings))
+        await close()
+        report(f"{name}: {args.size}-byte frames one way", rate, "frames", baseline)
+        baseline = baseline or rate
+        p99 = times[int(len(times) * 0.99) - 1]
+        print(f"{name + ': round trip':<50} median {statistics.median(times) * 1e6:8.1f}us   p99 {p99 * 1e6:8.1f}us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--pings", type=int, default=2000)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Memory and scheduling latency of TaskMasters run in a task each, against TaskMasters sharing a
+TaskPool.
+
+    python -m benchmarks.bench_task_scheduler [--counts 1000 10000 50000] [--workers 16]
+
+For each count, starts that many TaskMasters, then queues one task on every one of them at once,
+as a game tick broadcasting to every player would, and reports how long tasks waited.
+"""
+import argparse
+import asyncio
+import gc
+import time
+import tracemalloc
+
+import uvloop
+
+from athanor.tasks import TaskMaster, TaskPool
+
+
+class BenchMaster(TaskMaster):
+    pool = None
+
+    def __init__(self, waits: list):
+        super().__init__()
+        self.waits = waits
+
+    def get_task_pool(self):
+        return self.pool
+
+    async def run_task(self, task):
+        pass
+
+    def on_task_timed(self, task, waited: float, elapsed: float):
+        self.waits.append(waited)
+
+
+async def measure(count: int, pool: TaskPool = None):
+    BenchMaster.pool = pool
+    waits = list()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    masters = [BenchMaster(waits) for _ in range(count)]
+    for master in masters:
+        master.start()
+    # Let every one of them get through on_start().
+    await asyncio.sleep(0.1)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for master in masters:
+        master.enqueue("tick")
+    while len(waits) < count:
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+
+    for master in masters:
+        master.stop()
+    await asyncio.sleep(0.1)
+    waits.sort()
+    return used, elapsed, waits[len(waits) // 2], waits[int(len(waits) * 0.99)]
+
+
+class QuitMaster(TaskMaster):
+    """
+    Stops itself from inside a task, as a Connection does on "quit".
+    """
+    pool = None
+    stop_immediately = True
+
+    def __init__(self):
+        super().__init__()
+        self.ran = list()
+
+    def get_task_pool(self):
+        return self.pool
+
+    async def run_task(self, task):
+        self.ran.append(task)
+        if task == "quit":
+            self.stop()
+
+
+async def check_self_stop():
+    """
+    A pooled TaskMaster that stops itself mustn't take the worker down with it, or a pool of one
+    would never run anything again.
+    """
+    pool = TaskPool(1)
+    pool.start()
+    QuitMaster.pool = pool
+    first, second = QuitMaster(), QuitMaster()
+    first.start()
+    second.start()
+    first.enqueue("quit")
+    await asyncio.sleep(0.05)
+    second.enqueue("look")
+    await asyncio.sleep(0.05)
+    assert second.ran == ["look"], "a TaskMaster stopping itself killed its pool worker"
+    second.stop()
+    pool.stop()
+
+
+async def run(counts, workers):
+    await check_self_stop()
+    for count in counts:
+        pool = TaskPool(workers)
+        pool.start()
+        for name, use_pool in (("task each", None), (f"pool of {workers}", pool)):
+            used, elapsed, p50, p99 = await measure(count, use_pool)
+            print(f"{count:>7,} {name:<12} {used / count:>8,.0f} bytes each  "
+                  f"broadcast {elapsed * 1000:>8.1f}ms  wait p50 {p50 * 1000:>7.2f}ms  p99 {p99 * 1000:>7.2f}ms")
+        pool.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--counts", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--workers", type=int, default=16)
+    args = parser.parse_args()
+    uvloop.install()
+    asyncio.run(run(args.counts, args.workers))
+
+
+if __name__ == "__main__":
+    main()
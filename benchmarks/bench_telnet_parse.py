@@ -0,0 +1,95 @@
+"""
+TelnetMudConnection.data_received under pastes and negotiation floods, against the
+parse_consume() loop it replaced.
+
+    python -m benchmarks.bench_telnet_parse [--repeat 5]
+"""
+from types import SimpleNamespace
+
+from mudtelnet import TelnetFrame
+from athanor.shared import MudProtocol
+from athanor_portal.telnet import TelnetMudConnection
+
+from ._harness import Benchmark, main
+
+CHUNK = 64 * 1024
+
+
+class _Transport:
+    def write(self, data):
+        pass
+
+
+class LegacyTelnetMudConnection(TelnetMudConnection):
+    """
+    data_received as it was: consume one frame at a time off the front of the buffer, with a new
+    output buffer and write per frame.
+    """
+
+    def data_received(self, data: bytearray):
+        self.in_buffer.extend(data)
+        patch = dict()
+
+        while True:
+            frame = TelnetFrame.parse_consume(self.in_buffer)
+            if not frame:
+                break
+            events_buffer = self.telnet_in_events if self.started else self.telnet_pending_events
+            out_buffer = bytearray()
+            changed = self.telnet.process_frame(frame, out_buffer, events_buffer)
+            if out_buffer:
+                self.transport.write(out_buffer)
+            if changed:
+                patch.update(self.update_details(changed))
+
+        if self.telnet_in_events:
+            self.process_telnet_events()
+
+
+def make_connection(cls):
+    # write_threshold 0 writes replies at the end of each read, since there's no event loop here.
+    service = SimpleNamespace(in_conn_events=list(), mudconnections=dict(), id_prefix="bench:", ready_delay=0.3,
+                              write_threshold=0, max_output_buffer=0, response_time=None)
+    listener = SimpleNamespace(service=service, name="telnet", protocol=MudProtocol.TELNET, ssl_context=None,
+                               conn_limits=dict(), bytes_bucket=None, lines_bucket=None)
+    conn = cls(listener)
+    conn.transport = _Transport()
+    conn.started = True
+    return conn
+
+
+def chunks(stream: bytes, size: int = CHUNK):
+    return [stream[i:i + size] for i in range(0, len(stream), size)]
+
+
+def feed(cls, reads):
+    def run():
+        conn = make_connection(cls)
+        for data in reads:
+            conn.data_received(data)
+    return run
+
+
+# A 4 MiB paste of 80 column lines, arriving in 64 KiB reads.
+PASTE = chunks(b"".join(f"{i:08d} {'x' * 69}\r\n".encode() for i in range(4 * 1024 * 1024 // 80)))
+# A client that keeps renegotiating: window resizes and option toggles between short commands.
+NAWS = bytes([255, 250, 31, 0, 120, 0, 40, 255, 240])
+NEGOTIATION = chunks((NAWS + bytes([255, 251, 24, 255, 253, 3]) + b"look\r\n") * 50000)
+
+
+def size(reads) -> int:
+    return sum(len(r) for r in reads)
+
+
+BENCHMARKS = [
+    Benchmark("paste: parse_consume", feed(LegacyTelnetMudConnection, PASTE), size(PASTE), "bytes", 1, "paste"),
+    Benchmark("paste: cursor", feed(TelnetMudConnection, PASTE), size(PASTE), "bytes", 1, "paste"),
+    Benchmark("negotiation: parse_consume", feed(LegacyTelnetMudConnection, NEGOTIATION), size(NEGOTIATION),
+              "bytes", 1, "negotiation"),
+    Benchmark("negotiation: cursor", feed(TelnetMudConnection, NEGOTIATION), size(NEGOTIATION),
+              "bytes", 1, "negotiation"),
+]
+
+
+if __name__ == "__main__":
+    main(BENCHMARKS, __doc__)
@@ -0,0 +1,113 @@
+"""
+TimerService against loop.call_later with many timers pending.
+
+    python -m benchmarks.bench_timers [--counts 100000 500000] [--span 1.0]
+
+For each count, schedules that many timers at random delays of up to an hour and reports the
+cost of scheduling them (with tracemalloc running, so both look slower than they are), the
+memory they hold and the cost of cancelling half of them. Then it schedules that many again,
+spread over --span seconds, and reports the CPU time spent firing them all: for call_later, by
+running the event loop until they're done, and for TimerService, by turning the wheel a tick at
+a time as the main loop would.
+"""
+import argparse
+import asyncio
+import gc
+import random
+import time
+import tracemalloc
+
+from types import SimpleNamespace
+
+import uvloop
+
+from athanor.timers import TimerService
+
+INTERVAL = 0.01
+
+
+def noop():
+    pass
+
+
+def make_service() -> TimerService:
+    service = TimerService(SimpleNamespace(interval=INTERVAL, tick=0))
+    service.setup()
+    return service
+
+
+def measure_schedule(count: int, schedule):
+    delays = [random.uniform(0.001, 3600.0) for _ in range(count)]
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    handles = [schedule(delay, noop) for delay in delays]
+    elapsed = time.perf_counter() - start
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for handle in handles[::2]:
+        handle.cancel()
+    cancelled = time.perf_counter() - start
+    return elapsed, used, cancelled
+
+
+async def fire_call_later(count: int, span: float) -> float:
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+    left = [count]
+
+    def fired():
+        left[0] -= 1
+        if not left[0]:
+            done.set_result(None)
+
+    for _ in range(count):
+        loop.call_later(random.uniform(0.0, span), fired)
+    start = time.process_time()
+    await done
+    return time.process_time() - start
+
+
+def fire_wheel(count: int, span: float) -> float:
+    service = make_service()
+    for _ in range(count):
+        service.call_later(random.uniform(0.0, span), noop)
+    ticks = int(span / INTERVAL) + 1
+    start = time.process_time()
+    for tick in range(1, ticks + 1):
+        service.advance(tick)
+    elapsed = time.process_time() - start
+    assert not len(service)
+    return elapsed
+
+
+async def run(counts, span):
+    loop = asyncio.get_running_loop()
+    for count in counts:
+        for name, schedule in (("call_later", loop.call_later), ("TimerService", make_service().call_later)):
+            elapsed, used, cancelled = measure_schedule(count, schedule)
+            if name == "call_later":
+                fired = await fire_call_later(count, span)
+            else:
+                fired = fire_wheel(count, span)
+            print(f"{count:>9,} {name:<13} schedule {elapsed / count * 1e9:>6,.0f}ns each  "
+                  f"{used / count:>5,.0f} bytes each  cancel {cancelled / (count // 2) * 1e9:>6,.0f}ns each  "
+                  f"fire {fired / count * 1e9:>6,.0f}ns CPU each")
+        # Drop the cancelled call_later handles before the next count.
+        await asyncio.sleep(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--counts", type=int, nargs="+", default=[100000, 500000])
+    parser.add_argument("--span", type=float, default=1.0)
+    args = parser.parse_args()
+    uvloop.install()
+    asyncio.run(run(args.counts, args.span))
+
+
+if __name__ == "__main__":
+    main()
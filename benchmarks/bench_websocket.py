@@ -0,0 +1,159 @@
+"""
+Portal WebSocket connections against telnet ones, with many clients at once.
+
+    python -m benchmarks.bench_websocket [--clients 1000] [--rounds 20]
+
+Runs a real MudListener for each protocol whose service echoes every line straight back, with
+no link or server behind it. A child process opens --clients connections, and once they're all
+up, each one sends --rounds lines, one at a time, waiting for the echo before sending the next.
+Reports round trips per second, round trip percentiles, and the CPU time the portal side spent
+per round trip, which is the number that matters: client overhead lives in the other process.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import time
+
+from collections import Counter
+
+import orjson
+import uvloop
+import websockets
+
+from athanor.shared import MudProtocol, ConnectionInMessageType, ConnectionOutMessage, ConnectionOutMessageType
+from athanor.utils import EventBuffer
+from athanor_portal.net import MudListener
+
+PORT = 7990
+
+
+class EchoService:
+    """
+    Stands in for NetService, the link and the server: echoes lines back on the next pass of the
+    event loop, as a batch, the way the link would deliver them.
+    """
+
+    def __init__(self):
+        self.in_conn_events = EventBuffer(self.wake)
+        self.mudconnections = dict()
+        self.id_prefix = "bench:"
+        self.ready_delay = 0.05
+        self.reuse_port = False
+        self.write_threshold = 64 * 1024
+        self.max_output_buffer = 4 * 1024 * 1024
+        self.response_time = None
+        self.drops = Counter()
+        self.scheduled = False
+
+    def wake(self):
+        if not self.scheduled:
+            self.scheduled = True
+            asyncio.get_event_loop().call_soon(self.echo)
+
+    def echo(self):
+        self.scheduled = False
+        events = list(self.in_conn_events)
+        self.in_conn_events.clear()
+        for ev in events:
+            if ev.msg_type != ConnectionInMessageType.GAMEDATA:
+                continue
+            if (conn := self.mudconnections.get(ev.client_id, None)):
+                out = [("line", (f"echo: {args[0]}",), dict()) for cmd, args, kwargs in ev.data]
+                conn.process_out_event(ConnectionOutMessage(ConnectionOutMessageType.GAMEDATA, ev.client_id, out))
+
+
+async def telnet_client(rounds: int, start: asyncio.Event, rtts: list):
+    reader, writer = await asyncio.open_connection("localhost", PORT)
+    await start.wait()
+    buffer = b""
+    for i in range(rounds):
+        expected = f"echo: ping {i}".encode()
+        sent = time.perf_counter()
+        writer.write(f"ping {i}\r\n".encode())
+        while expected not in buffer:
+            buffer += await reader.read(65536)
+        rtts.append(time.perf_counter() - sent)
+        buffer = buffer[buffer.index(expected) + len(expected):]
+    writer.close()
+
+
+async def websocket_client(rounds: int, start: asyncio.Event, rtts: list, compression):
+    async with websockets.connect(f"ws://localhost:{PORT}/", compression=compression) as ws:
+        await start.wait()
+        for i in range(rounds):
+            expected = f"echo: ping {i}"
+            sent = time.perf_counter()
+            await ws.send(orjson.dumps(["line", [f"ping {i}"], {}]).decode())
+            while True:
+                if any(args[0] == expected for cmd, args, kwargs in orjson.loads(await ws.recv())):
+                    break
+            rtts.append(time.perf_counter() - sent)
+
+
+async def run_clients(protocol: str, clients: int, rounds: int, queue):
+    start = asyncio.Event()
+    rtts = list()
+    if protocol == "telnet":
+        coros = [telnet_client(rounds, start, rtts) for _ in range(clients)]
+    else:
+        coros = [websocket_client(rounds, start, rtts, "deflate" if protocol == "websocket+deflate" else None)
+                 for _ in range(clients)]
+    tasks = [asyncio.create_task(coro) for coro in coros]
+    # Let them all connect, and telnet ones get past the ready delay.
+    await asyncio.sleep(1.0 + clients / 1000)
+    queue.put("ready")
+    began = time.perf_counter()
+    start.set()
+    await asyncio.gather(*tasks)
+    queue.put((time.perf_counter() - began, rtts))
+
+
+def client_process(protocol: str, clients: int, rounds: int, queue):
+    uvloop.install()
+    asyncio.run(run_clients(protocol, clients, rounds, queue))
+
+
+async def measure(protocol: str, clients: int, rounds: int):
+    service = EchoService()
+    listener_protocol = MudProtocol.TELNET if protocol == "telnet" else MudProtocol.WEBSOCKET
+    options = {"compression": protocol == "websocket+deflate"}
+    listener = MudListener(service, protocol, "localhost", PORT, listener_protocol, websocket=options)
+    await listener.async_setup()
+    if listener_protocol == MudProtocol.TELNET:
+        await listener.server.start_serving()
+
+    loop = asyncio.get_running_loop()
+    queue = multiprocessing.get_context("spawn").Queue()
+    proc = multiprocessing.get_context("spawn").Process(target=client_process, args=(protocol, clients, rounds, queue))
+    proc.start()
+    await loop.run_in_executor(None, queue.get)
+    cpu = time.process_time()
+    elapsed, rtts = await loop.run_in_executor(None, queue.get)
+    cpu = time.process_time() - cpu
+    await loop.run_in_executor(None, proc.join)
+
+    listener.server.close()
+    await listener.server.wait_closed()
+    rtts.sort()
+    count = len(rtts)
+    print(f"{protocol:<18} {clients:>6,} clients  {count / elapsed:>9,.0f} round trips/sec  "
+          f"p50 {rtts[count // 2] * 1000:>7.2f}ms  p99 {rtts[int(count * 0.99)] * 1000:>7.2f}ms  "
+          f"portal CPU {cpu / count * 1e6:>6.1f}us per round trip")
+
+
+async def run(clients: int, rounds: int):
+    for protocol in ("telnet", "websocket", "websocket+deflate"):
+        await measure(protocol, clients, rounds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    uvloop.install()
+    asyncio.run(run(args.clients, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
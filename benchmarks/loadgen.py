@@ -0,0 +1,534 @@
+"""
+Load generator: many synthetic telnet clients against a real Portal and Server, end to end.
+
+    python -m benchmarks.loadgen [--clients 200] [--duration 10] [--rate 2] [--kinds mudlet,tintin,telnet]
+                                 [--script FILE | --journal DIR [--speed 1]] [--ramp 1] [--procs 1]
+                                 [--connect HOST:PORT | --port 7980 --link unix --record DIR]
+
+By default this starts a Portal and a Server of its own, on localhost, from a scratch profile
+whose Server runs EchoConnection: every line a client sends comes back as "echo: <line>". What's
+measured is the whole trip, through Portal, link and Server and back. --connect aims the clients
+at a Portal that's already running instead; its Server has to echo the same way.
+
+Each client negotiates the way a real one of its kind would: mudlet and tintin answer MTTS, send
+their window size with NAWS and take MCCP2 compression; telnet ignores negotiation entirely.
+Input is either a --script of lines (a built-in one if not given), which every client works
+through at --rate lines per second, or the sessions in a --journal directory, each replayed by
+one client with its original timing, --speed times faster. Point --journal at one process's
+journal, not both ends', or every session turns up twice. --record journals the run's link
+traffic to a directory, for replaying later.
+
+Clients connect spread over --ramp seconds, and send their first line as soon as they're
+connected. The Portal holds it until the connection's ready, so the rest are timed from when it
+comes back. Reports, across all clients: time to connect (to the Portal's first negotiation),
+time to the first echo (which includes the Portal's ready delay), input-to-output latency
+percentiles, and throughput. Lines the Portal drops, such as those over a per-connection
+lines_per_sec limit if one is configured, are counted as lost. --procs spreads the clients over that many
+processes, for when one can't keep up with them.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+from collections import deque, Counter
+from typing import Dict, List, Optional, Tuple
+
+import uvloop
+
+from mudtelnet import TC, TelnetFrameType
+
+from athanor.journal import list_segments, read_events
+from athanor.launcher import AthanorLauncher
+from athanor.shared import ConnectionInMessage, ConnectionInMessageType
+from athanor_portal.telnet import next_frame
+from athanor_server.conn import Connection
+
+# How each kind of client introduces itself. ttype is what it answers successive MTTS requests
+# with, naws its window size, and mccp2 whether it accepts compression.
+CLIENT_KINDS = {
+    "mudlet": {"ttype": ("MUDLET 4.17.2", "XTERM-256COLOR", "MTTS 2317"), "naws": (120, 40), "mccp2": True},
+    "tintin": {"ttype": ("TINTIN++ 2.02.20", "XTERM-256COLOR", "MTTS 2825"), "naws": (160, 50), "mccp2": True},
+    "telnet": {"ttype": (), "naws": None, "mccp2": False},
+}
+
+DEFAULT_SCRIPT = ("look", "say Hello, everyone!", "inventory", "north", "score", "who", "emote waves.", "south")
+
+_IAC_SE = bytes([TC.IAC, TC.SE])
+
+PORTAL_CONFIG = """from athanor_portal.config import Config as PortalConfig
+
+
+class Config(PortalConfig):
+    def _config_listeners(self):
+        self.listeners["telnet"] = {{"interface": "localhost", "port": {port}, "protocol": 0}}
+
+    def _config_link(self):
+        super()._config_link()
+        self.link["transport"] = {link!r}
+"""
+
+SERVER_CONFIG = """from athanor_server.config import Config as ServerConfig
+
+
+class Config(ServerConfig):
+    def _config_classes(self):
+        super()._config_classes()
+        self.classes["game"]["connection"] = "benchmarks.loadgen.EchoConnection"
+
+    def _config_link(self):
+        super()._config_link()
+        self.link["transport"] = {link!r}
+
+    def _config_journal(self):
+        super()._config_journal()
+        self.journal["enabled"] = {record}
+        self.journal["path"] = {record_path!r}
+"""
+
+
+class EchoConnection(Connection):
+    """
+    Sends every line straight back, as "echo: <line>". What the Server runs under the load
+    generator, so that clients can time their input all the way to its output.
+    """
+
+    async def on_process_event(self, ev: ConnectionInMessage):
+        if ev.msg_type == ConnectionInMessageType.GAMEDATA:
+            for cmd, args, kwargs in ev.data:
+                if cmd == "line" and args:
+                    self.out_gamedata.append(("line", (f"echo: {args[0]}",), dict()))
+
+
+class Stats:
+    """
+    What one process's clients saw. Plain lists and numbers, so it can be sent back to the parent.
+    """
+
+    def __init__(self):
+        self.connect: List[float] = list()
+        self.first_echo: List[float] = list()
+        self.latency: List[float] = list()
+        self.sent: int = 0
+        self.lost: int = 0
+        self.failed: int = 0
+        self.bytes_in: int = 0
+        self.bytes_out: int = 0
+        self.kinds = Counter()
+        self.began: float = 0.0
+        self.ended: float = 0.0
+
+    def merge(self, other: "Stats"):
+        self.connect.extend(other.connect)
+        self.first_echo.extend(other.first_echo)
+        self.latency.extend(other.latency)
+        self.sent += other.sent
+        self.lost += other.lost
+        self.failed += other.failed
+        self.bytes_in += other.bytes_in
+        self.bytes_out += other.bytes_out
+        self.kinds.update(other.kinds)
+        self.began = min(self.began, other.began) if self.began else other.began
+        self.ended = max(self.ended, other.ended)
+
+
+class SyntheticClient:
+    """
+    One telnet client. Answers negotiation the way its kind would, sends each of its lines when
+    it's due, and times how long each takes to come back echoed.
+
+    Args:
+        kind (str): A key of CLIENT_KINDS.
+        lines (list): (seconds after connecting, text) for every line to send, in order.
+        stats (Stats): Where to record what happens.
+    """
+
+    def __init__(self, kind: str, lines: List[Tuple[float, str]], stats: Stats):
+        self.kind = kind
+        self.options = CLIENT_KINDS[kind]
+        self.lines = lines
+        self.stats = stats
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.started: float = 0.0
+        self.connected: bool = False
+        # Set by the first echo.
+        self.ready = asyncio.Event()
+        # (text, perf_counter it was sent at) for every line not yet echoed.
+        self.waiting = deque()
+        self.done_sending: bool = False
+        self.all_echoed = asyncio.Event()
+        # Negotiation already answered, so that nothing's answered twice.
+        self.answered = set()
+        self.ttype_count: int = 0
+        self.text = bytearray()
+
+    async def run(self, host: str, port: int, drain: float):
+        self.stats.kinds[self.kind] += 1
+        self.started = time.perf_counter()
+        try:
+            reader, self.writer = await asyncio.open_connection(host, port)
+        except OSError:
+            self.stats.failed += 1
+            return
+        read_task = asyncio.create_task(self.read(reader))
+        try:
+            base = self.started
+            for i, (offset, text) in enumerate(self.lines):
+                if i == 1:
+                    # The Portal holds input until the connection's ready, and a recorded session's
+                    # timing starts from then too. So the rest are paced from the first echo.
+                    try:
+                        await asyncio.wait_for(self.ready.wait(), drain)
+                    except asyncio.TimeoutError:
+                        break
+                    base = time.perf_counter() - self.lines[0][0]
+                if (delay := base + offset - time.perf_counter()) > 0:
+                    await asyncio.sleep(delay)
+                if read_task.done():
+                    break
+                self.send_line(text)
+            self.done_sending = True
+            if self.waiting and not read_task.done():
+                try:
+                    await asyncio.wait_for(self.all_echoed.wait(), drain)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.stats.lost += len(self.waiting)
+            self.waiting.clear()
+            read_task.cancel()
+            self.writer.close()
+
+    def write(self, data: bytes):
+        self.stats.bytes_out += len(data)
+        self.writer.write(data)
+
+    def send_line(self, text: str):
+        self.waiting.append((text, time.perf_counter()))
+        self.stats.sent += 1
+        self.write(text.encode() + b"\r\n")
+
+    async def read(self, reader: asyncio.StreamReader):
+        buffer = bytearray()
+        decompressor = None
+        while (data := await reader.read(65536)):
+            if not self.connected:
+                self.connected = True
+                self.stats.connect.append(time.perf_counter() - self.started)
+            self.stats.bytes_in += len(data)
+            buffer.extend(decompressor.decompress(data) if decompressor else data)
+            pos = 0
+            while True:
+                frame, pos = next_frame(buffer, pos)
+                if not frame:
+                    break
+                if frame.msg_type == TelnetFrameType.DATA:
+                    self.text.extend(frame.data)
+                elif frame.msg_type == TelnetFrameType.NEGOTIATION:
+                    self.negotiate(*frame.data)
+                elif frame.msg_type == TelnetFrameType.SUBNEGOTIATION:
+                    option, payload = frame.data
+                    if option == TC.MCCP2 and decompressor is None:
+                        # Everything after this is compressed, including what's already arrived.
+                        decompressor = zlib.decompressobj()
+                        rest = decompressor.decompress(bytes(buffer[pos:]))
+                        buffer.clear()
+                        buffer.extend(rest)
+                        pos = 0
+                    elif option == TC.MTTS and payload[:1] == b"\x01":
+                        self.send_ttype()
+            del buffer[:pos]
+            if self.text:
+                self.process_text()
+
+    def negotiate(self, command: int, option: int):
+        options = self.options
+        if not options["ttype"] and not options["naws"] and not options["mccp2"]:
+            # A bare telnet client, which doesn't answer at all.
+            return
+        if (command, option) in self.answered:
+            return
+        self.answered.add((command, option))
+        if command == TC.DO:
+            if option == TC.MTTS and options["ttype"]:
+                self.write(bytes([TC.IAC, TC.WILL, option]))
+            elif option == TC.NAWS and options["naws"]:
+                width, height = options["naws"]
+                self.write(bytes([TC.IAC, TC.WILL, option]))
+                self.write(bytes([TC.IAC, TC.SB, option]) + width.to_bytes(2, "big") + height.to_bytes(2, "big")
+                           + _IAC_SE)
+            else:
+                self.write(bytes([TC.IAC, TC.WONT, option]))
+        elif command == TC.WILL:
+            if (option == TC.MCCP2 and options["mccp2"]) or option == TC.SGA:
+                self.write(bytes([TC.IAC, TC.DO, option]))
+            else:
+                self.write(bytes([TC.IAC, TC.DONT, option]))
+
+    def send_ttype(self):
+        ttype = self.options["ttype"]
+        # Past the end of the list, real clients repeat the last one.
+        name = ttype[min(self.ttype_count, len(ttype) - 1)]
+        self.ttype_count += 1
+        self.write(bytes([TC.IAC, TC.SB, TC.MTTS, 0]) + name.encode() + _IAC_SE)
+
+    def process_text(self):
+        text = self.text
+        end = text.rfind(b"\n")
+        if end == -1:
+            return
+        now = time.perf_counter()
+        waiting = self.waiting
+        stats = self.stats
+        for line in text[:end].split(b"\n"):
+            if not line.startswith(b"echo: "):
+                continue
+            echoed = line[6:].rstrip(b"\r").decode(errors="replace")
+            # Lines the Portal dropped never come back. Skip past them to the one that did.
+            while waiting:
+                sent_text, sent = waiting.popleft()
+                if sent_text == echoed:
+                    # The first line waits out the Portal's ready delay, so it's timed apart.
+                    if self.ready.is_set():
+                        stats.latency.append(now - sent)
+                    else:
+                        self.ready.set()
+                        stats.first_echo.append(now - self.started)
+                    break
+                stats.lost += 1
+        del text[:end + 1]
+        if self.done_sending and not waiting:
+            self.all_echoed.set()
+
+
+def scripted_lines(script: List[str], rate: float, duration: float, start: int) -> List[Tuple[float, str]]:
+    """
+    A client's lines for a script: one every 1/rate seconds for duration seconds, going round
+    the script from line start, so that clients aren't all saying the same thing at once.
+    """
+    count = max(1, int(duration * rate))
+    return [(i / rate, script[(start + i) % len(script)]) for i in range(count)]
+
+
+def load_sessions(path: str) -> List[List[Tuple[float, str]]]:
+    """
+    The input lines of every session recorded in a journal directory, with when each was sent
+    relative to that session's first.
+    """
+    sessions: Dict[str, List[Tuple[float, str]]] = dict()
+    for segment in list_segments(path):
+        for timestamp, ev in read_events(segment):
+            if not isinstance(ev, ConnectionInMessage) or ev.msg_type != ConnectionInMessageType.GAMEDATA:
+                continue
+            for cmd, args, kwargs in ev.data:
+                if cmd == "line" and args:
+                    sessions.setdefault(ev.client_id, list()).append((timestamp, args[0]))
+    return [[(t - lines[0][0], text) for t, text in lines] for lines in sessions.values()]
+
+
+def client_plans(args, sessions) -> List[Tuple[str, List[Tuple[float, str]]]]:
+    """
+    The kind and lines of every client.
+    """
+    kinds = args.kinds.split(",")
+    if sessions is None:
+        if args.script:
+            with open(args.script) as f:
+                script = [line.rstrip("\n") for line in f if line.strip()]
+        else:
+            script = list(DEFAULT_SCRIPT)
+    plans = list()
+    for i in range(args.clients):
+        if sessions is not None:
+            lines = [(t / args.speed, text) for t, text in sessions[i % len(sessions)] if t / args.speed < args.duration]
+        else:
+            lines = scripted_lines(script, args.rate, args.duration, i)
+        plans.append((kinds[i % len(kinds)], lines))
+    return plans
+
+
+async def run_clients(host: str, port: int, plans, ramp: float, drain: float) -> Stats:
+    stats = Stats()
+
+    async def start(i, kind, lines):
+        await asyncio.sleep(ramp * i / len(plans))
+        await SyntheticClient(kind, lines, stats).run(host, port, drain)
+
+    stats.began = time.time()
+    await asyncio.gather(*[start(i, kind, lines) for i, (kind, lines) in enumerate(plans)])
+    stats.ended = time.time()
+    return stats
+
+
+def client_process(host: str, port: int, plans, ramp: float, drain: float, queue):
+    uvloop.install()
+    queue.put(asyncio.run(run_clients(host, port, plans, ramp, drain)))
+
+
+def run_processes(host: str, port: int, plans, args) -> Stats:
+    """
+    Runs the clients in args.procs processes, every one starting at once.
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    procs = list()
+    for p in range(args.procs):
+        share = plans[p::args.procs]
+        proc = context.Process(target=client_process, args=(host, port, share, args.ramp, args.drain, queue))
+        proc.start()
+        procs.append(proc)
+    stats = Stats()
+    for _ in procs:
+        stats.merge(queue.get())
+    for proc in procs:
+        proc.join()
+    return stats
+
+
+class ScratchGame:
+    """
+    A Portal and a Server of our own, started from a throwaway profile and stopped afterwards.
+    """
+
+    def __init__(self, port: int, link: str, record: Optional[str]):
+        self.port = port
+        self.profile = tempfile.mkdtemp(prefix="athanor-loadgen-")
+        self.procs: List[subprocess.Popen] = list()
+        appdata = os.path.join(self.profile, "appdata")
+        os.makedirs(appdata)
+        os.makedirs(os.path.join(self.profile, "logs"))
+        files = {
+            "__init__.py": "",
+            "portal.py": PORTAL_CONFIG.format(port=port, link=link),
+            "server.py": SERVER_CONFIG.format(link=link, record=bool(record),
+                                              record_path=os.path.abspath(record) if record else "journal"),
+        }
+        for name, text in files.items():
+            with open(os.path.join(appdata, name), "w") as f:
+                f.write(text)
+
+    def start(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        for app in ("portal", "server"):
+            env = os.environ.copy()
+            env["ATHANOR_PROFILE"] = self.profile
+            env["ATHANOR_APPNAME"] = app
+            # So the Server can import EchoConnection from here.
+            env["PYTHONPATH"] = os.pathsep.join(filter(None, (root, env.get("PYTHONPATH", None))))
+            with open(os.path.join(self.profile, "logs", f"{app}.out"), "w") as out:
+                self.procs.append(subprocess.Popen([sys.executable, AthanorLauncher.startup], env=env,
+                                                   stdout=out, stderr=subprocess.STDOUT))
+
+    def output(self) -> str:
+        text = list()
+        for app in ("portal", "server"):
+            with open(os.path.join(self.profile, "logs", f"{app}.out")) as f:
+                text.append(f"--- {app} ---\n{f.read()}")
+        return "\n".join(text)
+
+    def stop(self):
+        for proc in self.procs:
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGTERM)
+        for proc in self.procs:
+            try:
+                proc.wait(5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        shutil.rmtree(self.profile, ignore_errors=True)
+
+
+async def wait_for_echo(host: str, port: int, timeout: float) -> bool:
+    """
+    Keeps trying one client until a line comes back echoed, which means the Portal's listening,
+    the link's up and the Server echoes.
+    """
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        stats = Stats()
+        await SyntheticClient("telnet", [(0.0, "ping")], stats).run(host, port, 2.0)
+        if stats.first_echo:
+            return True
+        await asyncio.sleep(0.2)
+    return False
+
+
+def describe(name: str, values: List[float]) -> str:
+    if not values:
+        return f"{name:<12} -"
+    values.sort()
+    count = len(values)
+    parts = [f"{label} {values[min(count - 1, int(count * p))] * 1000:>8.2f}ms"
+             for label, p in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))]
+    return f"{name:<12} {'  '.join(parts)}  max {values[-1] * 1000:>8.2f}ms  ({count:,})"
+
+
+def report(stats: Stats, args):
+    elapsed = stats.ended - stats.began
+    kinds = ", ".join(f"{kind} {count}" for kind, count in sorted(stats.kinds.items()))
+    print(f"{args.clients:,} clients ({kinds}) over {elapsed:.1f}s, {args.procs} client process(es)")
+    print(describe("connect", stats.connect))
+    print(describe("first echo", stats.first_echo))
+    print(describe("latency", stats.latency))
+    print(f"{'throughput':<12} {stats.sent / elapsed:>10,.0f} lines/sec sent  "
+          f"{(len(stats.latency) + len(stats.first_echo)) / elapsed:>10,.0f} echoed  {stats.lost:,} lost  {stats.failed:,} failed connections")
+    print(f"{'wire':<12} {stats.bytes_out / elapsed / 1024:>10,.1f} KiB/sec out  "
+          f"{stats.bytes_in / elapsed / 1024:>10,.1f} KiB/sec in")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds each client sends for.")
+    parser.add_argument("--rate", type=float, default=2.0, help="Lines per second per client, for scripts.")
+    parser.add_argument("--kinds", default="mudlet,tintin,telnet", help=f"Any of {', '.join(CLIENT_KINDS)}.")
+    parser.add_argument("--script", help="File of lines to send, one per line.")
+    parser.add_argument("--journal", help="Journal directory to replay the sessions of.")
+    parser.add_argument("--speed", type=float, default=1.0, help="How much faster than recorded to replay.")
+    parser.add_argument("--ramp", type=float, default=1.0, help="Seconds to spread connecting over.")
+    parser.add_argument("--drain", type=float, default=5.0, help="Seconds to wait for the last echoes.")
+    parser.add_argument("--procs", type=int, default=1, help="Processes to run the clients in.")
+    parser.add_argument("--connect", help="HOST:PORT of a running Portal, instead of starting one.")
+    parser.add_argument("--port", type=int, default=7980, help="Port for the Portal we start.")
+    parser.add_argument("--link", default="unix", help="Link transport for the Portal and Server we start.")
+    parser.add_argument("--record", help="Directory for the Server we start to journal to.")
+    args = parser.parse_args()
+    if (unknown := set(args.kinds.split(",")) - set(CLIENT_KINDS)):
+        parser.error(f"Unknown client kinds: {', '.join(sorted(unknown))}")
+
+    sessions = None
+    if args.journal:
+        if not (sessions := load_sessions(args.journal)):
+            parser.error(f"No sessions with input in {args.journal}")
+        print(f"Replaying {len(sessions):,} recorded sessions")
+    plans = client_plans(args, sessions)
+
+    game = None
+    if args.connect:
+        host, port = args.connect.rsplit(":", 1)
+        port = int(port)
+    else:
+        host, port = "localhost", args.port
+        game = ScratchGame(port, args.link, args.record)
+        game.start()
+    try:
+        uvloop.install()
+        if not asyncio.run(wait_for_echo(host, port, 15.0)):
+            if game:
+                print(game.output())
+            sys.exit(f"Nothing echoed by {host}:{port}. Is its Server running EchoConnection?")
+        report(run_processes(host, port, plans, args), args)
+    finally:
+        if game:
+            game.stop()
+
+
+if __name__ == "__main__":
+    main()
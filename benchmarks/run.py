@@ -0,0 +1,352 @@
+"""
+The hot path suite: one benchmark for each path every event, line or tick goes through, with
+saved baselines to compare later runs against.
+
+    python -m benchmarks.run [--filter TEXT] [--repeat 10] [--save [NAME]] [--compare [NAME]]
+                             [--threshold 10]
+
+Baselines are kept in .benchmarks/NAME.json ("baseline" if no NAME is given). --save stores
+this run's numbers in one, keeping what it has for benchmarks that didn't run; --compare reports every benchmark against one, marks those that got
+slower by more than --threshold percent, and exits non-zero if any did. Numbers only compare
+between runs on the same machine and Python, so a baseline records both and --compare warns when
+they differ.
+
+Every rate is the best of --repeat rounds, and the rounds go through all the benchmarks in turn,
+so a passing slowdown doesn't land on just one of them. A baseline also records the rate of a
+plain Python workload timed alongside them, and --compare scales every rate by how that's changed,
+so a machine that's slower across the board doesn't show up as regressions. The default
+threshold suits a quiet machine; on a shared or virtual one, where single benchmarks can swing by
+20% between runs, raise it. Use the bench_* scripts to look into any one of these properly.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import uvloop
+
+from athanor.app import Application, BaseConfig, Service
+from athanor.shared import LinkProtocol, LinkSession, LINK_CODECS, decode_frame
+from athanor.shared import ConnectionDetails, ConnectionInMessage, ConnectionInMessageType
+from athanor.shared import ConnectionOutMessage, ConnectionOutMessageType, PortalOutMessage, PortalOutMessageType
+from athanor.shared import ServerInMessage, ServerInMessageType
+from athanor.tasks import TaskMaster, TaskPool
+from athanor_portal.telnet import TelnetMudConnection
+
+from ._harness import Benchmark
+from .bench_telnet_parse import make_connection, chunks
+
+BASELINE_DIR = ".benchmarks"
+# The name the calibration workload's rate is saved under.
+CALIBRATION = "calibration"
+# Events per EVENTS message, and messages per batched link frame.
+EVENTS = 50
+BATCH = 16
+
+
+def link_protocol(in_message_class, codec: str) -> LinkProtocol:
+    app = SimpleNamespace(metrics=None, journal=None)
+    service = SimpleNamespace(app=app, in_message_class=in_message_class, outbox_size=0, session=LinkSession())
+    link = LinkProtocol(service, None, None)
+    link.codec = LINK_CODECS[codec]
+    link.batching = True
+    return link
+
+
+def in_events() -> List[ConnectionInMessage]:
+    events = [ConnectionInMessage(ConnectionInMessageType.GAMEDATA, f"portal:telnet_{i:020d}",
+                                  (("line", (f"say hello there, number {i}",), dict()),)) for i in range(EVENTS - 1)]
+    details = ConnectionDetails(client_id="portal:telnet_ready", client_name="MUDLET", width=120, height=40)
+    events.append(ConnectionInMessage(ConnectionInMessageType.READY, details.client_id, details))
+    return events
+
+
+def out_events() -> List[ConnectionOutMessage]:
+    return [ConnectionOutMessage(ConnectionOutMessageType.GAMEDATA, f"portal:telnet_{i:020d}",
+                                 [("line", (f"Room {i}\nA long, dusty corridor stretches north and south.",), dict()),
+                                  ("prompt", ("HP 100/100 > ",), dict())]) for i in range(EVENTS)]
+
+
+def link_round_trip(direction: str, codec: str):
+    """
+    What LinkProtocol.write() and process_message() do with a full batch: encode every message,
+    join them into one frame, and decode that frame at the other end.
+    """
+    if direction == "in":
+        sender, receive_class = link_protocol(PortalOutMessage, codec), ServerInMessage
+        messages = [ServerInMessage(ServerInMessageType.EVENTS, 1, in_events(), seq) for seq in range(1, BATCH + 1)]
+    else:
+        sender, receive_class = link_protocol(ServerInMessage, codec), PortalOutMessage
+        messages = [PortalOutMessage(PortalOutMessageType.EVENTS, 1, out_events(), seq) for seq in range(1, BATCH + 1)]
+    encode = sender.encode
+
+    def run():
+        frame = b"[" + b",".join([encode(msg) for msg in messages]) + b"]"
+        decode_frame(frame, receive_class)
+    return run
+
+
+def event_dicts():
+    """
+    The GAMEDATA events of in_events(), of which there are EVENTS - 1, through to_dict() and
+    back.
+    """
+    events = [ev for ev in in_events() if ev.msg_type == ConnectionInMessageType.GAMEDATA]
+
+    def run():
+        for ev in events:
+            ConnectionInMessage.from_dict(ev.to_dict())
+    return run
+
+
+def telnet_input(reads: List[bytes]):
+    def run():
+        conn = make_connection(TelnetMudConnection)
+        for data in reads:
+            conn.data_received(data)
+    return run
+
+
+# A player typing: short commands, an occasional window resize, arriving a line or two per read.
+NAWS = bytes([255, 250, 31, 0, 120, 0, 40, 255, 240])
+TYPING = [f"say line number {i}\r\n".encode() + (NAWS if i % 50 == 0 else b"") for i in range(2000)]
+# A paste, arriving in 64 KiB reads.
+PASTE = chunks(b"".join(f"{i:08d} {'x' * 69}\r\n".encode() for i in range(512 * 1024 // 80)))
+
+
+def telnet_output():
+    """
+    The server's output for one client, through conn_out_to_telnet_out() and the telnet encoder
+    into the write buffer. With write_threshold 0, each event is written out straight away.
+    """
+    conn = make_connection(TelnetMudConnection)
+    events = out_events()
+
+    def run():
+        for ev in events:
+            conn.process_out_event(ev)
+    return run
+
+
+class SuiteMaster(TaskMaster):
+    pool = None
+
+    def __init__(self):
+        super().__init__()
+        self.done: Optional[asyncio.Future] = None
+        self.remaining = 0
+
+    def get_task_pool(self):
+        return self.pool
+
+    async def run_task(self, task):
+        self.remaining -= 1
+        if not self.remaining:
+            self.done.set_result(True)
+
+
+def task_queue(loop: asyncio.AbstractEventLoop, masters: int, tasks: int, pool: bool, cleanups: list):
+    """
+    Queues tasks on every one of a set of running TaskMasters, and waits for them all to run.
+    """
+    async def start():
+        SuiteMaster.pool = TaskPool(16) if pool else None
+        if SuiteMaster.pool:
+            SuiteMaster.pool.start()
+        started = [SuiteMaster() for _ in range(masters)]
+        for master in started:
+            master.start()
+        await asyncio.sleep(0)
+        return started
+
+    started = loop.run_until_complete(start())
+    task_pool = SuiteMaster.pool
+
+    def stop():
+        for master in started:
+            master.stop(immediate=True)
+        if task_pool:
+            task_pool.stop()
+    cleanups.append(stop)
+
+    async def work():
+        for master in started:
+            master.done = loop.create_future()
+            master.remaining = tasks
+        for _ in range(tasks):
+            for master in started:
+                master.enqueue("tick")
+        for master in started:
+            await master.done
+
+    def run():
+        loop.run_until_complete(work())
+    return run
+
+
+class EveryTick(Service):
+    def update(self, now: float, delta: float):
+        pass
+
+
+class EveryTenTicks(EveryTick):
+    update_interval = 0.1
+
+
+def tick_loop(services: int):
+    """
+    Application.run_loop_once() with services of which a quarter update every tick, and the rest
+    every ten.
+    """
+    config = BaseConfig()
+    for i in range(services):
+        kind = "EveryTick" if i % 4 == 0 else "EveryTenTicks"
+        config.classes["services"][f"service{i}"] = f"benchmarks.run.{kind}"
+    app = Application(config)
+    app.setup()
+
+    def run():
+        app.tick += 1
+        app.run_loop_once(time.time(), app.interval)
+    return run
+
+
+def build(loop: asyncio.AbstractEventLoop, cleanups: list, name_filter: str = "") -> List[Benchmark]:
+    """
+    Sets up the benchmarks whose name contains name_filter, and only those, since some of them
+    start TaskMasters and pools.
+    """
+    suite = [
+        ("link: portal->server compact", lambda: link_round_trip("in", "compact"), EVENTS * BATCH, "events", 20),
+        ("link: portal->server json", lambda: link_round_trip("in", "json"), EVENTS * BATCH, "events", 2),
+        ("link: server->portal compact", lambda: link_round_trip("out", "compact"), EVENTS * BATCH, "events", 20),
+        ("link: server->portal json", lambda: link_round_trip("out", "json"), EVENTS * BATCH, "events", 2),
+        ("events: to_dict+from_dict", event_dicts, EVENTS - 1, "events", 20),
+        ("telnet in: typing", lambda: telnet_input(TYPING), sum(len(r) for r in TYPING), "bytes", 5),
+        ("telnet in: paste", lambda: telnet_input(PASTE), sum(len(r) for r in PASTE), "bytes", 2),
+        ("telnet out: process_out_event", telnet_output, EVENTS, "events", 100),
+        ("tasks: enqueue+run, task each", lambda: task_queue(loop, 100, 10, False, cleanups), 1000, "tasks", 20),
+        ("tasks: enqueue+run, pool", lambda: task_queue(loop, 100, 10, True, cleanups), 1000, "tasks", 20),
+        ("tick: run_loop_once, 200 services", lambda: tick_loop(200), 1, "ticks", 2000),
+    ]
+    return [Benchmark(name, make(), ops, unit, number)
+            for name, make, ops, unit, number in suite if name_filter in name]
+
+
+def baseline_path(name: str) -> str:
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def environment() -> Dict[str, str]:
+    return {"python": platform.python_version(), "implementation": platform.python_implementation(),
+            "machine": platform.machine(), "node": platform.node()}
+
+
+def save(name: str, rates: Dict[str, float]):
+    """
+    Stores rates in the named baseline. Benchmarks this run didn't include, because of --filter,
+    keep the rates the baseline already had for them, scaled by how the calibration changed so
+    that they're still comparable with the rest.
+    """
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = baseline_path(name)
+    if os.path.exists(path):
+        with open(path) as f:
+            kept = json.load(f).get("rates", dict())
+        if kept.get(CALIBRATION, None) and CALIBRATION in rates:
+            speed = rates[CALIBRATION] / kept[CALIBRATION]
+            kept = {bench: rate * speed for bench, rate in kept.items()}
+        rates = {**kept, **rates}
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "saved": time.strftime("%Y-%m-%d %H:%M:%S"), "rates": rates},
+                  f, indent=2, sort_keys=True)
+    print(f"Saved as {baseline_path(name)}")
+
+
+def load(name: str) -> dict:
+    with open(baseline_path(name)) as f:
+        baseline = json.load(f)
+    if baseline["environment"] != environment():
+        print(f"Warning: {name} was saved on {baseline['environment']}, not {environment()}.")
+    return baseline
+
+
+def calibration():
+    """
+    Plain Python, touching none of our code: dict and attribute access, calls, string building.
+    How fast this runs says how fast the machine is running right now.
+    """
+    items = [SimpleNamespace(name=f"item{i}", value=i) for i in range(200)]
+
+    def run():
+        index = dict()
+        for item in items:
+            index[item.name] = item.value * 2
+        return "".join(str(index[item.name]) for item in items)
+    return run
+
+
+def run_rounds(benchmarks: List[Benchmark], repeat: int) -> Dict[str, float]:
+    """
+    Times every benchmark once per round, round after round, so that anything slowing the
+    machine down for a while is spread across all of them. Keeps each one's best round.
+    """
+    rates = dict()
+    for _ in range(repeat):
+        for bench in benchmarks:
+            rates[bench.name] = max(rates.get(bench.name, 0.0), bench.run(1))
+    return rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this.")
+    parser.add_argument("--repeat", type=int, default=10, help="Timing rounds per benchmark.")
+    parser.add_argument("--save", nargs="?", const="baseline", help="Save the results as this baseline.")
+    parser.add_argument("--compare", nargs="?", const="baseline", help="Compare against this baseline.")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent slower that counts as a regression.")
+    args = parser.parse_args()
+
+    baseline = load(args.compare)["rates"] if args.compare else dict()
+    loop = uvloop.new_event_loop()
+    asyncio.set_event_loop(loop)
+    cleanups = list()
+    benchmarks = build(loop, cleanups, args.filter)
+    benchmarks.append(Benchmark(CALIBRATION, calibration(), 1, "runs", 200))
+    rates = run_rounds(benchmarks, args.repeat)
+    for stop in cleanups:
+        stop()
+    loop.run_until_complete(asyncio.sleep(0.01))
+    loop.close()
+
+    # Against a baseline, each rate is taken relative to the calibration's, so that a machine
+    # that's slower or faster across the board doesn't move the numbers.
+    speed = rates[CALIBRATION] / baseline[CALIBRATION] if CALIBRATION in baseline else 1.0
+    if args.compare:
+        print(f"Machine speed against {args.compare}: {speed:.2f}x, allowed for below.")
+    regressions = list()
+    for bench in benchmarks[:-1]:
+        rate = rates[bench.name]
+        line = f"{bench.name:<40} {rate:>14,.0f} {bench.unit}/sec"
+        if (old := baseline.get(bench.name, None)):
+            change = (rate / speed / old - 1) * 100
+            line += f"  {change:>+7.1f}%"
+            if change < -args.threshold:
+                line += "  REGRESSION"
+                regressions.append(bench.name)
+        print(line)
+
+    if args.save:
+        save(args.save, rates)
+    if regressions:
+        sys.exit(f"{len(regressions)} regression(s) past {args.threshold:g}%: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()